@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import sys
+from regex import FSM, RegexParser, LazyDFA
+from rulesparser import *
+from tools import Topology
+import constraints.manager as cmanager
+
+"""
+Static analysis of the path constraints, run before any probe is
+generated: a path expression is intersected with the switch paths the
+topology allows, and the expressions sharing a grouped condition are
+compared with each other.
+"""
+
+class PathAnalyzer:
+    """
+    Check path constraints against a topology
+    """
+    def __init__(self, topo, budget=100000):
+        self.topo = topo
+        self.budget = budget    # maximum DFA states, larger expressions are not analyzed
+        self.adj = {}           # node -> set of neighbours
+        self.dfas = {}          # path expression -> DFA (None if over budget)
+        self.walks = {}         # sorted source hosts -> topology DFA
+
+        for a in topo.edges:
+            for b in topo.edges[a]:
+                self.adj.setdefault(a, set()).add(b)
+                self.adj.setdefault(b, set()).add(a)
+
+    def topology_fsm(self, hosts):
+        """
+        DFA of the switch paths that a probe injected next to @hosts can
+        follow: it starts at a switch attached to one of the hosts, then
+        moves along switch-to-switch links and may stop anywhere
+        """
+        key = tuple(sorted(hosts))
+        if key in self.walks:
+            return self.walks[key]
+
+        switches = sorted([n for n in self.topo.nodes if self.topo.is_switch(n)])
+        ids = dict((s, i+1) for i, s in enumerate(switches))
+
+        fsm = FSM()
+        fsm.states[0] = {}
+        for h in hosts:
+            for s in self.adj.get(h, ()):
+                if self.topo.is_switch(s):
+                    fsm.states[0]['s'+str(s)] = [ids[s]]
+        for s in switches:
+            trans = {}
+            for n in self.adj.get(s, ()):
+                if self.topo.is_switch(n):
+                    trans['s'+str(n)] = [ids[n]]
+            fsm.states[ids[s]] = trans
+            fsm.accepting.append(ids[s])
+        fsm.dfa = True
+
+        self.walks[key] = fsm
+        return fsm
+
+    def get_dfa(self, expr):
+        if expr not in self.dfas:
+            dfa = RegexParser().create_fsm(expr, max_states=self.budget)
+            if isinstance(dfa, LazyDFA):
+                dfa = None
+            self.dfas[expr] = dfa
+        return self.dfas[expr]
+
+    def analyze(self, gc, src):
+        """
+        Analyze the path constraints of grouped condition @gc whose probes
+        are sent from the hosts @src. Return a tuple (unsat, implied):
+        @unsat lists the constraints no topology path can satisfy,
+        @implied lists (c1, c2) pairs where every topology path matching
+        c1 also matches c2
+        """
+        paths = []
+        for constr in gc.constr:
+            if cmanager.getinstance(id=constr.ctype).kw != 'path':
+                continue
+            dfa = self.get_dfa(constr.data['dpath'])
+            if dfa is not None:
+                paths.append((constr, dfa))
+
+        walks = self.topology_fsm(src)
+        unsat = []
+        feasible = []
+        for constr, dfa in paths:
+            reach = dfa.intersect(walks)
+            if reach.is_empty():
+                unsat.append(constr)
+            else:
+                feasible.append((constr, reach))
+
+        implied = []
+        for c1, r1 in feasible:
+            for c2, r2 in feasible:
+                if c1 is not c2 and r1.is_subset(r2):
+                    implied.append((c1, c2))
+
+        return unsat, implied
+
+    def check(self, gc, src):
+        """
+        Report the analysis of @gc on stderr and return False if no probe
+        needs to be sent for it: all its constraints are path constraints
+        that cannot be satisfied (probes could only confirm the failure)
+        """
+        unsat, implied = self.analyze(gc, src)
+
+        for constr in unsat:
+            sys.stderr.write('Warning: '+str(constr)+' cannot be satisfied on the topology\n')
+        for c1, c2 in implied:
+            sys.stderr.write('Note: '+str(c1)+' implies '+str(c2)+' on the topology\n')
+
+        for constr in gc.constr:
+            if constr not in unsat or float(constr.srate) <= 0:
+                return True
+        return False
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print 'Usage: %s <rules file> <topology file>' % (sys.argv[0])
+        sys.exit(-1)
+
+    reqs = RulesParser().parse(sys.argv[1])
+    pa = PathAnalyzer(Topology(sys.argv[2]))
+
+    for gc in reqs.conditions:
+        src = []
+        for c in gc.conds:
+            if c.source == 'Hs' and c.ctype == Condition.COND_EQUAL:
+                src.append(reqs.host_to_node(c.target))
+            elif c.source == 'Hs' and c.ctype == Condition.COND_ATOM:
+                for h in reqs.atoms[c.target]:
+                    src.append(reqs.host_to_node(h))
+        if len(src) == 0:
+            src = [n for n in pa.topo.nodes if not pa.topo.is_switch(n)]
+
+        if not pa.check(gc, src):
+            print 'Condition %d: no probe needed' % (gc.iid)
@@ -0,0 +1,1019 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import os, sys, re, struct, random, socket, threading, resource
+from time import time, sleep
+from Queue import Queue
+from optparse import OptionParser
+from regex import FSM, RegexParser, LazyDFA, MultiDFA
+from oflownet import *
+from oflowclient import OFlowClient
+from sessions import SessionPool
+from injector import Injector
+from ofstats import OFlowStats
+from flowtable import FlowTable
+from templates import ProbeTemplate, mac_bytes, ip_bytes
+from probeid import ProbeAllocator, ProbeIndex, split, join
+try:
+    from scapy.all import Ether, IP, UDP
+except ImportError: # templates only
+    Ether = None
+from emulator import Emulator, mac_to_bytes
+from tools import Topology, Mapping
+
+"""
+Micro-benchmarks for the performance sensitive parts of the tool chain.
+Each benchmark prints one line per problem size so that the scaling
+behaviour can be read directly from the output.
+"""
+
+def timeit(f, *args):
+    """ Run f(*args) once and return (elapsed seconds, result) """
+    t0 = time()
+    ret = f(*args)
+    return time() - t0, ret
+
+def union_nfa(branches, hops):
+    """
+    Epsilon-free NFA accepting the union of @branches explicit paths
+    of @hops switches each, as produced by path expressions that list
+    alternative routes through hundreds of switches
+    """
+    fsm = FSM()
+    nstate = 1
+    for b in range(branches):
+        cur = 0
+        for h in range(hops):
+            fsm.add_transition(cur, 's'+str(b*hops+h), nstate)
+            cur = nstate
+            nstate += 1
+        fsm.set_accepting([cur])
+    return fsm
+
+def kleene_chain_nfa(n):
+    """
+    Thompson NFA of '.*,s1,.*,s2,...,.*,sN', built directly to avoid the
+    parser overhead: every '.*' block contributes four epsilon edges
+    """
+    fsm = FSM()
+    entry = 0
+    for i in range(n):
+        b, c, f, nxt = entry+1, entry+2, entry+3, entry+4
+        fsm.add_transition(entry, FSM.epsilon, b)
+        fsm.add_transition(entry, FSM.epsilon, f)
+        fsm.add_transition(b, FSM.dot, c)
+        fsm.add_transition(c, FSM.epsilon, b)
+        fsm.add_transition(c, FSM.epsilon, f)
+        fsm.add_transition(f, 's'+str(i+1), nxt)
+        entry = nxt
+    fsm.set_accepting([entry])
+    return fsm
+
+def bench_remove_epsilon(scale):
+    print 'remove_epsilon: .*,s1,.*,s2,...,.*,sN'
+    print '%10s %10s %10s %12s' % ('N', 'eps edges', 'seconds', 'us/edge')
+    for n in [x*scale for x in [1250, 2500, 5000, 10000, 20000]]:
+        nfa = kleene_chain_nfa(n)
+        neps = 4*n
+        t, _ = timeit(nfa.remove_epsilon)
+        print '%10d %10d %10.4f %12.2f' % (n, neps, t, t*1e6/neps)
+
+    # Sanity check on the language (the DFA grows quadratically, keep it small)
+    nfa = kleene_chain_nfa(50)
+    nfa.remove_epsilon()
+    dfa = nfa.to_dfa()
+    path = []
+    for i in range(50):
+        path.extend(['s0', 's'+str(i+1)])
+    if dfa.process(path) is None or dfa.process(path[:-1]) is not None:
+        print 'remove_epsilon: language check FAILED'
+
+def bench_to_dfa(scale):
+    print 'to_dfa: union of explicit paths (8 hops each)'
+    print '%10s %10s %10s %12s' % ('branches', 'dfa', 'seconds', 'us/state')
+    for branches in [x*scale for x in [50, 100, 200, 400, 800, 1600]]:
+        nfa = union_nfa(branches, 8)
+        t, dfa = timeit(nfa.to_dfa)
+        n = dfa.state_size()
+        print '%10d %10d %10.4f %12.2f' % (branches, n, t, t*1e6/n)
+
+def bench_process(scale):
+    rng = random.Random(42)
+    parser = RegexParser()
+    dfa = parser.create_fsm('.*,s1,.,s2|s3,.*,s4,.,.,s5|s6,.*')
+    cdfa = dfa.compile()
+    print 'process: %d-state DFA, random paths of 12 hops' % (dfa.state_size())
+    print '%10s %12s %12s %10s' % ('paths', 'FSM (s)', 'compiled (s)', 'speedup')
+    for n in [x*scale for x in [1000, 10000, 100000]]:
+        paths = [['s'+str(rng.randint(1, 8)) for _ in range(12)] for _ in range(n)]
+        t1, r1 = timeit(lambda: [dfa.process(p) for p in paths])
+        t2, r2 = timeit(cdfa.process_many, paths)
+        if r1 != r2:
+            print 'process: result mismatch'
+        print '%10d %12.4f %12.4f %10.1f' % (n, t1, t2, t1/t2)
+
+def bench_lazy(scale):
+    print 'lazy: .*,s1,.,...,.,s2 with k dots, 10000 random paths of 30 hops'
+    rng = random.Random(42)
+    paths = [['s'+str(rng.randint(1, 4)) for _ in range(30)] for _ in range(10000*scale)]
+    print '%4s %10s %10s %10s %10s %10s' % ('k', 'eager dfa', 'eager (s)', 'lazy (s)', 'lazy dfa', 'evictions')
+    for k in [2, 4, 6, 8, 10, 12, 14]:
+        expr = '.*,s1,'+(k*'.,')+'s2'
+        parser = RegexParser()
+        t1, dfa = timeit(parser.create_fsm, expr, False, 1000)
+        if isinstance(dfa, LazyDFA):
+            eager = '%10s %10s' % ('>1000', '-')
+        else:
+            eager = '%10d %10.4f' % (dfa.state_size(), t1)
+        nfa = parser.create_fsm(expr, False, 0)
+        t2, r = timeit(nfa.process_many, paths)
+        print '%4d %s %10.4f %10d %10d' % (k, eager, t2, len(nfa.cache), nfa.evictions)
+
+def bench_multi(scale):
+    print 'multi: k path expressions on 20000 paths of 10 hops'
+    print '(postcards of one condition follow few routes: paths are drawn from R routes)'
+    rng = random.Random(42)
+    print '%4s %8s %14s %14s %10s' % ('k', 'R', 'per expr (s)', 'multi (s)', 'speedup')
+    for routes in [64, 20000*scale]:
+        allroutes = [['s'+str(rng.randint(1, 16)) for _ in range(10)] for _ in range(routes)]
+        paths = [rng.choice(allroutes) for _ in range(20000*scale)]
+        for k in [2, 4, 8, 16]:
+            cdfas = [RegexParser().create_fsm('.*,s%d,.*,s%d,.*' % (i+1, 16-i)).compile() for i in range(k)]
+            mdfa = MultiDFA(cdfas, range(k))
+            t1, _ = timeit(lambda: [c.process_many(paths) for c in cdfas])
+            t2, _ = timeit(mdfa.process_many, paths)
+            print '%4d %8d %14.4f %14.4f %10.1f' % (k, routes, t1, t2, t1/t2)
+
+def bench_parse(scale):
+    print 'parse: explicit paths of N hops, with and without .* between hops'
+    print '%8s %8s %10s %12s %12s %12s' % ('N', 'kleene', 'chars', 'parse (s)', 'nfa (s)', 'total (s)')
+    for n in [x*scale for x in [2500, 5000, 10000, 20000, 40000]]:
+        for sep in [',', ',.*,']:
+            expr = sep.join(['s'+str(i+1) for i in range(n)])
+            parser = RegexParser()
+            t1, ast = timeit(parser.parse, expr)
+            t2, _ = timeit(parser.translate_ast, ast)
+            if sep == ',':
+                t3, _ = timeit(parser.create_fsm, expr)
+            else:
+                # the DFA of .*,s1,.*,s2,... grows quadratically, stop at the NFA
+                t3 = float('nan')
+            print '%8d %8s %10d %12.4f %12.4f %12.4f' % (n, sep != ',', len(expr), t1, t2, t3)
+
+def forked(f, *args):
+    """
+    Run f(*args) in a child process and return (elapsed seconds, growth of
+    the peak RSS in kB) so that each measurement starts from the same
+    memory state
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t, _ = timeit(f, *args)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+        os.write(w, repr((t, rss)))
+        os._exit(0)
+    os.close(w)
+    data = os.read(r, 64)
+    os.close(r)
+    os.waitpid(pid, 0)
+    return eval(data)
+
+def epsilon_free_nfa(expr, method):
+    parser = RegexParser()
+    ast = parser.parse(expr)
+    if method == RegexParser.GLUSHKOV:
+        return parser.position_automaton(ast)
+    fsm = parser.translate_ast(ast)
+    fsm.remove_epsilon()
+    return fsm
+
+def bench_compile(scale):
+    print 'compile: Thompson + epsilon-removal vs position automaton'
+    print '(nfa: up to the epsilon-free NFA, dfa: full compilation without minimization)'
+    exprs = [
+        ('explicit path', lambda n: ','.join(['s'+str(i+1) for i in range(n)])),
+        ('waypoints', lambda n: ','.join(['.*,s'+str(i+1) for i in range(n)])),
+        ('unions', lambda n: ','.join(['s'+str(2*i+1)+'|s'+str(2*i+2)+'*' for i in range(n)])),
+    ]
+    print '%14s %6s %6s %12s %12s %12s %12s' % ('expression', 'N', 'stage', 'thompson (s)', 'glushkov (s)', 'thompson kB', 'glushkov kB')
+    for name, gen in exprs:
+        for n in [x*scale for x in [500, 1000, 2000, 4000]]:
+            if name == 'waypoints':
+                n /= 50 # DFA size grows quadratically
+            elif name == 'unions':
+                n /= 20 # so does the epsilon-free NFA (chains of nullable terms)
+            expr = gen(n)
+            t1, m1 = forked(epsilon_free_nfa, expr, RegexParser.THOMPSON)
+            t2, m2 = forked(epsilon_free_nfa, expr, RegexParser.GLUSHKOV)
+            print '%14s %6d %6s %12.4f %12.4f %12d %12d' % (name, n, 'nfa', t1, t2, m1, m2)
+            t1, m1 = forked(RegexParser().create_fsm, expr, False, None, RegexParser.THOMPSON)
+            t2, m2 = forked(RegexParser().create_fsm, expr, False, None, RegexParser.GLUSHKOV)
+            print '%14s %6d %6s %12.4f %12.4f %12d %12d' % (name, n, 'dfa', t1, t2, m1, m2)
+
+def bench_classes(scale):
+    print 'classes: .*,s1|...|sN,.*,sN|...|s2N vs .*,[s1-sN],.*,[sN-s2N]'
+    print '%6s %8s %10s %10s %10s %10s' % ('N', 'syntax', 'nfa', 'dfa edges', 'min edges', 'seconds')
+    for n in [x*scale for x in [8, 32, 128, 512]]:
+        unions = '.*,%s,.*,%s' % ('|'.join(['s'+str(i) for i in range(1, n+1)]),
+                                  '|'.join(['s'+str(i) for i in range(n, 2*n+1)]))
+        classes = '.*,[s1-s%d],.*,[s%d-s%d]' % (n, n, 2*n)
+        for name, expr in [('union', unions), ('class', classes)]:
+            parser = RegexParser()
+            t, dfa = timeit(parser.create_fsm, expr, False)
+            edges = sum([len(trans) for trans in dfa.states.itervalues()])
+            medges = sum([len(trans) for trans in dfa.minimize().states.itervalues()])
+            print '%6d %8s %10d %10d %10d %10.4f' % (n, name, parser.stats['nfa'], edges, medges, t)
+
+class LegacyHeader(object):
+    """
+    BinaryHeader as it was before the precompiled layouts (one regex per
+    field, one struct call per field when packing), kept for bench_ofp
+    """
+    def __init__(self, cls):
+        self.values = []
+        self.data = {}
+        for n, t in cls._fields:
+            if not t.endswith('x'):
+                self.add_value(n, t)
+        self.length = cls.length
+
+    def add_value(self, n, t):
+        self.values.append((n, t))
+        r = re.search('^[0-9]', t)
+        if r is not None:
+            self.data[n] = ''
+        else:
+            self.data[n] = 0
+
+    def set(self, n, v):
+        self.data[n] = v
+
+    def get(self, n):
+        return self.data[n]
+
+    def pack(self):
+        out = ''
+        for n, t in self.values:
+            out += struct.pack('>'+t, self.data[n])
+        return out
+
+    def read(self, data, count=0):
+        fmt = '>'
+        i = 0
+        for _, t in self.values:
+            if count > 0 and i >= count:
+                break
+            fmt += t
+            i += 1
+        rec = struct.unpack(fmt, data)
+        for i in range(len(rec)):
+            self.data[self.values[i][0]] = rec[i]
+
+def legacy_parse_stats_flow(msg):
+    """ parse_stats_flow before the precompiled layouts """
+    ofp_fwst = LegacyHeader(OFP_Flow_Stats)
+    ofp_match = LegacyHeader(OFP_Match)
+    ofp_action = LegacyHeader(OFP_Action_Header)
+
+    ofp_fwst.read(msg[:4]+msg[4+40:88])
+    ofp_match.read(msg[4:4+40])
+
+    plen = ofp_fwst.get('length')
+    rlen = 88
+    actions = []
+    while rlen < plen:
+        ofp_action.read(msg[rlen:rlen+ofp_action.length])
+        if ofp_action.get('type') == OFP_Action_Type.OFPAT_OUTPUT:
+            ofp_action_out = LegacyHeader(OFP_Action_Output)
+            ofp_action_out.read(msg[rlen:rlen+ofp_action_out.length])
+            actions.append(ofp_action_out)
+        rlen += ofp_action.get('len')
+    return plen, {"body": ofp_fwst, "match": ofp_match, "actions": actions}
+
+def flow_stats_body(n):
+    """ Body of an OFPST_FLOW reply with @n flows of two output actions """
+    body = []
+    for i in range(n):
+        fwst = OFP_Flow_Stats()
+        fwst.set('length', fwst.length + 2*OFP_Action_Output.length)
+        fwst.set('priority', i & 0xffff)
+        match = OFP_Match()
+        match.set('nw_dst', i)
+        buf = bytearray(fwst.length)
+        fwst.pack_into(buf)
+        match.pack_into(buf, 4)
+        body.append(str(buf))
+        for port in [1, 2]:
+            act = OFP_Action_Output()
+            act.set('type', OFP_Action_Type.OFPAT_OUTPUT)
+            act.set('len', act.length)
+            act.set('port', port)
+            body.append(act.pack())
+    return ''.join(body)
+
+def bench_ofp(scale):
+    print 'ofp: OpenFlow 1.0 headers, legacy BinaryHeader vs precompiled layouts'
+    print '%8s %10s %12s %12s %10s' % ('flows', 'operation', 'legacy (s)', 'struct (s)', 'speedup')
+    for n in [x*scale for x in [1000, 10000, 100000]]:
+        streply = OFP_Stats_Reply()
+        streply.set('type', OFP_Stats_Types.OFPST_FLOW)
+        msg = streply.pack() + flow_stats_body(n)
+
+        def legacy_parse():
+            offset = 4
+            flows = []
+            while offset < len(msg):
+                plen, flow = legacy_parse_stats_flow(msg[offset:])
+                flows.append(flow)
+                offset += plen
+            return flows
+
+        def parse():
+            ofnet = OFlowNet()
+            hdr = OFP_Header(OFP_Type.OFPT_STATS_REPLY, len(msg)+8)
+            ofnet.parse_stats(hdr, memoryview(msg))
+            return ofnet.flows
+
+        # the legacy slicing is quadratic in the reply size, measure it on
+        # at most 10000 flows and extrapolate linearly
+        m = min(n, 10000)
+        cut = OFP_Stats_Reply.length + m*(OFP_Flow_Stats.length + 2*OFP_Action_Output.length)
+        full = msg
+        msg = full[:cut]
+        t1, r1 = timeit(legacy_parse)
+        t1 *= float(n)/m
+        msg = full
+        t2, r2 = timeit(parse)
+        if [f['match'].get('nw_dst') for f in r1] != [f['match'].get('nw_dst') for f in r2[:m]]:
+            print 'ofp: parse mismatch'
+        print '%8d %10s %12.4f %12.4f %10.1f' % (n, 'parse', t1, t2, t1/t2)
+
+        def legacy_pack():
+            out = []
+            for flow in r1:
+                actpack = ''
+                for act in flow['actions']:
+                    actpack += act.pack()
+                fmod = LegacyHeader(OFP_Flow_Mod)
+                fmod.set('command', OFP_Flow_Mod_Command.OFPFC_MODIFY_STRICT)
+                fmod.set('priority', flow['body'].get('priority'))
+                body = flow['match'].pack() + fmod.pack() + actpack
+                hdr = LegacyHeader(OFP_Header)
+                hdr.set('type', OFP_Type.OFPT_FLOW_MOD)
+                hdr.set('length', len(body)+8)
+                out.append(hdr.pack()+body)
+            return out
+
+        def pack():
+            out = []
+            for flow in r2[:m]:
+                parts = [flow['match'], OFP_Flow_Mod()] + flow['actions']
+                parts[1].set('command', OFP_Flow_Mod_Command.OFPFC_MODIFY_STRICT)
+                parts[1].set('priority', flow['body'].get('priority'))
+                length = OFP_Header.length + sum([h.length for h in parts])
+                buf = bytearray(length)
+                OFP_Header(OFP_Type.OFPT_FLOW_MOD, length).pack_into(buf)
+                offset = OFP_Header.length
+                for h in parts:
+                    h.pack_into(buf, offset)
+                    offset += h.length
+                out.append(buf)
+            return out
+
+        t1, p1 = timeit(legacy_pack)
+        t2, p2 = timeit(pack)
+        if [str(x)[8:] for x in p1] != [str(x)[8:] for x in p2]:
+            print 'ofp: pack mismatch'
+        print '%8d %10s %12.4f %12.4f %10.1f' % (m, 'flow_mod', t1, t2, t1/t2)
+
+flow_stats_chunks = {} # flow count -> reply body
+
+def serve_flow_stats(sock, n, per_reply=500, delay=0):
+    """
+    Answer the flow stats request read on @sock with @n flows, split in
+    multipart replies of @per_reply flows, as a switch would after @delay
+    seconds. Other messages are ignored
+    """
+    req = OFP_Header()
+    while req.get('type') != OFP_Type.OFPT_STATS_REQUEST:
+        req.read(sock.recv(OFP_Header.length, socket.MSG_WAITALL))
+        if req.get('length') > OFP_Header.length:
+            sock.recv(req.get('length') - OFP_Header.length, socket.MSG_WAITALL)
+    if delay > 0:
+        sleep(delay)
+    send_flow_stats(sock, req.get('xid'), n, per_reply)
+
+def send_flow_stats(sock, xid, n, per_reply=500):
+    """ Send the multipart replies of @n flows to the flow stats request @xid """
+    chunk = flow_stats_chunks.get(per_reply)
+    if chunk is None:
+        chunk = flow_stats_body(per_reply)
+        flow_stats_chunks[per_reply] = chunk
+    flen = len(chunk)/per_reply
+    sent = 0
+    while sent < n:
+        k = min(per_reply, n - sent)
+        sent += k
+        streply = OFP_Stats_Reply()
+        streply.set('type', OFP_Stats_Types.OFPST_FLOW)
+        if sent < n:
+            streply.set('flags', OFP_Stats_Reply_Flags.OFPSF_REPLY_MORE)
+        body = streply.pack() + chunk[:k*flen]
+        hdr = OFP_Header(OFP_Type.OFPT_STATS_REPLY, len(body)+OFP_Header.length)
+        hdr.set('xid', xid)
+        sock.sendall(hdr.pack()+body)
+
+def dump_table(n, stream):
+    """ Fetch a table of @n flows from a local fake switch, return the flow count """
+    a, b = socket.socketpair()
+    switch = threading.Thread(target=serve_flow_stats, args=(a, n))
+    switch.start()
+    ofnet = OFlowNet()
+    ofnet.sock = b
+    count = 0
+    if stream:
+        for flow in ofnet.iter_flows():
+            count += 1
+    else:
+        # all the parts kept in memory, as run() does for a single reply
+        ofnet.dump_flows()
+        more = True
+        while more:
+            hdr, msg = ofnet.recv()
+            ofnet.parse_stats(hdr, msg)
+            more = OFP_Stats_Reply.length <= len(msg) and struct.unpack_from('>H', msg, 2)[0] & OFP_Stats_Reply_Flags.OFPSF_REPLY_MORE
+        count = len(ofnet.flows)
+    switch.join()
+    a.close()
+    b.close()
+    return count
+
+def default_probe():
+    """ Placeholder Ether/IP/UDP probe of protocols/default.py, as serialized by scapy """
+    ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 28, 0, 0, 64, 17, 0, '\0'*4, '\0'*4)
+    return '\0'*12 + '\x08\x00' + ip + struct.pack('>HHHH', 0, 64242, 8, 0x4242)
+
+def bench_probeid(scale):
+    print 'probeid: N probes (10 per source/destination pair), traces merged by random 16-bit ids vs allocated ids, and index lookups'
+    print '%8s %12s %12s %12s %12s' % ('probes', 'random', 'allocated', 'alloc (s)', 'lookup (s)')
+    for n in [x*scale for x in [1000, 100000, 1000000]]:
+        ids = set([random.getrandbits(16) for i in range(n)])
+
+        def allocate():
+            probes = ProbeAllocator()
+            for i in range(n/10):
+                probes.allocate(i % 100, i/100, i % 100 + 1, 10)
+            return probes
+
+        t1, probes = timeit(allocate)
+        pids = set()
+        for pid in xrange(probes.next):
+            pids.add(join(*split(pid)))
+
+        def lookup():
+            index = probes.index
+            for pid in xrange(probes.next):
+                index.gcid(pid)
+
+        t2, _ = timeit(lookup)
+        print '%8d %12d %12d %12.4f %12.4f' % (n, n - len(ids), probes.next - len(pids), t1, t2)
+
+def bench_probes(scale):
+    print 'probes: N default probes, scapy packets vs patched templates'
+    print '%8s %12s %12s %10s' % ('probes', 'scapy (s)', 'template (s)', 'speedup')
+    mapping = [('10.0.%d.%d' % (i >> 8, i & 0xff), '00:00:00:00:%02x:%02x' % (i >> 8, i & 0xff)) for i in range(256)]
+    template = ProbeTemplate(default_probe())
+    for n in [x*scale for x in [1000, 10000, 100000]]:
+        def scapy_probes():
+            pkts = []
+            for i in range(n):
+                sip, smac = mapping[i & 0xff]
+                dip, dmac = mapping[(i >> 8) & 0xff]
+                p = Ether(src=smac, dst=dmac)/IP(src=sip, dst=dip, id=i & 0xffff)/UDP(dport=64242, sport=i*7 & 0xffff, chksum=0x4242)
+                pkts.append(str(p))
+            return pkts
+
+        def template_probes():
+            pkts = []
+            addrs = [(ip_bytes(ip), mac_bytes(mac)) for ip, mac in mapping]
+            for i in range(n):
+                sip, smac = addrs[i & 0xff]
+                dip, dmac = addrs[(i >> 8) & 0xff]
+                pkts.append(template.build(smac, dmac, sip, dip, i & 0xffff, i*7 & 0xffff))
+            return pkts
+
+        t2, pkts = timeit(template_probes)
+        if Ether is None:
+            print '%8d %12s %12.4f %10s' % (n, 'n/a', t2, 'n/a')
+            continue
+        t1, ref = timeit(scapy_probes)
+        if ref != pkts:
+            print 'probes: templates differ from scapy packets'
+        print '%8d %12.4f %12.4f %9.1fx' % (n, t1, t2, t1/t2)
+
+def bench_flowstats(scale):
+    print 'flowstats: multipart flow table dump (500 flows per reply)'
+    print '%8s %12s %12s %12s %12s' % ('flows', 'list (s)', 'iter (s)', 'list kB', 'iter kB')
+    for n in [x*scale for x in [10000, 50000, 200000]]:
+        if dump_table(1000, True) != 1000 or dump_table(1000, False) != 1000:
+            print 'flowstats: flow count mismatch'
+        t1, m1 = forked(dump_table, n, False)
+        t2, m2 = forked(dump_table, n, True)
+        print '%8d %12.4f %12.4f %12d %12d' % (n, t1, t2, m1, m2)
+
+def build_flows(body, columnar):
+    """ Flows of the stats reply @body, as a FlowTable or a list of parse_flow dicts """
+    if columnar:
+        table = FlowTable()
+        table.add_stats(body)
+        return table
+    ofnet = OFlowNet()
+    flows = []
+    offset = 0
+    while offset < len(body):
+        plen, flow = ofnet.parse_flow(body, offset)
+        flows.append(flow)
+        offset += plen
+    return flows
+
+def bench_flowtable(scale):
+    print 'flowtable: flows as parse_flow dicts vs columnar FlowTable, and flows to port 2 by scan vs index'
+    print '%8s %12s %12s %12s %12s %12s %12s' % ('flows', 'dicts (s)', 'table (s)', 'dicts kB', 'table kB', 'scan (s)', 'index (s)')
+    for n in [x*scale for x in [10000, 50000, 200000]]:
+        body = flow_stats_body(n)
+        t1, m1 = forked(build_flows, body, False)
+        t2, m2 = forked(build_flows, body, True)
+
+        flows = build_flows(body, False)
+        table = build_flows(body, True)
+        t3, scan = timeit(lambda: [f for f in flows if 2 in [a.get('port') for a in f['actions']]])
+        t4, rows = timeit(table.with_out_port, 2)
+        if len(scan) != len(rows):
+            print 'flowtable: %d flows found by scan, %d by index' % (len(scan), len(rows))
+        print '%8d %12.4f %12.4f %12d %12d %12.6f %12.6f' % (n, t1, t2, m1, m2, t3, t4)
+
+def bench_client(scale):
+    print 'client: flow tables of N switches (100 flows, 20ms to answer)'
+    print '%6s %14s %14s %10s' % ('N', 'sequential (s)', 'concurrent (s)', 'speedup')
+    for n in [x*scale for x in [10, 50, 200]]:
+        pairs = [socket.socketpair() for _ in range(n)]
+        switches = [threading.Thread(target=serve_flow_stats, args=(a, 100, 500, 0.02)) for a, _ in pairs]
+        for th in switches:
+            th.start()
+
+        def sequential():
+            for _, b in pairs:
+                ofnet = OFlowNet()
+                ofnet.sock = b
+                if len(list(ofnet.iter_flows())) != 100:
+                    print 'client: flow count mismatch'
+
+        t1, _ = timeit(sequential)
+        for th in switches:
+            th.join()
+
+        pairs = [socket.socketpair() for _ in range(n)]
+        switches = [threading.Thread(target=serve_flow_stats, args=(a, 100, 500, 0.02)) for a, _ in pairs]
+        for th in switches:
+            th.start()
+
+        def concurrent():
+            client = OFlowClient()
+            client.start()
+            requests = [client.attach(b).request_flows() for _, b in pairs]
+            for f in requests:
+                if len(f.result()) != 100:
+                    print 'client: flow count mismatch'
+            client.stop()
+
+        t2, _ = timeit(concurrent)
+        for th in switches:
+            th.join()
+        print '%6d %14.4f %14.4f %10.1f' % (n, t1, t2, t1/t2)
+
+def serve_flow_mods(sock, fail_every=10):
+    """
+    Apply the flow modifications read on @sock as a switch would, failing
+    one in @fail_every with an OFPT_ERROR, and answer barrier requests
+    """
+    ofnet = OFlowNet()
+    ofnet.sock = sock
+    count = 0
+    try:
+        for hdr, msg in ofnet.messages():
+            if hdr.get('type') == OFP_Type.OFPT_FLOW_MOD:
+                count += 1
+                if count % fail_every == 0:
+                    ofp_error = OFP_Error()
+                    ofp_error.set('type', OFP_Error_Type.OFPET_FLOW_MOD_FAILED)
+                    body = ofp_error.pack() + hdr.pack() + msg[:56].tobytes()
+                    err = OFP_Header(OFP_Type.OFPT_ERROR, OFP_Header.length+len(body))
+                    err.set('xid', hdr.get('xid'))
+                    sock.sendall(err.pack()+body)
+            elif hdr.get('type') == OFP_Type.OFPT_BARRIER_REQUEST:
+                reply = OFP_Header(OFP_Type.OFPT_BARRIER_REPLY, OFP_Header.length)
+                reply.set('xid', hdr.get('xid'))
+                sock.sendall(reply.pack())
+    except (RuntimeError, socket.error):
+        pass
+
+def bench_flowmods(scale):
+    print 'flowmods: N flow modifications with per-flow error report (1 in 10 fails)'
+    print '%8s %16s %12s %10s' % ('flows', 'synchronous (s)', 'batched (s)', 'speedup')
+    match = OFP_Match()
+    match.set('wildcards', OFP_Flow_Wildcards.OFPFW_ALL)
+    flow_mod = OFP_Flow_Mod()
+    flow_mod.set('command', OFP_Flow_Mod_Command.OFPFC_MODIFY_STRICT)
+    act = OFP_Action_Output()
+    act.set('type', OFP_Action_Type.OFPAT_OUTPUT)
+    act.set('len', act.length)
+    for n in [x*scale for x in [1000, 10000, 50000]]:
+        mods = [(match, flow_mod, [act])]*n
+        results = []
+
+        def synchronous(ofnet):
+            # one message at a time, waiting for its barrier to know its fate
+            report = []
+            for m in mods:
+                xid = ofnet.mod_flow(*m)
+                ofnet.wait_barrier(ofnet.barrier())
+                report.extend(ofnet.flow_mod_errors([xid]))
+            return report
+
+        def batched(ofnet):
+            return ofnet.mod_flows(mods)
+
+        times = []
+        for f in (synchronous, batched):
+            a, b = socket.socketpair()
+            th = threading.Thread(target=serve_flow_mods, args=(a,))
+            th.daemon = True
+            th.start()
+            ofnet = OFlowNet()
+            ofnet.sock = b
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w') # silence parse_error
+            try:
+                t, report = timeit(f, ofnet)
+            finally:
+                sys.stdout = stdout
+            b.close()
+            th.join()
+            times.append(t)
+            if len(report) != n or len([e for e in report if e is not None]) != n/10:
+                print 'flowmods: wrong error report'
+        print '%8d %16.4f %12.4f %10.1f' % (n, times[0], times[1], times[0]/times[1])
+
+def serve_hooking(sock, n):
+    """
+    Answer the flow stats request read on @sock with @n flows while
+    reading the flow modifications, as a switch would, and answer barrier
+    requests
+    """
+    replies = Queue() # (function, args) run by the writer, so that reading never blocks
+    def write():
+        while True:
+            f, args = replies.get()
+            if f is None:
+                return
+            f(*args)
+
+    writer = threading.Thread(target=write)
+    writer.daemon = True
+    writer.start()
+    ofnet = OFlowNet()
+    ofnet.sock = sock
+    try:
+        for hdr, msg in ofnet.messages():
+            if hdr.get('type') == OFP_Type.OFPT_STATS_REQUEST:
+                replies.put((send_flow_stats, (sock, hdr.get('xid'), n)))
+            elif hdr.get('type') == OFP_Type.OFPT_BARRIER_REQUEST:
+                reply = OFP_Header(OFP_Type.OFPT_BARRIER_REPLY, OFP_Header.length)
+                reply.set('xid', hdr.get('xid'))
+                replies.put((sock.sendall, (reply.pack(),)))
+    except (RuntimeError, socket.error):
+        pass
+    replies.put((None, None))
+    writer.join()
+
+def hook_table(n):
+    """ Hook a fake switch of @n flows with Generator.hook_switch, return the hooked flow count """
+    from generator import Generator # needs scapy, unlike the other benchmarks
+    gen = Generator()
+    gen.topo, _ = linear_network(1)
+    gen.set_collector(1000)
+    a, b = socket.socketpair()
+    th = threading.Thread(target=serve_hooking, args=(a, n))
+    th.daemon = True
+    th.start()
+    ofnet = OFlowNet()
+    ofnet.sock = b
+    report, unchanged = gen.hook_switch(1, ofnet)
+    b.close()
+    th.join()
+    a.close()
+    return len([r for r in report if r[1] is None])
+
+def bench_hook(scale):
+    print 'hook: flow table of N flows hooked from a fake switch (500 flows per reply), against a FlowTable of the whole table'
+    print '%8s %12s %12s %12s' % ('flows', 'hook (s)', 'hook kB', 'table kB')
+    if hook_table(1000) != 1000:
+        print 'hook: flow count mismatch'
+    for n in [x*scale for x in [10000, 50000, 200000]]:
+        t1, m1 = forked(hook_table, n)
+        _, m2 = forked(build_flows, flow_stats_body(n), True)
+        print '%8d %12.4f %12d %12d' % (n, t1, m1, m2)
+
+class PacketOutSink:
+    """
+    Local fake OpenFlow agent counting the packet-outs it receives on
+    any number of connections
+    """
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(128)
+        self.port = self.server.getsockname()[1]
+        self.count = 0
+        self.connections = 0
+        th = threading.Thread(target=self.accept)
+        th.daemon = True
+        th.start()
+
+    def accept(self):
+        while True:
+            sock, _ = self.server.accept()
+            self.connections += 1
+            th = threading.Thread(target=self.serve, args=(sock,))
+            th.daemon = True
+            th.start()
+
+    def serve(self, sock):
+        sock.sendall(OFP_Header(OFP_Type.OFPT_HELLO, OFP_Header.length).pack())
+        ofnet = OFlowNet()
+        ofnet.sock = sock
+        try:
+            for hdr, msg in ofnet.messages():
+                if hdr.get('type') == OFP_Type.OFPT_PACKET_OUT:
+                    self.count += 1
+        except (RuntimeError, socket.error):
+            sock.close()
+
+class SinkMapping:
+    """ Mapping of every switch to a PacketOutSink """
+    def __init__(self, sink):
+        self.sink = sink
+
+    def get_data(self, node):
+        return ('127.0.0.1', None, self.sink.port)
+
+def bench_sessions(scale):
+    print 'sessions: N packet-outs spread over 10 switches'
+    print '%8s %16s %12s %10s' % ('packets', 'per packet (s)', 'pool (s)', 'speedup')
+    for n in [x*scale for x in [100, 1000, 5000]]:
+        sink = PacketOutSink()
+        pkt = 'x'*64
+
+        def per_packet():
+            for i in range(n):
+                ofnet = OFlowNet()
+                ofnet.connect('127.0.0.1', sink.port)
+                ofnet.handshake()
+                ofnet.packet_out(0, pkt)
+                ofnet.disconnect()
+
+        def pooled():
+            pool = SessionPool(SinkMapping(sink))
+            for i in range(n):
+                pool.packet_out(i % 10, 0, pkt)
+            pool.close()
+
+        t1, _ = timeit(per_packet)
+        t2, _ = timeit(pooled)
+        sleep(0.2)
+        if sink.count != 2*n:
+            print 'sessions: %d packets received out of %d' % (sink.count, 2*n)
+        print '%8d %16.4f %12.4f %10.1f' % (n, t1, t2, t1/t2)
+
+def bench_injector(scale):
+    print 'injector: N packet-outs spread over 10 switches, sequential vs scheduler (unlimited, then capped at half the unlimited rate)'
+    print '%8s %12s %12s %12s %12s %12s' % ('packets', 'seq (pps)', 'sched (pps)', 'target', 'capped (pps)', 'max switch')
+    for n in [x*scale for x in [1000, 10000, 50000]]:
+        sink = PacketOutSink()
+        pkt = 'x'*64
+
+        pool = SessionPool(SinkMapping(sink))
+        def sequential():
+            for i in range(n):
+                pool.packet_out(i % 10, 0, pkt)
+        t1, _ = timeit(sequential)
+
+        rates = []
+        for rate in [None, n/t1/2]:
+            injector = Injector(pool, rate)
+            for i in range(n):
+                injector.add(i % 10, pkt)
+            injector.run()
+            r = injector.report()
+            if r['sent'] != n:
+                print 'injector: %d packets sent out of %d' % (r['sent'], n)
+            rates.append(r)
+        pool.close()
+        capped = rates[1]
+        print '%8d %12.0f %12.0f %12.0f %12.0f %12.0f' % (n, n/t1, rates[0]['rate'], capped['target'], capped['rate'],
+                                                        max([s['rate'] for s in capped['switches'].values()]))
+
+def linear_network(k, cid=1000):
+    """ Topology and mapping of k switches in line, hosts 100 and 101 at the ends, collector on every switch """
+    topo = Topology()
+    mapping = Mapping()
+    for i in range(1, k+1):
+        topo.add_node(i, True)
+        topo.add_node(cid, False)
+        topo.add_edge(i, cid)
+        topo.set_port(i, cid, 1)
+        if i > 1:
+            topo.add_edge(i, i-1)
+            topo.set_port(i, i-1, 2)
+            topo.set_port(i-1, i, 3)
+    for h, s in ((100, 1), (101, k)):
+        topo.add_node(h, False)
+        topo.add_edge(s, h)
+        topo.set_port(s, h, 4)
+        mapping.mapping[h] = ('10.0.0.%d' % (h), '02:00:00:00:00:%02x' % (h), 0)
+    return topo, mapping
+
+def hook_emulated(ofnet, node, port):
+    """ Hooking of Generator.hook_switch: a postcard to @port after each output """
+    mods = []
+    for flow in ofnet.iter_flows():
+        tag_actions = []
+        for act in flow['actions']:
+            if act.get('type') == OFP_Action_Type.OFPAT_OUTPUT:
+                ofp_mod_dl_dst = OFP_Action_Mod_Dl_Dst()
+                ofp_mod_dl_dst.set('type', OFP_Action_Type.OFPAT_SET_DL_DST)
+                ofp_mod_dl_dst.set('len', ofp_mod_dl_dst.length)
+                ofp_mod_dl_dst.set('dl_dst', struct.pack('>HHH', 0x4242, node, act.get('port')))
+                ofp_act_out = OFP_Action_Output()
+                ofp_act_out.set('type', OFP_Action_Type.OFPAT_OUTPUT)
+                ofp_act_out.set('len', ofp_act_out.length)
+                ofp_act_out.set('port', port)
+                ofp_act_out.set('max_len', 256)
+                tag_actions.extend([ofp_mod_dl_dst, ofp_act_out])
+        ofp_flow_mod = OFP_Flow_Mod()
+        ofp_flow_mod.set('command', OFP_Flow_Mod_Command.OFPFC_MODIFY_STRICT)
+        ofp_flow_mod.set('priority', flow['body'].get('priority'))
+        ofp_flow_mod.set('buffer_id', 0xffffffff)
+        ofp_flow_mod.set('out_port', OFP_Port_No.OFPP_NONE)
+        mods.append((flow['match'], ofp_flow_mod, flow['actions'] + tag_actions))
+    return ofnet.mod_flows(mods)
+
+class CountingSink:
+    """ Postcard sink of an Emulator, waiting for a number of postcards """
+    def __init__(self):
+        self.count = 0
+        self.cond = threading.Condition()
+
+    def __call__(self, dpid, frame):
+        with self.cond:
+            self.count += 1
+            self.cond.notify_all()
+
+    def wait(self, n, timeout=30):
+        end = time() + timeout
+        with self.cond:
+            while self.count < n and time() < end:
+                self.cond.wait(end - time())
+            return self.count >= n
+
+def bench_emulator(scale):
+    print 'emulator: probes through K emulated switches in line, hooked, one postcard per hop'
+    print '%4s %8s %12s %14s %14s' % ('K', 'probes', 'hook (s)', 'postcards/s', 'latency (ms)')
+    for k in [2, 5, 10]:
+        n = 2000*scale
+        topo, mapping = linear_network(k)
+        sink = CountingSink()
+        emu = Emulator(topo, mapping, 1000, sink)
+        emu.start()
+        pool = SessionPool(emu)
+
+        t0 = time()
+        for node in emu.switches:
+            report = pool.run(node, lambda ofnet: hook_emulated(ofnet, node, topo.get_port(node, 1000)))
+            if len([e for e in report if e is not None]) > 0:
+                print 'emulator: hooking failed on s%d' % (node)
+        thook = time() - t0
+
+        frame = mac_to_bytes(mapping.get_mac(101)) + mac_to_bytes(mapping.get_mac(100)) + '\x08\x00'
+        frame += struct.pack('>BBHHHBBH4s4s', 0x45, 0, 28+16, 0, 0, 64, 17, 0, socket.inet_aton('10.0.0.100'), socket.inet_aton('10.0.0.101'))
+        frame += struct.pack('>HHHH', 4242, 4242, 8+16, 0x4242) + 'x'*16
+
+        # throughput: probes pipelined on the connection of the first switch
+        t0 = time()
+        for i in range(n):
+            pool.packet_out(1, 4, frame)
+        if not sink.wait(n*k):
+            print 'emulator: %d postcards out of %d' % (sink.count, n*k)
+        tput = n*k/(time() - t0)
+
+        # latency: one probe at a time, until its last postcard
+        m = 200
+        base = sink.count
+        t0 = time()
+        for i in range(1, m+1):
+            pool.packet_out(1, 4, frame)
+            sink.wait(base + i*k)
+        lat = (time() - t0)/m*1000
+
+        pool.close()
+        emu.stop()
+        if emu.delivered != n + m:
+            print 'emulator: %d probes delivered out of %d' % (emu.delivered, n+m)
+        print '%4d %8d %12.4f %14.0f %14.3f' % (k, n, thook, tput, lat)
+
+def serve_echo(sock):
+    """ Answer the echo requests read on @sock """
+    ofnet = OFlowNet()
+    ofnet.sock = sock
+    try:
+        for hdr, msg in ofnet.messages():
+            reply = OFP_Header(OFP_Type.OFPT_ECHO_REPLY, hdr.get('length'))
+            reply.set('xid', hdr.get('xid'))
+            sock.sendall(reply.pack()+msg.tobytes())
+    except (RuntimeError, socket.error):
+        pass
+
+def bench_ofstats(scale):
+    print 'ofstats: N echo round trips, without and with channel instrumentation'
+    print '%8s %12s %12s %10s' % ('echoes', 'off (s)', 'on (s)', 'overhead')
+    for n in [x*scale for x in [1000, 10000, 50000]]:
+        times = []
+        for stats in (None, OFlowStats().switch('s1')):
+            a, b = socket.socketpair()
+            th = threading.Thread(target=serve_echo, args=(a,))
+            th.daemon = True
+            th.start()
+            ofnet = OFlowNet(stats)
+            ofnet.sock = b
+
+            def echoes():
+                for i in range(n):
+                    ofnet.echo()
+                    ofnet.recv()
+
+            t, _ = timeit(echoes)
+            times.append(t)
+            b.close()
+            th.join()
+        if stats.rtt['echo'].count != n:
+            print 'ofstats: %d round trips recorded out of %d' % (stats.rtt['echo'].count, n)
+        print '%8d %12.4f %12.4f %9.1f%%' % (n, times[0], times[1], (times[1]/times[0] - 1)*100)
+
+benchmarks = {
+    'classes': bench_classes,
+    'client': bench_client,
+    'compile': bench_compile,
+    'emulator': bench_emulator,
+    'flowmods': bench_flowmods,
+    'flowstats': bench_flowstats,
+    'flowtable': bench_flowtable,
+    'hook': bench_hook,
+    'injector': bench_injector,
+    'lazy': bench_lazy,
+    'multi': bench_multi,
+    'ofp': bench_ofp,
+    'ofstats': bench_ofstats,
+    'parse': bench_parse,
+    'probeid': bench_probeid,
+    'probes': bench_probes,
+    'process': bench_process,
+    'remove_epsilon': bench_remove_epsilon,
+    'sessions': bench_sessions,
+    'to_dfa': bench_to_dfa,
+}
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] [benchmark ...]")
+    parser.add_option("-s", "--scale", dest="scale", metavar="N", default="1", help="Multiply problem sizes by N, default=1")
+    parser.add_option("-l", "--list", dest="list", action="store_true", default=False, help="List available benchmarks")
+    options, args = parser.parse_args()
+
+    if options.list:
+        for name in sorted(benchmarks):
+            print name
+        sys.exit(0)
+
+    if len(args) == 0:
+        args = sorted(benchmarks)
+
+    for name in args:
+        if name not in benchmarks:
+            parser.error("Unknown benchmark "+name)
+        benchmarks[name](int(options.scale))
+        print
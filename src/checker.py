@@ -4,24 +4,27 @@
 @author: David Lebrun <dav.lebrun@gmail.com>
 """
 
-import sys
+import os, sys
 from rulesparser import *
 from regex import *
 from tools import *
 import simplejson as json
 import constraints.manager as cmanager
+import pathcache
+from probeid import ProbeIndex
 
 class Checker:
     """
     Main checker class.
     """
-    def __init__(self, rules=None, topo=None, mapping=None, trace=None):
+    def __init__(self, rules=None, topo=None, mapping=None, trace=None, cache=None, budget=None, probes=None):
         self.reqs = None        # Requirements class, generated from the rules
         self.rawtrace = None    # collected traces
         self.trace = {}         # reconstructed packets
         self.gc = {}            # grouped conditions
         self.mapping = None     # static mapping
         self.topo = None        # topology
+        self.probes = None      # ProbeIndex of the generator, else the conditions found by the collector are used
 
         if rules is not None:
             self.reqs = RulesParser().parse(rules)
@@ -32,9 +35,18 @@ class Checker:
         if mapping is not None:
             self.mapping = Mapping(mapping)
 
+        if probes is not None:
+            self.probes = ProbeIndex(probes)
+
         if trace is not None:
             self.load_trace(trace)
 
+        if cache is not None:
+            pathcache.set_store(cache) # persist compiled path expressions
+
+        if budget is not None:
+            pathcache.set_budget(budget) # DFA states before lazy matching
+
     def load_trace(self, fname):
         f = open(fname, 'r')
         data = f.readlines()
@@ -49,7 +61,13 @@ class Checker:
         for pkt in self.rawtrace:
             print 'Processing packet '+str(pkt)
             if pkt['id'] not in self.trace:
-                td = TraceData(pkt['src'], pkt['dst'], pkt['gcid'], pktid=pkt['id']) # create a new packet
+                gcid = pkt['gcid']
+                if self.probes is not None:
+                    gcid = self.probes.gcid(pkt['id'])
+                    if gcid is None:
+                        sys.stderr.write('Unknown probe id %d, skipping packet\n' % (pkt['id']))
+                        continue
+                td = TraceData(pkt['src'], pkt['dst'], gcid, pktid=pkt['id']) # create a new packet
                 td.path.append(pkt['switch']) # append path
                 td.ts = 0
                 td.lastts = pkt['ts']
@@ -77,9 +95,23 @@ class Checker:
                 data = []
             else:
                 data = self.gc[gc.iid]
+
+            # Constraints of the same type sharing this condition are verified
+            # together when the handler supports it (one pass per trace)
+            bytype = {}
             for constr in gc.constr:
-                inst = cmanager.getinstance(id=constr.ctype) # fetch constraint instance
-                inst.verify(constr, data, mapping=self.mapping, topo=self.topo) # actual verification
+                if constr.ctype not in bytype:
+                    bytype[constr.ctype] = [constr]
+                else:
+                    bytype[constr.ctype].append(constr)
+
+            for ctype in bytype:
+                inst = cmanager.getinstance(id=ctype) # fetch constraint instance
+                if hasattr(inst, 'verify_many'):
+                    inst.verify_many(bytype[ctype], data, mapping=self.mapping, topo=self.topo)
+                else:
+                    for constr in bytype[ctype]:
+                        inst.verify(constr, data, mapping=self.mapping, topo=self.topo) # actual verification
 
         """
         Iterate over groups and check if they are verified.
@@ -121,10 +153,21 @@ def dump_constr(constr):
 
 if __name__ == "__main__":
     if len(sys.argv) < 5:
-        print 'Usage: %s <rules file> <topology file> <mapping file> <trace file>' % (sys.argv[0])
+        print 'Usage: %s <rules file> <topology file> <mapping file> <trace file> [path cache dir|-] [probe index, default=probes.json]' % (sys.argv[0])
+        sys.exit(-1)
+
+    cache = None
+    if len(sys.argv) > 5 and sys.argv[5] != '-':
+        cache = sys.argv[5]
+
+    probes = 'probes.json'
+    if len(sys.argv) > 6:
+        probes = sys.argv[6]
+    if not os.path.exists(probes):
+        print 'Missing probe index %s, see generator -p' % (probes)
         sys.exit(-1)
 
-    c = Checker(rules=sys.argv[1], topo=sys.argv[2], mapping=sys.argv[3], trace=sys.argv[4])
+    c = Checker(rules=sys.argv[1], topo=sys.argv[2], mapping=sys.argv[3], trace=sys.argv[4], cache=cache, probes=probes)
     c.reassemble_packets()
 
     for t in c.trace:
@@ -132,6 +175,7 @@ if __name__ == "__main__":
 
     cnt = c.verify()
     print 'There are %d unmatched constraints.' % (cnt)
+    pathcache.dump()
 
     for constr in c.reqs.constraints:
         if constr.ctype == Constraint.CONSTR_GROUP:
@@ -4,43 +4,78 @@
 @author: David Lebrun <dav.lebrun@gmail.com>
 """
 
-import sys, time
+import os, sys, time, socket
 from scapy.all import *
 import simplejson as json
 from optparse import OptionParser
+from probeid import ProbeIndex, join
 
 class Collector:
     """
     Main collector class
     """
-    def __init__(self):
+    def __init__(self, probes):
         self.pkts = [] # collected traces
+        self.probes = probes # ProbeIndex of the generator, maps the probe ids to their condition
 
     def callback(self, pkt):
         """ Just store the packet with ts in order to minimize processing time """
         self.pkts.append((time.time(), pkt))
 
     def collect(self, tm):
-        trace = []
         sniff(filter="not arp", timeout=tm, prn=self.callback)
-
+        return self.decode()
+
+    def collect_udp(self, tm, port):
+        """
+        Collect the postcards sent as UDP datagrams to the local @port
+        (see emulator -u) instead of sniffing them
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', port))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        frames = []
+        end = time.time() + tm
+        while True:
+            left = end - time.time()
+            if left <= 0:
+                break
+            sock.settimeout(left)
+            try:
+                frames.append((time.time(), sock.recv(65535)))
+            except socket.timeout:
+                break
+        sock.close()
+
+        for ts, data in frames:
+            self.pkts.append((ts, Ether(data)))
+        return self.decode()
+
+    def decode(self):
+        """ Build the trace from the collected postcards """
+        trace = []
         for ts, p in self.pkts:
             s = p.sprintf("{Ether:%Ether.dst%}/{IP:%IP.src%;%IP.dst%;%IP.id%;%IP.proto%}")
             data = s.split('/')
             mac = data[0].split(":")
 
-            # Extract data from destination MAC
-            b1 = ((int(mac[0], base=16) & 0xff) << 8 | (int(mac[1], base=16) & 0xff)) & 0xffff  # magic
-            b2 = ((int(mac[2], base=16) & 0xff) << 8 | (int(mac[3], base=16) & 0xff)) & 0xffff  # switch ID
-            b3 = ((int(mac[4], base=16) & 0xff) << 8 | (int(mac[5], base=16) & 0xff)) & 0xffff  # output port
+            if Dot1Q in p:
+                # OpenFlow 1.3 postcard: switch ID in the VLAN tag, output port unknown
+                b2 = p[Dot1Q].vlan
+                b3 = None
+            else:
+                # Extract data from destination MAC
+                b1 = ((int(mac[0], base=16) & 0xff) << 8 | (int(mac[1], base=16) & 0xff)) & 0xffff  # magic
+                b2 = ((int(mac[2], base=16) & 0xff) << 8 | (int(mac[3], base=16) & 0xff)) & 0xffff  # switch ID
+                b3 = ((int(mac[4], base=16) & 0xff) << 8 | (int(mac[5], base=16) & 0xff)) & 0xffff  # output port
 
-            if b1 != 0x4242:
-                sys.stderr.write('Not a postcard, skipping packet\n')
-                continue
+                if b1 != 0x4242:
+                    sys.stderr.write('Not a postcard, skipping packet\n')
+                    continue
 
-            if b3 >= 0xff00:
-                sys.stderr.write('Outport > MAX_PORT, probably sent to controller, skipping packet\n')
-                continue
+                if b3 >= 0xff00:
+                    sys.stderr.write('Outport > MAX_PORT, probably sent to controller, skipping packet\n')
+                    continue
 
             ipdata = data[1].split(";")
             ipsrc = ipdata[0]
@@ -51,10 +86,7 @@ class Collector:
             # Extract packet ID according to L3 protocol
             if proto == "icmp":
                 chksum = p.sprintf("{ICMP:%ICMP.chksum%}")
-                seq = p.sprintf("{ICMP:%ICMP.seq%}")
-                if seq is None:
-                    continue
-                pktid = int(seq)
+                pktid = int(p.sprintf("{ICMP:%r,ICMP.id%}"))
             elif proto == "udp":
                 chksum = p.sprintf("{UDP:%UDP.chksum%}")
                 pktid = int(p.sprintf("{UDP:%r,UDP.sport%}"))
@@ -75,19 +107,34 @@ class Collector:
                 sys.stderr.write('Checksum does not match magic value, skipping packet\n')
                 continue
 
-            trace.append({'id': pktid, 'ts': ts, 'src': ipsrc, 'dst': ipdst, 'gcid': ipid, 'proto': proto, 'switch': b2, 'outport': b3})
+            # Probe id, spread over the IP id and the transport id
+            pktid = join(ipid, pktid)
+            gcid = self.probes.gcid(pktid)
+            if gcid is None:
+                sys.stderr.write('Unknown probe id %d, skipping packet\n' % (pktid))
+                continue
+
+            trace.append({'id': pktid, 'ts': ts, 'src': ipsrc, 'dst': ipdst, 'gcid': gcid, 'proto': proto, 'switch': b2, 'outport': b3})
 
         return trace
 
 if __name__ == "__main__":
     parser = OptionParser()
     parser.add_option("-t", "--timeout", dest="timeout", metavar="SECONDS", help="collection timeout")
+    parser.add_option("-p", "--probes", dest="probes", metavar="FILE", default="probes.json", help="Index of the probe ids written by the generator, to find the condition of each probe, default=probes.json")
+    parser.add_option("-u", "--udp", dest="udp", metavar="PORT", help="Receive the postcards on this local UDP port (emulator) instead of sniffing")
     options, args = parser.parse_args()
 
     timeout = 5
     if options.timeout is not None:
         timeout = int(options.timeout)
 
-    c = Collector()
-    trace = c.collect(timeout)
+    if not os.path.exists(options.probes):
+        parser.error("Missing probe index %s, see generator -p" % (options.probes))
+
+    c = Collector(ProbeIndex(options.probes))
+    if options.udp is not None:
+        trace = c.collect_udp(timeout, int(options.udp))
+    else:
+        trace = c.collect(timeout)
     print json.dumps(trace)
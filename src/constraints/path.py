@@ -6,7 +6,7 @@
 
 import re
 from tools import TraceData
-from regex import RegexParser
+import pathcache
 
 class PathConstraint:
     def __init__(self):
@@ -41,22 +41,39 @@ class PathConstraint:
             constr.verified = False
             return
 
-        cnt = 0
-        parser = RegexParser()
-        fsm = parser.create_fsm(constr.data['dpath']) # create DFA
+        fsm = pathcache.get(constr.data['dpath']) # fetch compiled DFA
 
-        for td in tds:
-            path = []
-            for node in td.path:
-                path.append('s'+str(node))
-            ret = fsm.process(path) # check path
-            if ret is not None:
-                cnt += 1
+        paths = [['s'+str(node) for node in td.path] for td in tds]
+        ret = fsm.process_many(paths) # check paths
+        cnt = len(tds) - ret.count(None)
 
         constr.verifrate = float(cnt)/float(len(tds))
         if constr.check():
             constr.verified = True
 
+    def verify_many(self, constrs, tds, mapping=None, topo=None):
+        """
+        Verify several path constraints sharing the same traces with a
+        single pass over each path
+        """
+        if len(constrs) == 1 or len(tds) == 0:
+            for constr in constrs:
+                self.verify(constr, tds, mapping, topo)
+            return
+
+        mdfa = pathcache.get_multi([constr.data['dpath'] for constr in constrs])
+
+        paths = [['s'+str(node) for node in td.path] for td in tds]
+        cnt = [0]*len(constrs)
+        for labels in mdfa.process_many(paths): # labels are constraint indexes
+            for i in labels:
+                cnt[i] += 1
+
+        for i in range(len(constrs)):
+            constrs[i].verifrate = float(cnt[i])/float(len(tds))
+            if constrs[i].check():
+                constrs[i].verified = True
+
     def tostring(self, data):
         return 'F, \'%s\', %f' % (data['dpath'], data['srate'])
 
@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import sys, socket, struct, threading
+from collections import deque
+from time import time, sleep
+from optparse import OptionParser
+from oflownet import *
+from tools import *
+
+"""
+Software OpenFlow 1.0 network running on loopback, to exercise the
+generator, the collector and the checker without real switches. Each
+switch of a topology listens on the OpenFlow port of the mapping and
+speaks the subset used by this project: HELLO, ECHO, FEATURES, flow
+stats, FLOW_MOD, PACKET_OUT and BARRIER. The switches start with L2
+forwarding flows towards every host (by destination MAC address, on
+shortest paths), and forward the packets sent with PACKET_OUT through
+their flow tables. The packets output on the port of the collector are
+handed to a sink.
+
+Subset: a single table, no buffers, timeouts and PACKET_IN; the
+non-strict MODIFY and DELETE only act on all the flows with a match-all
+request and are strict otherwise; the supported actions are OUTPUT,
+SET_DL_SRC and SET_DL_DST
+"""
+
+# priority of the forwarding flows
+FORWARDING_PRIORITY = 100
+
+# hops after which a forwarded packet is dropped (loops)
+MAX_HOPS = 64
+
+def mac_to_bytes(mac):
+    return ''.join([chr(int(x, 16)) for x in mac.split(':')])
+
+def frame_fields(frame, in_port):
+    """ OpenFlow 1.0 match fields of the Ethernet @frame received on @in_port """
+    f = {'in_port': in_port, 'dl_dst': frame[0:6], 'dl_src': frame[6:12],
+         'dl_vlan': 0xffff, 'dl_vlan_pcp': 0, 'nw_tos': 0, 'nw_proto': 0,
+         'nw_src': 0, 'nw_dst': 0, 'tp_src': 0, 'tp_dst': 0}
+    dl_type = struct.unpack_from('>H', frame, 12)[0]
+    offset = 14
+    if dl_type == 0x8100 and len(frame) >= 18:
+        tci, dl_type = struct.unpack_from('>HH', frame, 14)
+        f['dl_vlan'] = tci & 0xfff
+        f['dl_vlan_pcp'] = tci >> 13
+        offset = 18
+    f['dl_type'] = dl_type
+
+    if dl_type == 0x0800 and len(frame) >= offset+20:
+        ihl = (ord(frame[offset]) & 0xf)*4
+        f['nw_tos'] = ord(frame[offset+1]) & 0xfc
+        f['nw_proto'] = ord(frame[offset+9])
+        f['nw_src'], f['nw_dst'] = struct.unpack_from('>II', frame, offset+12)
+        offset += ihl
+        if f['nw_proto'] in (6, 17) and len(frame) >= offset+4: # TCP, UDP
+            f['tp_src'], f['tp_dst'] = struct.unpack_from('>HH', frame, offset)
+        elif f['nw_proto'] == 1 and len(frame) >= offset+2: # ICMP type and code
+            f['tp_src'], f['tp_dst'] = ord(frame[offset]), ord(frame[offset+1])
+    return f
+
+# (wildcard bit, field) of the exact match fields
+MATCH_FIELDS = [
+    (OFP_Flow_Wildcards.OFPFW_IN_PORT, 'in_port'),
+    (OFP_Flow_Wildcards.OFPFW_DL_VLAN, 'dl_vlan'),
+    (OFP_Flow_Wildcards.OFPFW_DL_SRC, 'dl_src'),
+    (OFP_Flow_Wildcards.OFPFW_DL_DST, 'dl_dst'),
+    (OFP_Flow_Wildcards.OFPFW_DL_TYPE, 'dl_type'),
+    (OFP_Flow_Wildcards.OFPFW_NW_PROTO, 'nw_proto'),
+    (OFP_Flow_Wildcards.OFPFW_TP_SRC, 'tp_src'),
+    (OFP_Flow_Wildcards.OFPFW_TP_DST, 'tp_dst'),
+    (OFP_Flow_Wildcards.OFPFW_DL_VLAN_PCP, 'dl_vlan_pcp'),
+    (OFP_Flow_Wildcards.OFPFW_NW_TOS, 'nw_tos'),
+]
+
+def match_packet(ofp_match, f):
+    """ True if the OFP_Match @ofp_match matches the frame fields @f """
+    w = ofp_match.get('wildcards')
+    for bit, n in MATCH_FIELDS:
+        if not w & bit and ofp_match.get(n) != f[n]:
+            return False
+
+    # nw_src and nw_dst wildcards are the number of ignored low bits
+    for n, shift in (('nw_src', OFP_Flow_Wildcards.OFPFW_NW_SRC_SHIFT), ('nw_dst', OFP_Flow_Wildcards.OFPFW_NW_DST_SHIFT)):
+        bits = (w >> shift) & 0x3f
+        if bits < 32:
+            mask = (0xffffffff << bits) & 0xffffffff
+            if ofp_match.get(n) & mask != f[n] & mask:
+                return False
+    return True
+
+class FlowEntry:
+    def __init__(self, ofp_match, priority, cookie, actions):
+        self.match = ofp_match
+        self.key = ofp_match.pack()     # identity of the flow with its priority
+        self.priority = priority
+        self.cookie = cookie
+        self.actions = actions
+        self.created = time()
+        self.packet_count = 0
+        self.byte_count = 0
+
+class EmulatedSwitch:
+    """
+    OpenFlow 1.0 switch @dpid of an Emulator, whose ports are given by
+    the topology
+    """
+    def __init__(self, net, dpid):
+        self.net = net
+        self.dpid = dpid
+        self.table = []     # FlowEntry, highest priority first
+        self.lock = threading.Lock()
+        self.server = None
+        self.conns = []     # (socket, thread) of the OpenFlow connections
+
+        # counters
+        self.flow_mods = 0
+        self.packet_outs = 0
+        self.errors = 0
+
+    def ports(self):
+        return self.net.topo.ports.get(self.dpid, {})
+
+    def add_flow(self, entry):
+        for i, e in enumerate(self.table):
+            if e.key == entry.key and e.priority == entry.priority:
+                self.table[i] = entry
+                return
+        i = 0
+        while i < len(self.table) and self.table[i].priority >= entry.priority:
+            i += 1
+        self.table.insert(i, entry)
+
+    def lookup(self, f):
+        with self.lock:
+            for e in self.table:
+                if match_packet(e.match, f):
+                    return e
+        return None
+
+    def flow_mod(self, ofp_match, ofp_flow_mod, actions):
+        """ Apply a FLOW_MOD to the table """
+        cmd = ofp_flow_mod.get('command')
+        prio = ofp_flow_mod.get('priority')
+        key = ofp_match.pack()
+        match_all = ofp_match.get('wildcards') & OFP_Flow_Wildcards.OFPFW_ALL == OFP_Flow_Wildcards.OFPFW_ALL
+        strict = cmd in (OFP_Flow_Mod_Command.OFPFC_MODIFY_STRICT, OFP_Flow_Mod_Command.OFPFC_DELETE_STRICT)
+
+        def selected(e):
+            if not strict and match_all:
+                return True
+            return e.key == key and (e.priority == prio or not strict)
+
+        with self.lock:
+            self.flow_mods += 1
+            if cmd == OFP_Flow_Mod_Command.OFPFC_ADD:
+                self.add_flow(FlowEntry(ofp_match, prio, ofp_flow_mod.get('cookie'), actions))
+            elif cmd in (OFP_Flow_Mod_Command.OFPFC_MODIFY, OFP_Flow_Mod_Command.OFPFC_MODIFY_STRICT):
+                found = False
+                for e in self.table:
+                    if selected(e):
+                        e.actions = actions
+                        e.cookie = ofp_flow_mod.get('cookie')
+                        found = True
+                if not found: # a modification of no flow adds it
+                    self.add_flow(FlowEntry(ofp_match, prio, ofp_flow_mod.get('cookie'), actions))
+            elif cmd in (OFP_Flow_Mod_Command.OFPFC_DELETE, OFP_Flow_Mod_Command.OFPFC_DELETE_STRICT):
+                self.table = [e for e in self.table if not selected(e)]
+
+    def listen(self, ip, port):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((ip, port))
+        self.server.listen(16)
+        th = threading.Thread(target=self.accept, name='s'+str(self.dpid))
+        th.daemon = True
+        th.start()
+        return self.server.getsockname()[1]
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except socket.error:
+                return
+            th = threading.Thread(target=self.serve, args=(sock,))
+            th.daemon = True
+            self.conns.append((sock, th))
+            th.start()
+
+    def stop(self):
+        """ Stop listening and close the connections """
+        if self.server is not None:
+            try:
+                self.server.shutdown(socket.SHUT_RDWR) # wakes accept() up
+            except socket.error:
+                pass
+            self.server.close()
+        for sock, th in self.conns:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            th.join()
+        self.conns = []
+
+    def serve(self, sock):
+        """ Handle the OpenFlow connection @sock until it is closed """
+        ofnet = OFlowNet()
+        ofnet.sock = sock
+        try:
+            ofnet.send(OFP_Header(OFP_Type.OFPT_HELLO, OFP_Header.length).pack())
+            for hdr, msg in ofnet.messages():
+                self.dispatch(ofnet, hdr, msg)
+        except (RuntimeError, socket.error, struct.error):
+            pass
+        sock.close()
+
+    def reply(self, ofnet, hdr, t, body=''):
+        ofp_hdr = OFP_Header(t, OFP_Header.length+len(body))
+        ofp_hdr.set('xid', hdr.get('xid'))
+        ofnet.send(ofp_hdr.pack()+body)
+
+    def error(self, ofnet, hdr, msg, t, code):
+        """ Reply with an error, whose data is the start of the failed request """
+        self.errors += 1
+        ofp_error = OFP_Error()
+        ofp_error.set('type', t)
+        ofp_error.set('code', code)
+        self.reply(ofnet, hdr, OFP_Type.OFPT_ERROR, ofp_error.pack()+hdr.pack()+msg[:56].tobytes())
+
+    def dispatch(self, ofnet, hdr, msg):
+        t = hdr.get('type')
+        if t == OFP_Type.OFPT_HELLO or t == OFP_Type.OFPT_ECHO_REPLY:
+            return
+        elif t == OFP_Type.OFPT_ECHO_REQUEST:
+            self.reply(ofnet, hdr, OFP_Type.OFPT_ECHO_REPLY, msg.tobytes())
+        elif t == OFP_Type.OFPT_FEATURES_REQUEST:
+            self.reply(ofnet, hdr, OFP_Type.OFPT_FEATURES_REPLY, self.features())
+        elif t == OFP_Type.OFPT_BARRIER_REQUEST: # messages are handled in order
+            self.reply(ofnet, hdr, OFP_Type.OFPT_BARRIER_REPLY)
+        elif t == OFP_Type.OFPT_FLOW_MOD:
+            self.handle_flow_mod(ofnet, hdr, msg)
+        elif t == OFP_Type.OFPT_PACKET_OUT:
+            self.handle_packet_out(ofnet, hdr, msg)
+        elif t == OFP_Type.OFPT_STATS_REQUEST:
+            self.handle_stats(ofnet, hdr, msg)
+        else:
+            self.error(ofnet, hdr, msg, OFP_Error_Type.OFPET_BAD_REQUEST, OFP_Bad_Request_Code.OFPBRC_BAD_TYPE)
+
+    def features(self):
+        ofp_features = OFP_Switch_Features()
+        ofp_features.set('datapath_id', self.dpid)
+        ofp_features.set('n_tables', 1)
+        body = ofp_features.pack()
+        for node, port in sorted(self.ports().items(), key=lambda x: x[1]):
+            ofp_port = OFP_Phy_Port()
+            ofp_port.set('port_no', port)
+            ofp_port.set('hw_addr', struct.pack('>HHH', 0x0200, self.dpid & 0xffff, port))
+            ofp_port.set('name', 's%d-eth%d' % (self.dpid, port))
+            body += ofp_port.pack()
+        return body
+
+    def parse_actions(self, msg, offset, end):
+        """ Return the actions between @offset and @end of @msg, None if one is not supported """
+        actions = []
+        ofp_action = OFP_Action_Header()
+        while offset < end:
+            ofp_action.unpack_from(msg, offset)
+            atype = ofp_action.get('type')
+            if ofp_action.get('len') < ofp_action.length:
+                return None
+            if atype == OFP_Action_Type.OFPAT_OUTPUT:
+                act = OFP_Action_Output()
+            elif atype in (OFP_Action_Type.OFPAT_SET_DL_SRC, OFP_Action_Type.OFPAT_SET_DL_DST):
+                act = OFP_Action_Mod_Dl_Dst()
+            else:
+                return None
+            act.unpack_from(msg, offset)
+            actions.append(act)
+            offset += ofp_action.get('len')
+        return actions
+
+    def handle_flow_mod(self, ofnet, hdr, msg):
+        ofp_match = OFP_Match()
+        ofp_match.unpack_from(msg)
+        ofp_flow_mod = OFP_Flow_Mod()
+        ofp_flow_mod.unpack_from(msg, ofp_match.length)
+        actions = self.parse_actions(msg, ofp_match.length+ofp_flow_mod.length, len(msg))
+        if actions is None:
+            self.error(ofnet, hdr, msg, OFP_Error_Type.OFPET_BAD_ACTION, OFP_Bad_Action_Code.OFPBAC_BAD_TYPE)
+            return
+        self.flow_mod(ofp_match, ofp_flow_mod, actions)
+
+    def handle_packet_out(self, ofnet, hdr, msg):
+        ofp_packet_out = OFP_Packet_Out()
+        ofp_packet_out.unpack_from(msg)
+        offset = ofp_packet_out.length
+        end = offset + ofp_packet_out.get('actions_len')
+        actions = self.parse_actions(msg, offset, end)
+        if actions is None:
+            self.error(ofnet, hdr, msg, OFP_Error_Type.OFPET_BAD_ACTION, OFP_Bad_Action_Code.OFPBAC_BAD_TYPE)
+            return
+        self.packet_outs += 1
+        self.net.inject(self.dpid, ofp_packet_out.get('in_port'), msg[end:].tobytes(), actions)
+
+    def handle_stats(self, ofnet, hdr, msg):
+        ofp_streq = OFP_Stats_Request()
+        ofp_streq.unpack_from(msg)
+        if ofp_streq.get('type') != OFP_Stats_Types.OFPST_FLOW:
+            self.error(ofnet, hdr, msg, OFP_Error_Type.OFPET_BAD_REQUEST, OFP_Bad_Request_Code.OFPBRC_BAD_STAT)
+            return
+
+        with self.lock:
+            table = list(self.table)
+
+        # multipart reply, each part below 64kB
+        now = time()
+        parts = []
+        body = bytearray()
+        for e in table:
+            alen = sum([a.length for a in e.actions])
+            if OFP_Header.length + OFP_Stats_Reply.length + len(body) + OFP_Flow_Stats.length + alen > 0xffff:
+                parts.append(body)
+                body = bytearray()
+
+            ofp_fwst = OFP_Flow_Stats()
+            ofp_fwst.set('length', ofp_fwst.length+alen)
+            ofp_fwst.set('duration_sec', int(now - e.created))
+            ofp_fwst.set('priority', e.priority)
+            ofp_fwst.set('cookie', e.cookie)
+            ofp_fwst.set('packet_count', e.packet_count)
+            ofp_fwst.set('byte_count', e.byte_count)
+
+            offset = len(body)
+            body += bytearray(ofp_fwst.length+alen)
+            ofp_fwst.pack_into(body, offset)
+            e.match.pack_into(body, offset+4)
+            offset += ofp_fwst.length
+            for a in e.actions:
+                a.pack_into(body, offset)
+                offset += a.length
+        parts.append(body)
+
+        for i, body in enumerate(parts):
+            ofp_streply = OFP_Stats_Reply()
+            ofp_streply.set('type', OFP_Stats_Types.OFPST_FLOW)
+            if i < len(parts) - 1:
+                ofp_streply.set('flags', OFP_Stats_Reply_Flags.OFPSF_REPLY_MORE)
+            self.reply(ofnet, hdr, OFP_Type.OFPT_STATS_REPLY, ofp_streply.pack()+str(body))
+
+class Emulator:
+    """
+    Network of EmulatedSwitch built from a topology and a mapping. The
+    frames output towards the collector @cid, truncated to the max_len
+    of the action, are passed to sink(switch, frame)
+    """
+    def __init__(self, topo, mapping, cid, sink=None):
+        self.topo = topo
+        self.mapping = mapping
+        self.collectorid = cid
+        self.sink = sink
+        self.switches = {}      # dpid -> EmulatedSwitch
+        self.addresses = {}     # dpid -> (ip, port) the switch listens on
+
+        # counters
+        self.forwarded = 0      # packets sent from a switch to another
+        self.delivered = 0      # packets delivered to a host
+        self.postcards = 0      # packets sent to the collector
+        self.dropped = 0        # table misses and loops
+
+        for node in self.topo.nodes:
+            if self.topo.is_switch(node):
+                self.switches[node] = EmulatedSwitch(self, node)
+        self.install_forwarding()
+
+    def install_forwarding(self):
+        """ Add to each switch a flow per host, matching its MAC address, on the shortest path """
+        for host in self.topo.nodes:
+            if self.topo.is_switch(host) or host == self.collectorid:
+                continue
+            try:
+                mac = mac_to_bytes(self.mapping.get_mac(host))
+            except (KeyError, ValueError):
+                continue
+
+            # breadth-first search from the switches of the host
+            nexthop = {}    # switch -> port towards the host
+            queue = deque()
+            for s in self.topo.get_edges(host):
+                nexthop[s] = self.topo.get_port(s, host)
+                queue.append(s)
+            while len(queue) > 0:
+                s = queue.popleft()
+                for n in self.topo.nodes:
+                    if n in nexthop or not self.topo.is_switch(n) or s not in self.topo.ports.get(n, {}):
+                        continue
+                    nexthop[n] = self.topo.get_port(n, s)
+                    queue.append(n)
+
+            for s, port in nexthop.items():
+                ofp_match = OFP_Match()
+                ofp_match.set('wildcards', OFP_Flow_Wildcards.OFPFW_ALL & ~OFP_Flow_Wildcards.OFPFW_DL_DST)
+                ofp_match.set('dl_dst', mac)
+                ofp_act_out = OFP_Action_Output()
+                ofp_act_out.set('type', OFP_Action_Type.OFPAT_OUTPUT)
+                ofp_act_out.set('len', ofp_act_out.length)
+                ofp_act_out.set('port', port)
+                self.switches[s].add_flow(FlowEntry(ofp_match, FORWARDING_PRIORITY, 0, [ofp_act_out]))
+
+    def start(self):
+        """
+        Listen on the OpenFlow address of each switch in the mapping, which
+        must be local (any free loopback port for the unmapped switches)
+        """
+        for dpid, sw in self.switches.items():
+            try:
+                ip, _, port = self.mapping.get_data(dpid)
+            except KeyError:
+                ip, port = '127.0.0.1', 0
+            self.addresses[dpid] = (ip, sw.listen(ip, port))
+
+    def stop(self):
+        for sw in self.switches.values():
+            sw.stop()
+
+    def get_data(self, node):
+        """ Mapping of the switches to their emulated agent, for SessionPool """
+        ip, port = self.addresses[node]
+        return (ip, None, port)
+
+    def neighbor(self, dpid, port):
+        for node, p in self.topo.ports.get(dpid, {}).items():
+            if p == port:
+                return node
+        return None
+
+    def inject(self, dpid, in_port, frame, actions):
+        """ Apply the PACKET_OUT @actions to @frame at switch @dpid, and forward it """
+        queue = deque()
+        self.apply(dpid, in_port, frame, actions, queue, 0)
+        while len(queue) > 0:
+            dpid, in_port, frame, hops = queue.popleft()
+            sw = self.switches[dpid]
+            e = sw.lookup(frame_fields(frame, in_port))
+            if e is None or hops >= MAX_HOPS:
+                self.dropped += 1
+                continue
+            e.packet_count += 1
+            e.byte_count += len(frame)
+            self.apply(dpid, in_port, frame, e.actions, queue, hops)
+
+    def apply(self, dpid, in_port, frame, actions, queue, hops):
+        for act in actions:
+            t = act.get('type')
+            if t == OFP_Action_Type.OFPAT_SET_DL_DST:
+                frame = act.get('dl_dst') + frame[6:]
+            elif t == OFP_Action_Type.OFPAT_SET_DL_SRC:
+                frame = frame[:6] + act.get('dl_dst') + frame[12:]
+            elif t == OFP_Action_Type.OFPAT_OUTPUT:
+                port = act.get('port')
+                if port == OFP_Port_No.OFPP_TABLE:
+                    queue.append((dpid, in_port, frame, hops))
+                    continue
+                if port == OFP_Port_No.OFPP_IN_PORT:
+                    port = in_port
+                if port in (OFP_Port_No.OFPP_FLOOD, OFP_Port_No.OFPP_ALL):
+                    ports = [p for n, p in self.topo.ports.get(dpid, {}).items() if p != in_port and n != self.collectorid]
+                else:
+                    ports = [port]
+                for p in ports:
+                    self.output(dpid, p, frame, act.get('max_len'), queue, hops)
+
+    def output(self, dpid, port, frame, max_len, queue, hops):
+        node = self.neighbor(dpid, port)
+        if node is None:
+            self.dropped += 1
+        elif node == self.collectorid:
+            self.postcards += 1
+            if self.sink is not None:
+                self.sink(dpid, frame[:max_len] if max_len > 0 else frame)
+        elif self.topo.is_switch(node):
+            self.forwarded += 1
+            queue.append((node, self.topo.get_port(node, dpid), frame, hops+1))
+        else:
+            self.delivered += 1
+
+    def dump(self):
+        print 'Emulator: %d switches, %d flow mods, %d packet outs, %d errors' % (len(self.switches), sum([s.flow_mods for s in self.switches.values()]), sum([s.packet_outs for s in self.switches.values()]), sum([s.errors for s in self.switches.values()]))
+        print 'Packets: %d forwarded, %d delivered, %d postcards, %d dropped' % (self.forwarded, self.delivered, self.postcards, self.dropped)
+
+class UDPSink:
+    """ Send each postcard frame in a UDP datagram to @ip:@port, see collector -u """
+    def __init__(self, ip, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addr = (ip, port)
+
+    def __call__(self, dpid, frame):
+        self.sock.sendto(frame, self.addr)
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-c", "--collector", dest="cid", metavar="ID", help="Set the collector id")
+    parser.add_option("-t", "--topology", dest="topo", metavar="FILE", help="Set the topology file")
+    parser.add_option("-m", "--mapping", dest="mapping", metavar="FILE", help="Set the mapping file")
+    parser.add_option("-u", "--udp", dest="udp", metavar="PORT", help="Send the postcards to the collector on this local UDP port")
+    options, args = parser.parse_args()
+    if options.cid is None or options.topo is None or options.mapping is None:
+        parser.error("Missing argument, see -h for help")
+
+    sink = None
+    if options.udp is not None:
+        sink = UDPSink('127.0.0.1', int(options.udp))
+
+    emu = Emulator(Topology(options.topo), Mapping(options.mapping), int(options.cid), sink)
+    emu.start()
+    for dpid in sorted(emu.addresses):
+        print 's%d listening on %s:%d' % (dpid, emu.addresses[dpid][0], emu.addresses[dpid][1])
+
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+    emu.dump()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import sys, struct
+from array import array
+from oflownet import *
+
+"""
+Columnar OpenFlow 1.0 flow table. The flow stats entries are decoded
+straight from the reply bytes into one array per match field and
+counter, instead of one dict of BinaryHeader objects per flow, and the
+actions are kept as raw bytes. Hash indexes on the priority, the output
+ports, the identity of the flows (table, match and priority) and, on demand,
+any exact match field answer the usual queries without scanning the
+table
+"""
+
+# struct ofp_flow_stats with its struct ofp_match, up to the actions
+FLOW_STATS = struct.Struct('>HBxIH6s6sHBxHBB2xIIHHIIHHH6xQQQ')
+
+# struct ofp_match, as packed by OFP_Match
+MATCH = struct.Struct('>IH6s6sHBxHBB2xIIHH')
+
+class U64Array:
+    """ Array of 64-bit integers as two 'I' arrays, where array('L') has 32 bits """
+    def __init__(self):
+        self.hi = array('I')
+        self.lo = array('I')
+
+    def __len__(self):
+        return len(self.lo)
+
+    def __getitem__(self, i):
+        return (self.hi[i] << 32) | self.lo[i]
+
+    def append(self, v):
+        self.hi.append(v >> 32)
+        self.lo.append(v & 0xffffffff)
+
+# array type of the 64-bit columns (cookie and counters), 'u64' for U64Array
+U64 = 'L' if array('L').itemsize >= 8 else 'u64'
+
+# (name, array type) of the columns, in FLOW_STATS order after the length,
+# 'mac' columns are bytearrays of 6 bytes per flow
+COLUMNS = [
+    ('table_id', 'B'),
+    ('wildcards', 'I'),
+    ('in_port', 'H'),
+    ('dl_src', 'mac'),
+    ('dl_dst', 'mac'),
+    ('dl_vlan', 'H'),
+    ('dl_vlan_pcp', 'B'),
+    ('dl_type', 'H'),
+    ('nw_tos', 'B'),
+    ('nw_proto', 'B'),
+    ('nw_src', 'I'),
+    ('nw_dst', 'I'),
+    ('tp_src', 'H'),
+    ('tp_dst', 'H'),
+    ('duration_sec', 'I'),
+    ('duration_nsec', 'I'),
+    ('priority', 'H'),
+    ('idle_timeout', 'H'),
+    ('hard_timeout', 'H'),
+    ('cookie', U64),
+    ('packet_count', U64),
+    ('byte_count', U64),
+]
+
+# match fields, in OFP_Match order after the wildcards
+MATCH_FIELDS = ['in_port', 'dl_src', 'dl_dst', 'dl_vlan', 'dl_vlan_pcp', 'dl_type',
+                'nw_tos', 'nw_proto', 'nw_src', 'nw_dst', 'tp_src', 'tp_dst']
+
+# wildcard bit of the match fields (nw_src and nw_dst have a bit count)
+WILDCARDS = {
+    'in_port': OFP_Flow_Wildcards.OFPFW_IN_PORT,
+    'dl_vlan': OFP_Flow_Wildcards.OFPFW_DL_VLAN,
+    'dl_src': OFP_Flow_Wildcards.OFPFW_DL_SRC,
+    'dl_dst': OFP_Flow_Wildcards.OFPFW_DL_DST,
+    'dl_type': OFP_Flow_Wildcards.OFPFW_DL_TYPE,
+    'nw_proto': OFP_Flow_Wildcards.OFPFW_NW_PROTO,
+    'tp_src': OFP_Flow_Wildcards.OFPFW_TP_SRC,
+    'tp_dst': OFP_Flow_Wildcards.OFPFW_TP_DST,
+    'dl_vlan_pcp': OFP_Flow_Wildcards.OFPFW_DL_VLAN_PCP,
+    'nw_tos': OFP_Flow_Wildcards.OFPFW_NW_TOS,
+    'nw_src': OFP_Flow_Wildcards.OFPFW_NW_SRC_MASK,
+    'nw_dst': OFP_Flow_Wildcards.OFPFW_NW_DST_MASK,
+}
+
+class OFP_Action_Raw(object):
+    """ Action of a type that FlowTable does not decode, kept as its bytes """
+    def __init__(self, data):
+        self.data = data
+        self.type = struct.unpack_from('>H', data)[0]
+        self.length = len(data)
+
+    def get(self, n):
+        if n == 'type':
+            return self.type
+        if n == 'len':
+            return self.length
+        return None
+
+    def pack_into(self, buf, offset=0):
+        buf[offset:offset+self.length] = self.data
+
+class FlowTable:
+    """
+    Flows of a switch, as rows of columns. Row @i of column @n is
+    get(i, n); flow(i) rebuilds the dict of OFlowNet.parse_flow
+    """
+    def __init__(self):
+        self.columns = {}
+        for n, t in COLUMNS:
+            if t == 'mac':
+                self.columns[n] = bytearray()
+            elif t == 'u64':
+                self.columns[n] = U64Array()
+            else:
+                self.columns[n] = array(t)
+        self.order = [self.columns[n] for n, t in COLUMNS]
+        self.actions_data = bytearray()     # raw actions of all the flows
+        self.actions_start = array('I', [0]) # row -> offset in actions_data, plus the end
+        self.count = 0
+
+        # indexes: value -> rows
+        self.by_priority = {}
+        self.by_out_port = {}
+        self.by_key = {}        # (table, match, priority) -> row
+        self.by_field = {}      # match field -> {value -> rows}, built on demand
+
+    def __len__(self):
+        return self.count
+
+    def add_stats(self, buf, offset=0, end=None):
+        """ Append the flow stats entries between @offset and @end of @buf, return their count """
+        if end is None:
+            end = len(buf)
+        n = 0
+        while offset < end:
+            offset += self.add_entry(buf, offset)
+            n += 1
+        return n
+
+    def add_entry(self, buf, offset=0):
+        """ Append the flow stats entry at @offset of @buf, return its length """
+        vals = FLOW_STATS.unpack_from(buf, offset)
+        plen = vals[0]
+        if plen < FLOW_STATS.size:
+            raise RuntimeError("invalid flow stats length %d" % (plen))
+
+        row = self.count
+        for col, v in zip(self.order, vals[1:]):
+            if isinstance(col, bytearray):
+                col += v
+            else:
+                col.append(v)
+
+        # actions, and the ports they output to
+        ports = []
+        a = offset + FLOW_STATS.size
+        while a < offset + plen:
+            atype, alen = struct.unpack_from('>HH', buf, a)
+            if alen < 8 or a + alen > offset + plen:
+                raise RuntimeError("invalid action length %d" % (alen))
+            if atype == OFP_Action_Type.OFPAT_OUTPUT:
+                ports.append(struct.unpack_from('>H', buf, a+4)[0])
+            a += alen
+        self.actions_data += buf[offset+FLOW_STATS.size:offset+plen]
+        self.actions_start.append(len(self.actions_data))
+        self.count += 1
+
+        # indexes
+        self.by_priority.setdefault(vals[17], []).append(row)
+        for port in set(ports):
+            self.by_out_port.setdefault(port, []).append(row)
+        self.by_key[(vals[1], vals[2], vals[17]) + vals[3:15]] = row
+        for n, index in self.by_field.items():
+            if self.exact(row, n):
+                index.setdefault(self.get(row, n), []).append(row)
+        return plen
+
+    def get(self, i, n):
+        col = self.columns[n]
+        if isinstance(col, bytearray):
+            return str(col[6*i:6*i+6])
+        return col[i]
+
+    def exact(self, i, n):
+        """ True if match field @n of flow @i is not wildcarded """
+        w = self.columns['wildcards'][i] & WILDCARDS[n]
+        return w == 0
+
+    def key(self, i):
+        """
+        Identity of flow @i: its table, wildcards, priority and the values
+        of all its match fields, wildcarded ones included as the switch
+        reports them
+        """
+        return (self.columns['table_id'][i], self.columns['wildcards'][i], self.columns['priority'][i]) + tuple([self.get(i, n) for n in MATCH_FIELDS])
+
+    def packed_match(self, i):
+        return MATCH.pack(self.columns['wildcards'][i], *[self.get(i, n) for n in MATCH_FIELDS])
+
+    def match(self, i):
+        ofp_match = OFP_Match()
+        ofp_match.set('wildcards', self.columns['wildcards'][i])
+        for n in MATCH_FIELDS:
+            ofp_match.set(n, self.get(i, n))
+        return ofp_match
+
+    def body(self, i):
+        ofp_fwst = OFP_Flow_Stats()
+        ofp_fwst.set('length', FLOW_STATS.size + self.actions_start[i+1] - self.actions_start[i])
+        for n in ('table_id', 'duration_sec', 'duration_nsec', 'priority', 'idle_timeout', 'hard_timeout', 'cookie', 'packet_count', 'byte_count'):
+            ofp_fwst.set(n, int(self.get(i, n)))
+        return ofp_fwst
+
+    def actions(self, i):
+        """
+        Actions of flow @i, in order: output and set_dl_src/dst as
+        BinaryHeader objects, the others as OFP_Action_Raw
+        """
+        actions = []
+        a = self.actions_start[i]
+        end = self.actions_start[i+1]
+        while a < end:
+            atype, alen = struct.unpack_from('>HH', self.actions_data, a)
+            if atype == OFP_Action_Type.OFPAT_OUTPUT:
+                act = OFP_Action_Output()
+            elif atype in (OFP_Action_Type.OFPAT_SET_DL_SRC, OFP_Action_Type.OFPAT_SET_DL_DST):
+                act = OFP_Action_Mod_Dl_Dst()
+            else:
+                act = OFP_Action_Raw(str(self.actions_data[a:a+alen]))
+            if not isinstance(act, OFP_Action_Raw):
+                act.unpack_from(self.actions_data, a)
+            actions.append(act)
+            a += alen
+        return actions
+
+    def flow(self, i):
+        """ Flow @i as returned by OFlowNet.parse_flow """
+        return {"body": self.body(i), "match": self.match(i), "actions": [a for a in self.actions(i) if a.get('type') == OFP_Action_Type.OFPAT_OUTPUT]}
+
+    def out_ports(self, i):
+        """ Ports of the output actions of flow @i, in order """
+        return [a.get('port') for a in self.actions(i) if a.get('type') == OFP_Action_Type.OFPAT_OUTPUT]
+
+    def with_priority(self, priority):
+        return self.by_priority.get(priority, [])
+
+    def with_out_port(self, port):
+        """ Flows with an output action to @port """
+        return self.by_out_port.get(port, [])
+
+    def with_field(self, n, v):
+        """ Flows matching exactly @v on match field @n (not wildcarded) """
+        index = self.by_field.get(n)
+        if index is None:
+            index = {}
+            for i in xrange(self.count):
+                if self.exact(i, n):
+                    index.setdefault(self.get(i, n), []).append(i)
+            self.by_field[n] = index
+        return index.get(v, [])
+
+    def find(self, ofp_match, priority, table_id=0):
+        """ Row of the flow with match @ofp_match and @priority in table @table_id, None if not in the table """
+        vals = MATCH.unpack(ofp_match.pack()) # unset fields as the switch reports them
+        return self.by_key.get((table_id, vals[0], priority) + vals[1:])
+
+    def dump(self):
+        for i in xrange(self.count):
+            print 'priority %d cookie %x packets %d output %s' % (self.get(i, 'priority'), self.get(i, 'cookie'), self.get(i, 'packet_count'), [a.get('port') for a in self.flow(i)['actions']])
+
+def fetch(ofnet):
+    """ Request the flow table of the OpenFlow 1.0 connection @ofnet and return it as a FlowTable """
+    if ofnet.Type is not OFP_Type:
+        raise RuntimeError("FlowTable only holds OpenFlow 1.0 flows")
+    table = FlowTable()
+    for msg, offset, end in ofnet.flow_stats_parts():
+        table.add_stats(msg, offset, end)
+    return table
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print 'Usage: %s <host> <port> [out port]' % (sys.argv[0])
+        sys.exit(-1)
+
+    ofnet = OFlowNet()
+    ofnet.connect(sys.argv[1], int(sys.argv[2]))
+    ofnet.handshake()
+    table = fetch(ofnet)
+    if len(sys.argv) > 3:
+        rows = table.with_out_port(int(sys.argv[3]))
+        print '%d flows out of %d output to port %s' % (len(rows), len(table), sys.argv[3])
+    else:
+        table.dump()
@@ -4,36 +4,72 @@
 @author: David Lebrun <dav.lebrun@gmail.com>
 """
 
-import sys, random
+import os, sys, random
 from subprocess import check_output, call
 from rulesparser import *
 from oflownet import *
+from oflownet13 import *
 from tools import *
 from scapy.all import *
 import simplejson as json
 from optparse import OptionParser
 import protocols.manager as pmanager
+from analysis import PathAnalyzer
+from sessions import SessionPool
+from ofstats import OFlowStats
+from templates import *
+from probeid import ProbeAllocator, split
+from flowtable import FlowTable
+from injector import Injector
+
+def flow_key(match, priority):
+    """ Identity of a flow entry in the snapshots, from its packed ofp_match """
+    return '%s/%d' % (match.encode('hex'), priority)
 
 class Generator:
     """
     Main generator class
     """
-    def __init__(self, rules=None, topo=None, mapping=None, cid=None, samples=None):
+
+    # cookie of the hooked flows, in the high 16 bits
+    HOOK_COOKIE = 0x4242 << 48
+    HOOK_COOKIE_MASK = 0xffff << 48
+
+    # OpenFlow 1.3 hooking: table of the postcard rule, and first table of
+    # the production pipeline
+    POSTCARD_TABLE = 0
+    PIPELINE_TABLE = 1
+
+    def __init__(self, rules=None, topo=None, mapping=None, cid=None, samples=None, analyze=True, of13=False, snapshots=None, ofstats=None):
         self.reqs = None        # Requirements class parsed from the rules
         self.topo = None        # Topology
         self.collectorid = cid  # self-explanatory
         self.mapping = None     # static mapping
         self.samples = samples  # default samples
         self.allpkts = []       # generated packets
+        self.templates = {}     # protocol -> probe templates
+        self.probes = ProbeAllocator() # probe ids, and their index for the collector and checker
+        self.analyzer = None    # static path constraints analysis
+        self.of13 = of13        # OpenFlow 1.3 switches, hooked with a postcard rule
+        self.snapshot_dir = snapshots # directory of the flow table snapshots, if persistent
+        self.snapshots = {}     # switch -> snapshot of its hooked flow table, see hook_switch
+        self.ofstats = ofstats  # OFlowStats of the OpenFlow connections, None if not instrumented
+        self.sessions = SessionPool(protocol=OFlowNet13 if of13 else OFlowNet, stats=ofstats) # OpenFlow connections, shared by hooking and injection
 
         if rules is not None:
             self.reqs = RulesParser().parse(rules)
 
         if topo is not None:
             self.topo = Topology(topo)
+            if analyze:
+                self.analyzer = PathAnalyzer(self.topo)
 
         if mapping is not None:
             self.mapping = Mapping(mapping)
+            self.sessions.set_mapping(self.mapping)
+
+        if snapshots is not None and not os.path.isdir(snapshots):
+            os.makedirs(snapshots) # before hooking, so that the snapshots can be saved
 
     def set_collector(self, cid):
         self.collectorid = cid
@@ -59,27 +95,70 @@ class Generator:
         """
         For each switch in the network, modify its flow table to add an mod_dl_dst and
         output action to send truncated packet copies to the collector, with switch ID
-        and output encoded in destination MAC address
+        and output encoded in destination MAC address. With OpenFlow 1.3, a single
+        postcard rule is installed per switch instead, see hook_switch13
         """
         for node in self.topo.nodes:
             if not self.topo.is_switch(node):
                 continue
 
-            ip, _, port = self.mapping.get_data(node)
+            _, _, port = self.mapping.get_data(node)
             if port == 0:
                 sys.stderr.write('Warning: oflow port for s'+str(node)+' is zero, skipping switch\n')
                 continue
 
-            ofnet = OFlowNet()
-            ofnet.connect(ip, port)
-            ofnet.handshake() # wait for HELLO and reply with HELLO (let's be polite :))
-            ofnet.dump_flows() # request the content of the flow table
-            ofnet.run(OFP_Type.OFPT_STATS_REPLY) # wait until we get the flow entries
+            if self.of13:
+                if int(node) >= OFPVID_PRESENT:
+                    sys.stderr.write('Warning: s'+str(node)+' does not fit in a VLAN ID, skipping switch\n')
+                    continue
+                report, unchanged = self.sessions.run(node, lambda ofnet: self.hook_switch13(node, ofnet))
+            else:
+                report, unchanged = self.sessions.run(node, lambda ofnet: self.hook_switch(node, ofnet))
+            failed = [r for r in report if r[1] is not None]
+            for priority, error in failed:
+                sys.stderr.write('Warning: hooking flow of priority %d on s%s failed with error type %d code %d\n' % (priority, str(node), error[0], error[1]))
+            print 'Hooked %d/%d flows on s%s, %d already hooked' % (len(report)-len(failed), len(report), str(node), unchanged)
 
-            for flow in ofnet.flows:
-                ofp_fwst = flow['body']
-                ofp_match = flow['match']
-                actions = flow['actions']
+    def hook_switch(self, node, ofnet, batch=512):
+        """
+        Add the collector actions to the flows of switch @node. The flow
+        modifications are sent by batches of @batch messages while the
+        table is received, and a barrier closes the last batch. Hooked
+        flows are tagged with HOOK_COOKIE; those whose output ports did
+        not change since the last run, according to the snapshot of the
+        switch, are left alone, and the postcard actions of the others
+        are replaced, so hooking again costs as much as the table churn
+        and never duplicates postcards. Return the (priority, error) of
+        each modified flow, error being None on success or the (type,
+        code) of the error returned by the switch, and the number of
+        unchanged flows. Each part of the table is received into a
+        FlowTable, whose cookie, priority and output ports columns drive
+        the diff
+        """
+        cport = self.topo.get_port(node, self.collectorid)
+        old = self.load_snapshot(node)
+        snapshot = {}   # flow key -> output ports once hooked
+        unchanged = 0
+        mods = []       # flow modifications not sent yet
+        keys = []       # flow keys of the modifications not sent yet
+        sent = []       # (xid, priority, flow key) of the flow modifications sent
+        bxid = None     # xid of the last barrier request
+        for msg, offset, end in ofnet.flow_stats_parts(): # flow entries, as they are received
+            # one table per part, so that only a part of the flows is held at once
+            table = FlowTable()
+            table.add_stats(msg, offset, end)
+            for i in xrange(len(table)):
+                priority = table.get(i, 'priority')
+                cookie = int(table.get(i, 'cookie'))
+                key = flow_key(table.packed_match(i), priority)
+                ports = table.out_ports(i)
+                if cookie & Generator.HOOK_COOKIE_MASK == Generator.HOOK_COOKIE and old.get(key) == ports:
+                    snapshot[key] = ports
+                    unchanged += 1
+                    continue
+
+                # Keep the actions of the flow, without the postcards of a previous hooking
+                actions = self.strip_postcards(table.actions(i), cport)
                 tag_actions = []
 
                 # For each output action in the flow, append our mod_dl_dst,output actions
@@ -95,30 +174,150 @@ class Generator:
                         ofp_act_out = OFP_Action_Output()
                         ofp_act_out.set('type', OFP_Action_Type.OFPAT_OUTPUT)
                         ofp_act_out.set('len', ofp_act_out.length)
-                        ofp_act_out.set('port', self.topo.get_port(node, self.collectorid))
+                        ofp_act_out.set('port', cport)
                         ofp_act_out.set('max_len', 256)
 
                         tag_actions.extend([ofp_mod_dl_dst, ofp_act_out])
                 actions.extend(tag_actions)
+                snapshot[key] = [act.get('port') for act in actions if act.get('type') == OFP_Action_Type.OFPAT_OUTPUT]
 
-                allacts = ''
-                for act in actions:
-                    allacts += act.pack()
-
-                # Prepare flow modification command and send it
+                # Prepare flow modification command, the controller's cookie is kept in the low bits
                 ofp_flow_mod = OFP_Flow_Mod()
-                ofp_flow_mod.set('cookie', random.getrandbits(64))
+                ofp_flow_mod.set('cookie', Generator.HOOK_COOKIE | (cookie & ~Generator.HOOK_COOKIE_MASK))
                 ofp_flow_mod.set('command', OFP_Flow_Mod_Command.OFPFC_MODIFY_STRICT)
-                ofp_flow_mod.set('idle_timeout', ofp_fwst.get('idle_timeout'))
-                ofp_flow_mod.set('hard_timeout', ofp_fwst.get('hard_timeout'))
-                ofp_flow_mod.set('priority', ofp_fwst.get('priority'))
+                ofp_flow_mod.set('idle_timeout', table.get(i, 'idle_timeout'))
+                ofp_flow_mod.set('hard_timeout', table.get(i, 'hard_timeout'))
+                ofp_flow_mod.set('priority', priority)
                 ofp_flow_mod.set('buffer_id', 0xffffffff)
                 ofp_flow_mod.set('out_port', OFP_Port_No.OFPP_NONE)
 
-                body = ofp_match.pack() + ofp_flow_mod.pack() + allacts
-                ofp_hdr = OFP_Header(OFP_Type.OFPT_FLOW_MOD, len(body)+8)
-                ofnet.send(ofp_hdr.pack()+body)
-            ofnet.disconnect()
+                mods.append((table.match(i), ofp_flow_mod, actions))
+                keys.append(key)
+                if len(mods) == batch:
+                    xids, bxid = ofnet.send_flow_mods(mods)
+                    sent.extend(zip(xids, [m[1].get('priority') for m in mods], keys))
+                    mods = []
+                    keys = []
+
+        if len(mods) > 0:
+            xids, bxid = ofnet.send_flow_mods(mods)
+            sent.extend(zip(xids, [m[1].get('priority') for m in mods], keys))
+
+        report = []
+        if bxid is not None:
+            # the barrier reply comes after every error of the previous batches
+            ofnet.wait_barrier(bxid)
+            errors = ofnet.flow_mod_errors([xid for xid, _, _ in sent])
+            for (_, priority, key), error in zip(sent, errors):
+                if error is not None:
+                    del snapshot[key] # not hooked, retried next time
+                report.append((priority, error))
+
+        self.save_snapshot(node, snapshot)
+        return report, unchanged
+
+    def strip_postcards(self, actions, cport):
+        """
+        @actions without the mod_dl_dst,output pairs added by hook_switch,
+        i.e. a mod_dl_dst to a 42:42 address followed by an output to the
+        collector port @cport
+        """
+        kept = []
+        k = 0
+        while k < len(actions):
+            act = actions[k]
+            if k+1 < len(actions) and act.get('type') == OFP_Action_Type.OFPAT_SET_DL_DST and act.get('dl_dst')[:2] == '\x42\x42':
+                out = actions[k+1]
+                if out.get('type') == OFP_Action_Type.OFPAT_OUTPUT and out.get('port') == cport:
+                    k += 2
+                    continue
+            kept.append(act)
+            k += 1
+        return kept
+
+    def load_snapshot(self, node):
+        """ Flow table of switch @node as hooked by the last run: flow key -> output ports """
+        if node in self.snapshots:
+            return self.snapshots[node]
+        if self.snapshot_dir is not None:
+            fname = os.path.join(self.snapshot_dir, 's%s.json' % (str(node)))
+            if os.path.exists(fname):
+                f = open(fname, 'r')
+                snapshot = json.load(f)
+                f.close()
+                return snapshot
+        return {}
+
+    def save_snapshot(self, node, snapshot):
+        self.snapshots[node] = snapshot
+        if self.snapshot_dir is not None:
+            f = open(os.path.join(self.snapshot_dir, 's%s.json' % (str(node))), 'w')
+            json.dump(snapshot, f)
+            f.close()
+
+    def hook_switch13(self, node, ofnet):
+        """
+        Install the postcard rule of the OpenFlow 1.3 switch @node in table
+        POSTCARD_TABLE: every packet is copied to the collector with the
+        switch ID as VLAN tag, then goes on to the production pipeline in
+        table PIPELINE_TABLE, which the production flows must use. The
+        production flows are left untouched, so the cost does not depend
+        on their number. Unlike the OpenFlow 1.0 hooking, the copy is made
+        when the packet enters the switch: the output port is not known,
+        and dropped packets are reported too. Returns the result of
+        hook_switch for the postcard rule
+        """
+        # match everything
+        ofp_match = OXM_Match()
+
+        # push vlan, set vlan_vid=switch ID, output to collector, pop vlan
+        ofp_push = OFP13_Action_Push()
+        ofp_push.set('type', OFP13_Action_Type.OFPAT_PUSH_VLAN)
+        ofp_push.set('len', ofp_push.length)
+        ofp_push.set('ethertype', 0x8100)
+
+        ofp_set_vid = OFP13_Action_Set_Field('vlan_vid', OFPVID_PRESENT | int(node))
+
+        ofp_act_out = OFP13_Action_Output()
+        ofp_act_out.set('type', OFP13_Action_Type.OFPAT_OUTPUT)
+        ofp_act_out.set('len', ofp_act_out.length)
+        ofp_act_out.set('port', self.topo.get_port(node, self.collectorid))
+        ofp_act_out.set('max_len', 256)
+
+        ofp_pop = OFP13_Action_Pop_Vlan()
+        ofp_pop.set('type', OFP13_Action_Type.OFPAT_POP_VLAN)
+        ofp_pop.set('len', ofp_pop.length)
+
+        ofp_goto = OFP13_Instruction_Goto_Table()
+        ofp_goto.set('type', OFP13_Instruction_Type.OFPIT_GOTO_TABLE)
+        ofp_goto.set('len', ofp_goto.length)
+        ofp_goto.set('table_id', Generator.PIPELINE_TABLE)
+
+        instructions = [OFP13_Instruction_Actions(OFP13_Instruction_Type.OFPIT_APPLY_ACTIONS, [ofp_push, ofp_set_vid, ofp_act_out, ofp_pop]), ofp_goto]
+
+        # adding the rule again replaces it, so hooking twice is harmless
+        ofp_flow_mod = OFP13_Flow_Mod()
+        ofp_flow_mod.set('table_id', Generator.POSTCARD_TABLE)
+        ofp_flow_mod.set('command', OFP_Flow_Mod_Command.OFPFC_ADD)
+        ofp_flow_mod.set('priority', 0)
+        ofp_flow_mod.set('buffer_id', OFP_NO_BUFFER)
+        ofp_flow_mod.set('out_port', OFP13_Port_No.OFPP_ANY)
+        ofp_flow_mod.set('out_group', OFPG_ANY)
+
+        errors = ofnet.mod_flows([(ofp_match, ofp_flow_mod, instructions)])
+        return [(0, errors[0])], 0
+
+    def get_templates(self, proto):
+        """
+        Templates of the packets of @proto, compiled from its protocol
+        handler on first use
+        """
+        templates = self.templates.get(proto)
+        if templates is None:
+            inst = pmanager.getinstance(proto)
+            ll = Ether(src='00:00:00:00:00:00', dst='00:00:00:00:00:00')
+            templates = self.templates[proto] = compile_protocol(inst, ll)
+        return templates
 
     def get_packet_prototypes(self, src, dst, proto, gciid, samples):
         """
@@ -126,19 +325,23 @@ class Generator:
         """
         pkts = []
 
+        if proto is None:
+            proto = "default"
+        templates = self.get_templates(proto.lower())
+
         for snode in src:
+            smac = mac_bytes(self.mapping.get_mac(snode))
+            sip = ip_bytes(self.mapping.get_ip(snode))
             for dnode in dst:
+                dmac = mac_bytes(self.mapping.get_mac(dnode))
+                dip = ip_bytes(self.mapping.get_ip(dnode))
+                print 'Setting %d packets %d (%s) -> %d (%s)' % (samples*len(templates), snode, self.mapping.get_mac(snode), dnode, self.mapping.get_mac(dnode))
+                pid = self.probes.allocate(gciid, snode, dnode, samples*len(templates))
                 for i in range(0, samples):
-                    print 'Setting packet %d (%s) -> %d (%s)' % (snode, self.mapping.get_mac(snode), dnode, self.mapping.get_mac(dnode))
-                    ll = Ether(src=self.mapping.get_mac(snode), dst=self.mapping.get_mac(dnode))
-
-                    if proto is None:
-                        proto = "default"
-                    inst = pmanager.getinstance(proto.lower())
-                    genpkt = inst.build_layers(snode, dnode, gciid, self.mapping, ll)
-
-                    for p in genpkt:
-                        pkts.append({'src': snode, 'data':str(p)})
+                    for t in templates:
+                        ipid, tid = split(pid)
+                        pkts.append({'src': snode, 'id': pid, 'data': t.build(smac, dmac, sip, dip, ipid, tid)})
+                        pid += 1
         return pkts
 
     def generate_packets(self):
@@ -159,9 +362,6 @@ class Generator:
             dst = []
             proto = None
 
-            if len(gc.constr) > 1:
-                raise RuntimeError("More than one constraint for group condition "+str(gc.iid)+", this is not supported at the time.")
-
             for c in gc.conds:
                 if c.source == 'Hs': # source host
                     if c.ctype == Condition.COND_EQUAL:
@@ -183,42 +383,51 @@ class Generator:
 
             print str(src), str(dst)
 
-            # Samples priority: command line, constraint handler, default
+            # Do not probe conditions whose constraints cannot be satisfied
+            if self.analyzer is not None and not self.analyzer.check(gc, src):
+                print 'Skipping condition %d, its constraints cannot be satisfied on the topology' % (gc.iid)
+                gc.pkts = []
+                continue
+
+            # Samples priority: command line, constraint handlers (largest
+            # request among the constraints sharing the condition), default
             if self.samples is not None:
                 samples = self.samples
-            elif 'samples' in gc.constr[0].data:
-                samples = gc.constr[0].data['samples']
             else:
                 samples = 1
+                for constr in gc.constr:
+                    if 'samples' in constr.data:
+                        samples = max(samples, constr.data['samples'])
 
             # Generate packet data
             pkts = self.get_packet_prototypes(src, dst, proto, gc.iid, samples)
             self.allpkts.extend(pkts)
             gc.pkts = pkts
 
-    def send_packets(self, outcon=False):
+    def send_packets(self, outcon=False, rate=None, switch_rate=None):
         """
-        Inject the packets in the netwok
+        Inject the packets in the netwok, at most @rate packets per second
+        overall and @switch_rate per switch (None for no limit), the
+        switches in parallel. Return the Injector, for its report
         """
+        oport = OFP_Port_No.OFPP_TABLE
+        if outcon:
+            oport = OFP_Port_No.OFPP_CONTROLLER
+
+        injector = Injector(self.sessions, rate, switch_rate)
         for pkt in self.allpkts:
             src = pkt['src']
             data = pkt['data']
             for s in self.topo.get_edges(src): # inject the packet in all switches connected to the source host
                 ip, _, port = self.mapping.get_data(s)
                 if port == 0:
-                    print "Warning: oflow port for s'+str(node)+' is zero, skipping packet out"
+                    print 'Warning: oflow port for s%d is zero, skipping packet out' % (s)
                     continue
+                injector.add(s, data, oport)
 
-                print 'Sending packet from source %d at switch %d IP/port %s/%d' % (src, s, ip, port)
-
-                ofnet = OFlowNet()
-                ofnet.connect(ip, port)
-                ofnet.handshake()
-                oport = OFP_Port_No.OFPP_TABLE
-                if outcon:
-                    oport = OFP_Port_No.OFPP_CONTROLLER
-                ofnet.packet_out(0, data, oport)
-                ofnet.disconnect()
+        print 'Sending %d packets from %d sources' % (len(injector), len(set([pkt['src'] for pkt in self.allpkts])))
+        injector.run()
+        return injector
 
     def out_json(self):
         allconds = []
@@ -238,6 +447,13 @@ if __name__ == "__main__":
     parser.add_option("-k", "--no-hook", dest="hook", action="store_false", default=True, help="Disable flow table modifications")
     parser.add_option("-o", "--out-controller", dest="outcon", action="store_true", default=False, help="Make the switches send the packets to the controller")
     parser.add_option("-s", "--samples", dest="samples", metavar="SAMPLES", help="Samples per test packet, default=1")
+    parser.add_option("-n", "--no-analysis", dest="analyze", action="store_false", default=True, help="Disable the static analysis of path constraints")
+    parser.add_option("-S", "--snapshots", dest="snapshots", metavar="DIR", help="Keep the snapshots of the hooked flow tables in this directory, so that the next runs only modify the flows that changed")
+    parser.add_option("-j", "--of-stats", dest="ofstats", metavar="FILE", help="Write the OpenFlow channel statistics (messages, bytes, round trip times) to this JSON file")
+    parser.add_option("-p", "--probes", dest="probes", metavar="FILE", default="probes.json", help="Write the index of the probe ids to this file, for the collector and the checker, default=probes.json")
+    parser.add_option("-R", "--rate", dest="rate", metavar="PPS", help="Inject at most PPS packets per second overall, default=unlimited")
+    parser.add_option("-W", "--switch-rate", dest="switch_rate", metavar="PPS", help="Inject at most PPS packets per second in each switch, default=unlimited")
+    parser.add_option("-3", "--openflow13", dest="of13", action="store_true", default=False, help="Talk OpenFlow 1.3 and hook the switches with a single postcard rule in table 0, the production flows must start in table 1")
 
     options, args = parser.parse_args()
     if options.cid is None:
@@ -249,9 +465,31 @@ if __name__ == "__main__":
     else:
         samples = int(options.samples)
 
-    g = Generator(cid=int(options.cid), rules=options.rules, topo=options.topo, mapping=options.mapping, samples=samples)
+    rate = None
+    if options.rate is not None:
+        rate = float(options.rate)
+    switch_rate = None
+    if options.switch_rate is not None:
+        switch_rate = float(options.switch_rate)
+
+    ofstats = None
+    if options.ofstats is not None:
+        ofstats = OFlowStats()
+
+    g = Generator(cid=int(options.cid), rules=options.rules, topo=options.topo, mapping=options.mapping, samples=samples, analyze=options.analyze, of13=options.of13, snapshots=options.snapshots, ofstats=ofstats)
 
+    g.sessions.start()
     if options.hook:
         g.hook_switches()
     g.generate_packets()
-    g.send_packets(options.outcon)
+    g.probes.index.save(options.probes)
+    injector = g.send_packets(options.outcon, rate, switch_rate)
+    injector.dump()
+    g.sessions.close()
+    g.sessions.dump()
+
+    if ofstats is not None:
+        ofstats.dump()
+        f = open(options.ofstats, 'w')
+        json.dump(ofstats.snapshot(), f, indent=2, sort_keys=True)
+        f.close()
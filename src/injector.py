@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import sys, threading
+from time import time, sleep
+from oflownet import *
+
+"""
+Rate controlled probe injection. The packets to inject are queued per
+switch and sent by one thread per datapath over the sessions of a
+SessionPool, so that a slow control channel does not hold back the
+others. Each switch is paced by its own token bucket, and all of them by
+a global one capping the packets per second of the whole run
+"""
+
+class TokenBucket:
+    """
+    @rate tokens per second, at most @burst of them saved up. Shared by
+    several threads
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        if burst is None:
+            burst = max(1, int(rate/100)) # 10ms of traffic
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time()
+        self.lock = threading.Lock()
+
+    def take(self, n):
+        """ Take up to @n tokens, return (tokens taken, seconds until the next one if none) """
+        with self.lock:
+            now = time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+            self.last = now
+            got = min(n, int(self.tokens))
+            if got > 0:
+                self.tokens -= got
+                return got, 0
+            return 0, (1 - self.tokens)/self.rate
+
+    def give(self, n):
+        """ Return @n tokens taken but not used """
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + n)
+
+class Injector:
+    """
+    Sends the packets queued with add() through the SessionPool
+    @sessions, at most @rate packets per second overall and
+    @switch_rate per switch (None for no limit), at most @batch packets
+    per session use
+    """
+    def __init__(self, sessions, rate=None, switch_rate=None, batch=64):
+        self.sessions = sessions
+        self.rate = rate
+        self.switch_rate = switch_rate
+        self.batch = batch
+        self.bucket = None      # global TokenBucket
+        if rate is not None:
+            self.bucket = TokenBucket(rate)
+        self.queues = {}        # node -> [(inport, packet, outport)]
+        self.order = []         # nodes in the order of their first packet
+
+        # per switch counters
+        self.sent = {}
+        self.failed = {}
+        self.elapsed = {}
+        self.wall = 0
+
+    def add(self, node, data, outport=OFP_Port_No.OFPP_TABLE, inport=0):
+        q = self.queues.get(node)
+        if q is None:
+            q = self.queues[node] = []
+            self.order.append(node)
+        q.append((inport, data, outport))
+
+    def __len__(self):
+        return sum([len(q) for q in self.queues.values()])
+
+    def run(self):
+        """ Send all the queued packets and wait for the end of the injection """
+        threads = []
+        t0 = time()
+        for node in self.order:
+            th = threading.Thread(target=self.inject, args=(node,), name='inject-s'+str(node))
+            th.daemon = True
+            th.start()
+            threads.append(th)
+        for th in threads:
+            th.join()
+        self.wall = time() - t0
+        self.queues = {}
+        self.order = []
+
+    def inject(self, node):
+        """ Send the packets queued for @node, paced by its bucket and the global one """
+        queue = self.queues[node]
+        bucket = None
+        if self.switch_rate is not None:
+            bucket = TokenBucket(self.switch_rate)
+        sent = failed = 0
+        i = 0
+        t0 = time()
+        while i < len(queue):
+            n = min(self.batch, len(queue) - i)
+            if bucket is not None:
+                n, wait = bucket.take(n)
+                if n == 0:
+                    sleep(wait)
+                    continue
+            if self.bucket is not None:
+                got, wait = self.bucket.take(n)
+                if got < n and bucket is not None:
+                    bucket.give(n - got)
+                if got == 0:
+                    sleep(wait)
+                    continue
+                n = got
+
+            pkts = queue[i:i+n]
+            i += n
+            done = [0] # packets written, a new session resumes after them
+            def send(ofnet):
+                while done[0] < len(pkts):
+                    inport, data, outport = pkts[done[0]]
+                    ofnet.packet_out(inport, data, outport)
+                    done[0] += 1
+            try:
+                self.sessions.run(node, send, retry=True)
+            except RuntimeError, e:
+                sys.stderr.write('Warning: could not inject %d packets at s%s: %s\n' % (n - done[0], str(node), str(e)))
+                failed += n - done[0]
+            sent += done[0]
+
+        self.sent[node] = sent
+        self.failed[node] = failed
+        self.elapsed[node] = time() - t0
+
+    def target(self, nodes):
+        """ Target rate of the injection on @nodes switches, None if unlimited """
+        rates = []
+        if self.switch_rate is not None:
+            rates.append(self.switch_rate*nodes)
+        if self.rate is not None:
+            rates.append(self.rate)
+        if len(rates) == 0:
+            return None
+        return min(rates)
+
+    def report(self):
+        """ Packets sent and failed, achieved and target rates (packets per second), overall and per switch """
+        switches = {}
+        for node in self.sent:
+            elapsed = self.elapsed[node]
+            switches[node] = {'sent': self.sent[node], 'failed': self.failed[node], 'time_s': elapsed,
+                              'rate': self.sent[node]/elapsed if elapsed > 0 else 0,
+                              'target': self.target(1)}
+        sent = sum(self.sent.values())
+        return {'sent': sent, 'failed': sum(self.failed.values()), 'time_s': self.wall,
+                'rate': sent/self.wall if self.wall > 0 else 0,
+                'target': self.target(len(self.sent)),
+                'switches': switches}
+
+    def dump(self):
+        r = self.report()
+        target = 'unlimited' if r['target'] is None else '%.0f pps' % (r['target'])
+        print 'Injection: %d packets sent (%d failed) to %d switches in %.3fs, %.0f pps (target %s)' % (r['sent'], r['failed'], len(r['switches']), r['time_s'], r['rate'], target)
+        for node, s in sorted(r['switches'].items()):
+            target = 'unlimited' if s['target'] is None else '%.0f pps' % (s['target'])
+            print '  s%s: %d sent, %d failed, %.0f pps (target %s)' % (str(node), s['sent'], s['failed'], s['rate'], target)
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import os, sys, errno, fcntl, socket, select, threading
+from collections import deque
+from time import time
+from oflownet import *
+
+"""
+Event-driven OpenFlow 1.0 client. A single background thread multiplexes
+the connections to many switches with poll(): it writes the queued
+messages, frames the received ones, answers echo requests and completes
+the pending requests of each connection, matched to their replies by xid.
+Requests can be issued from any thread and return an OFlowFuture.
+"""
+
+class OFlowFuture:
+    """
+    Result of a request, set by the event loop thread once its reply (or
+    an error) is received
+    """
+    def __init__(self, xid):
+        self.xid = xid
+        self.value = None
+        self.error = None
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    def done(self):
+        return self.event.is_set()
+
+    def finish(self, value, error=None):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.value = value
+            self.error = error
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for f in callbacks:
+            f(self)
+
+    def add_done_callback(self, f):
+        """ Call f(future) once done, from the event loop thread (now if already done) """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(f)
+                return
+        f(self)
+
+    def result(self, timeout=None):
+        """ Wait for the reply and return it, raise RuntimeError on error or timeout """
+        if not self.event.wait(timeout):
+            raise RuntimeError("request %d timed out" % (self.xid))
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return self.value
+
+class OFlowConnection(OFlowNet):
+    """
+    Connection to a switch driven by an OFlowClient. The message builders
+    of OFlowNet only queue their message, which is written by the event
+    loop thread
+    """
+    def __init__(self, client, sock, name=None, stats=None):
+        OFlowNet.__init__(self, stats)
+        self.client = client
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.name = name if name is not None else str(self.fd)
+        self.lock = threading.RLock()
+        self.obuf = bytearray()     # bytes waiting to be written
+        self.pending = {}           # xid -> (future, reply bodies, parse function)
+        self.errors = deque(maxlen=1024) # (xid, type, code) of unsolicited errors
+        self.closing = False        # close once the queued bytes are written
+        self.closed = False
+
+    def send(self, msg):
+        """ Queue @msg for the event loop thread """
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("connection to %s closed" % (self.name))
+            self.obuf += msg
+            if self.stats is not None:
+                self.stats.on_send(msg)
+        self.client.update(self)
+
+    def request(self, build, args=(), parse=None):
+        """
+        Send a request with the OFlowNet builder @build(*args), which
+        returns the xid of the message, and return the future of its
+        reply: the list of the reply bodies (several for a multipart
+        stats reply), or parse(bodies) if @parse is given
+        """
+        with self.lock: # the reply cannot be dispatched before registration
+            xid = build(*args)
+            f = OFlowFuture(xid)
+            self.pending[xid] = (f, [], parse)
+        return f
+
+    def request_flows(self):
+        """ Future of the list of flow entries, see OFlowNet.parse_flow """
+        return self.request(self.dump_flows, parse=self.parse_flow_replies)
+
+    def request_barrier(self):
+        """ Future set once the switch has processed the previous messages """
+        return self.request(self.barrier)
+
+    def request_echo(self, data=''):
+        return self.request(self.echo, (data,))
+
+    def parse_flow_replies(self, bodies):
+        flows = []
+        for body in bodies:
+            offset = OFP_Stats_Reply.length
+            while offset < len(body):
+                plen, flow = self.parse_flow(body, offset)
+                flows.append(flow)
+                offset += plen
+        return flows
+
+    def disconnect(self):
+        """ Close the connection once the queued messages are written """
+        self.closing = True
+        self.client.update(self)
+
+    def on_readable(self):
+        try:
+            self.fill()
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            raise
+
+        while True:
+            m = self.next_message()
+            if m is None:
+                break
+            self.dispatch(m[0], m[1])
+
+    def dispatch(self, hdr, body):
+        t = hdr.get('type')
+        xid = hdr.get('xid')
+
+        if t == OFP_Type.OFPT_ECHO_REQUEST:
+            reply = OFP_Header(OFP_Type.OFPT_ECHO_REPLY, hdr.get('length'))
+            reply.set('xid', xid)
+            self.send(reply.pack()+body.tobytes())
+            return
+        if t == OFP_Type.OFPT_HELLO:
+            return
+
+        with self.lock:
+            entry = self.pending.get(xid)
+        if entry is None:
+            if t == OFP_Type.OFPT_ERROR:
+                ofp_error = OFP_Error()
+                ofp_error.unpack_from(body)
+                self.errors.append((xid, ofp_error.get('type'), ofp_error.get('code')))
+            return
+
+        f, bodies, parse = entry
+        if t == OFP_Type.OFPT_ERROR:
+            ofp_error = OFP_Error()
+            ofp_error.unpack_from(body)
+            error = "switch %s: error type %d code %d" % (self.name, ofp_error.get('type'), ofp_error.get('code'))
+        else:
+            error = None
+            bodies.append(body.tobytes())
+            if t == OFP_Type.OFPT_STATS_REPLY:
+                flags = struct.unpack_from('>H', body, 2)[0]
+                if flags & OFP_Stats_Reply_Flags.OFPSF_REPLY_MORE:
+                    return
+
+        with self.lock:
+            del self.pending[xid]
+        if error is not None or parse is None:
+            f.finish(bodies, error)
+            return
+        try:
+            value = parse(bodies)
+        except (RuntimeError, struct.error), e:
+            f.finish(None, "switch %s: %s" % (self.name, e))
+            return
+        f.finish(value)
+
+    def flush(self):
+        """ Write the queued bytes, return True if some are left """
+        with self.lock:
+            while len(self.obuf) > 0:
+                try:
+                    n = self.sock.send(buffer(self.obuf))
+                except socket.error, e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                        return True
+                    raise
+                del self.obuf[:n]
+            return False
+
+    def close(self, reason):
+        """ Close the socket and fail the pending requests """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending = self.pending
+            self.pending = {}
+            self.sock.close()
+        for f, _, _ in pending.itervalues():
+            f.finish(None, "connection to %s closed: %s" % (self.name, reason))
+
+class OFlowClient:
+    """
+    Event loop thread handling any number of OFlowConnection. With an
+    OFlowStats @stats, each connection is instrumented under its name
+    """
+
+    # poll timeout in ms
+    POLL_TIMEOUT = 1000
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.poller = select.poll()
+        self.conns = {}         # fd -> registered connection
+        self.lock = threading.Lock()
+        self.dirty = set()      # connections whose registration must be updated
+        self.running = False
+        self.thread = None
+
+        # self-pipe to wake the loop up when a connection has to be updated
+        self.wake_r, self.wake_w = os.pipe()
+        for fd in (self.wake_r, self.wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.poller.register(self.wake_r, select.POLLIN)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='oflowclient')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the event loop and close all the connections """
+        self.running = False
+        self.wakeup()
+        if self.thread is not None:
+            self.thread.join()
+        for conn in self.conns.values():
+            self.drop(conn, 'client stopped')
+        with self.lock:
+            for conn in self.dirty:
+                conn.close('client stopped')
+            self.dirty = set()
+
+    def connect(self, host, port, timeout=10):
+        """ Connect to the switch at @host:@port and return its OFlowConnection """
+        sock = socket.create_connection((host, port), timeout)
+        return self.attach(sock, '%s:%d' % (host, port))
+
+    def attach(self, sock, name=None):
+        """ Drive the connected socket @sock, the HELLO message is sent first """
+        sock.setblocking(0)
+        stats = None
+        if self.stats is not None:
+            stats = self.stats.switch(name if name is not None else str(sock.fileno()))
+        conn = OFlowConnection(self, sock, name, stats)
+        conn.send(OFP_Header(OFP_Type.OFPT_HELLO, OFP_Header.length).pack())
+        return conn
+
+    def update(self, conn):
+        """ Have the loop update the poll registration of @conn """
+        with self.lock:
+            self.dirty.add(conn)
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            os.write(self.wake_w, 'x')
+        except OSError, e:
+            if e.errno != errno.EAGAIN: # already pending
+                raise
+
+    def drop(self, conn, reason):
+        if conn.fd in self.conns:
+            self.poller.unregister(conn.fd)
+            del self.conns[conn.fd]
+        conn.close(reason)
+
+    def run(self):
+        while self.running:
+            with self.lock:
+                dirty = self.dirty
+                self.dirty = set()
+            for conn in dirty:
+                if conn.closed:
+                    continue
+                if conn.closing and len(conn.obuf) == 0:
+                    self.drop(conn, 'closed by the client')
+                    continue
+                events = select.POLLIN
+                if len(conn.obuf) > 0:
+                    events |= select.POLLOUT
+                if conn.fd in self.conns:
+                    self.poller.modify(conn.fd, events)
+                else:
+                    self.conns[conn.fd] = conn
+                    self.poller.register(conn.fd, events)
+
+            try:
+                events = self.poller.poll(OFlowClient.POLL_TIMEOUT)
+            except select.error, e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, ev in events:
+                if fd == self.wake_r:
+                    try:
+                        os.read(self.wake_r, 4096)
+                    except OSError:
+                        pass
+                    continue
+
+                conn = self.conns.get(fd)
+                if conn is None:
+                    continue
+                try:
+                    if ev & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                        conn.on_readable()
+                    if ev & select.POLLOUT and not conn.flush():
+                        if conn.closing:
+                            self.drop(conn, 'closed by the client')
+                        else:
+                            self.poller.modify(fd, select.POLLIN)
+                except (socket.error, RuntimeError, struct.error), e:
+                    self.drop(conn, str(e))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print 'Usage: %s <host:port> [host:port ...]' % (sys.argv[0])
+        sys.exit(-1)
+
+    client = OFlowClient()
+    client.start()
+
+    t0 = time()
+    requests = []
+    for arg in sys.argv[1:]:
+        host, port = arg.rsplit(':', 1)
+        conn = client.connect(host, int(port))
+        requests.append((conn, conn.request_flows()))
+
+    for conn, f in requests:
+        try:
+            print '%s: %d flows' % (conn.name, len(f.result(30)))
+        except RuntimeError, e:
+            print '%s: %s' % (conn.name, e)
+    print 'Done in %.3fs' % (time() - t0)
+
+    client.stop()
@@ -4,7 +4,8 @@
 @author: David Lebrun <dav.lebrun@gmail.com>
 """
 
-import struct, socket, re, random
+import struct, socket, random
+from time import time
 
 """
 Partial implementation of OpenFlow 1.0 protocol
@@ -95,6 +96,22 @@ OFP_Stats_Types =  enum('OFPST_DESC',
                         'OFPST_QUEUE',
                         OFPST_VENDOR = 0xffff)
 
+OFP_Stats_Reply_Flags = enum(OFPSF_REPLY_MORE = 1 << 0)
+
+OFP_Error_Type = enum('OFPET_HELLO_FAILED',
+                      'OFPET_BAD_REQUEST',
+                      'OFPET_BAD_ACTION',
+                      'OFPET_FLOW_MOD_FAILED',
+                      'OFPET_PORT_MOD_FAILED',
+                      'OFPET_QUEUE_OP_FAILED')
+
+OFP_Bad_Request_Code = enum('OFPBRC_BAD_VERSION',
+                            'OFPBRC_BAD_TYPE',
+                            'OFPBRC_BAD_STAT')
+
+OFP_Bad_Action_Code = enum('OFPBAC_BAD_TYPE',
+                           'OFPBAC_BAD_LEN')
+
 OFP_Flow_Wildcards =   enum(OFPFW_IN_PORT       = 1 << 0,
                             OFPFW_DL_VLAN       = 1 << 1,
                             OFPFW_DL_SRC        = 1 << 2,
@@ -103,234 +120,342 @@ OFP_Flow_Wildcards =   enum(OFPFW_IN_PORT       = 1 << 0,
                             OFPFW_NW_PROTO      = 1 << 5,
                             OFPFW_TP_SRC        = 1 << 6,
                             OFPFW_TP_DST        = 1 << 7,
+                            OFPFW_NW_SRC_SHIFT  = 8,
+                            OFPFW_NW_SRC_MASK   = 0x3f << 8,
+                            OFPFW_NW_DST_SHIFT  = 14,
+                            OFPFW_NW_DST_MASK   = 0x3f << 14,
+                            OFPFW_DL_VLAN_PCP   = 1 << 20,
+                            OFPFW_NW_TOS        = 1 << 21,
                             OFPFW_ALL           = ((1 << 22) - 1))
 
+class BinaryLayout(type):
+    """
+    Metaclass of the binary headers: the (name, format) list in the _fields
+    attribute of a class is compiled once into a struct.Struct, so that
+    instances only hold their list of values. Fields whose format is a pad
+    ('x') take room in the layout but have no value
+    """
+    def __new__(mcs, name, bases, dct):
+        dct.setdefault('__slots__', ())
+        cls = type.__new__(mcs, name, bases, dct)
+        fields = [(n, t) for n, t in cls._fields if not t.endswith('x')]
+        cls._names = tuple([n for n, _ in fields])
+        cls._index = dict((n, i) for i, n in enumerate(cls._names))
+        cls._defaults = tuple(['' if t[0].isdigit() else 0 for _, t in fields])
+        cls._struct = struct.Struct('>'+''.join([t for _, t in cls._fields]))
+        cls._partial = {}   # field count -> struct of the first fields
+        cls.length = cls._struct.size
+        return cls
+
 class BinaryHeader(object):
+    __metaclass__ = BinaryLayout
+    __slots__ = ('_vals',)
+    _fields = []
+
     def __init__(self):
-        self.values = []
-        self.data = {}
-
-    def add_value(self, n, t):
-        self.values.append((n, t))
-        r = re.search('^[0-9]', t)
-        if r is not None:
-            self.data[n] = ''
-        else:
-            self.data[n] = 0
+        self._vals = list(self._defaults)
 
     def set(self, n, v):
-        self.data[n] = v
+        self._vals[self._index[n]] = v
 
     def get(self, n):
-        return self.data[n]
+        return self._vals[self._index[n]]
 
     def pack(self):
-        out = ''
-        for n, t in self.values:
-            out += struct.pack('>'+t, self.data[n])
-        
-        return out
+        return self._struct.pack(*self._vals)
+
+    def pack_into(self, buf, offset=0):
+        """ Write the header at @offset of the writable buffer @buf """
+        self._struct.pack_into(buf, offset, *self._vals)
+
+    def unpack_from(self, buf, offset=0):
+        """ Read the header at @offset of @buf (string, buffer or memoryview) """
+        self._vals = list(self._struct.unpack_from(buf, offset))
 
     def read(self, data, count=0):
-        fmt = '>'
-        i = 0
-        for _, t in self.values:
-            if count > 0 and i >= count:
-                break
-            fmt += t
-            i += 1
-        
-        rec = struct.unpack(fmt, data)
-        for i in range(len(rec)):
-            self.data[self.values[i][0]] = rec[i]
+        if count <= 0 or count >= len(self._names):
+            self._vals = list(self._struct.unpack(data))
+            return
+
+        st = self._partial.get(count)
+        if st is None:
+            fmt = '>'
+            i = 0
+            for _, t in self._fields:
+                if i >= count:
+                    break
+                fmt += t
+                if not t.endswith('x'):
+                    i += 1
+            st = struct.Struct(fmt)
+            self._partial[count] = st
+        self._vals[:count] = st.unpack(data)
 
     def dump(self):
-        for n, _ in self.values:
-            if isinstance(self.data[n], int):
-                print n+': '+str(self.data[n])
+        for n, v in zip(self._names, self._vals):
+            if isinstance(v, (int, long)):
+                print n+': '+str(v)
             else:
-                print n+': '+(' '.join(x.encode('hex') for x in self.data[n]))
+                print n+': '+(' '.join(x.encode('hex') for x in v))
 
 class OFP_Header(BinaryHeader):
-    def __init__(self, t=0, l=0):
-        p = super(OFP_Header, self)
-        p.__init__()
-        p.add_value('version', 'B')
-        p.add_value('type', 'B')
-        p.add_value('length', 'H')
-        p.add_value('xid', 'I')
-        self.length = 8
+    _fields = [
+        ('version', 'B'),
+        ('type', 'B'),
+        ('length', 'H'),
+        ('xid', 'I'),
+    ]
 
+    def __init__(self, t=0, l=0):
+        super(OFP_Header, self).__init__()
         self.set('version', 1)
         self.set('type', t)
         self.set('length', l)
         self.set('xid', random.getrandbits(32))
 
+class OFP_Switch_Features(BinaryHeader):
+    # struct ofp_header header
+    _fields = [
+        ('datapath_id', 'Q'),
+        ('n_buffers', 'I'),
+        ('n_tables', 'B'),
+        ('pad', '3x'),
+        ('capabilities', 'I'),
+        ('actions', 'I'),
+    ]
+    # struct ofp_phy_port ports[0]
+
+class OFP_Phy_Port(BinaryHeader):
+    _fields = [
+        ('port_no', 'H'),
+        ('hw_addr', str(OFP_ETH_ALEN)+'s'),
+        ('name', '16s'),
+        ('config', 'I'),
+        ('state', 'I'),
+        ('curr', 'I'),
+        ('advertised', 'I'),
+        ('supported', 'I'),
+        ('peer', 'I'),
+    ]
+
 class OFP_Match(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Match, self)
-        p.__init__()
-        p.add_value('wildcards', 'I')
-        p.add_value('in_port', 'H')
-        p.add_value('dl_src', str(OFP_ETH_ALEN)+'s')
-        p.add_value('dl_dst', str(OFP_ETH_ALEN)+'s')
-        p.add_value('dl_vlan', 'H')
-        p.add_value('dl_vlan_pcp', 'B')
-        p.add_value('pad1', 'B')
-        p.add_value('dl_type', 'H')
-        p.add_value('nw_tos', 'B')
-        p.add_value('nw_proto', 'B')
-        p.add_value('pad2', '2s')
-        p.add_value('nw_src', 'I')
-        p.add_value('nw_dst', 'I')
-        p.add_value('tp_src', 'H')
-        p.add_value('tp_dst', 'H')
-        self.length = 40
+    _fields = [
+        ('wildcards', 'I'),
+        ('in_port', 'H'),
+        ('dl_src', str(OFP_ETH_ALEN)+'s'),
+        ('dl_dst', str(OFP_ETH_ALEN)+'s'),
+        ('dl_vlan', 'H'),
+        ('dl_vlan_pcp', 'B'),
+        ('pad1', 'B'),
+        ('dl_type', 'H'),
+        ('nw_tos', 'B'),
+        ('nw_proto', 'B'),
+        ('pad2', '2s'),
+        ('nw_src', 'I'),
+        ('nw_dst', 'I'),
+        ('tp_src', 'H'),
+        ('tp_dst', 'H'),
+    ]
 
 class OFP_Action_Header(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Action_Header, self)
-        p.__init__()
-        p.add_value('type', 'H')
-        p.add_value('len', 'H')
-        p.add_value('pad', '4s')
-        self.length = 8
+    _fields = [
+        ('type', 'H'),
+        ('len', 'H'),
+        ('pad', '4s'),
+    ]
 
 class OFP_Action_Output(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Action_Output, self)
-        p.__init__()
-        p.add_value('type', 'H')
-        p.add_value('len', 'H')
-        p.add_value('port', 'H')
-        p.add_value('max_len', 'H')
-        self.length = 8
+    _fields = [
+        ('type', 'H'),
+        ('len', 'H'),
+        ('port', 'H'),
+        ('max_len', 'H'),
+    ]
 
 class OFP_Action_Mod_Dl_Dst(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Action_Mod_Dl_Dst, self)
-        p.__init__()
-        p.add_value('type', 'H')
-        p.add_value('len', 'H')
-        p.add_value('dl_dst', '6s')
-        p.add_value('pad', '6s')
-        self.length = 16
+    _fields = [
+        ('type', 'H'),
+        ('len', 'H'),
+        ('dl_dst', '6s'),
+        ('pad', '6s'),
+    ]
 
 class OFP_Flow_Mod(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Flow_Mod, self)
-        p.__init__()
-        # struct ofp_header header
-        # struct ofp_match match
-        p.add_value('cookie', 'Q')
-        p.add_value('command', 'H')
-        p.add_value('idle_timeout', 'H')
-        p.add_value('hard_timeout', 'H')
-        p.add_value('priority', 'H')
-        p.add_value('buffer_id', 'I')
-        p.add_value('out_port', 'H')
-        p.add_value('flags', 'H')
-        self.length = 24
-        # struct ofp_action_header actions[0]
+    # struct ofp_header header
+    # struct ofp_match match
+    _fields = [
+        ('cookie', 'Q'),
+        ('command', 'H'),
+        ('idle_timeout', 'H'),
+        ('hard_timeout', 'H'),
+        ('priority', 'H'),
+        ('buffer_id', 'I'),
+        ('out_port', 'H'),
+        ('flags', 'H'),
+    ]
+    # struct ofp_action_header actions[0]
 
 class OFP_Packet_Out(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Packet_Out, self)
-        p.__init__()
-        # struct ofp_header header
-        p.add_value('buffer_id', 'I')
-        p.add_value('in_port', 'H')
-        p.add_value('actions_len', 'H')
-        self.length = 8
-        # struct ofp_action_header actions[0]
-        # uint8_t data[0]
+    # struct ofp_header header
+    _fields = [
+        ('buffer_id', 'I'),
+        ('in_port', 'H'),
+        ('actions_len', 'H'),
+    ]
+    # struct ofp_action_header actions[0]
+    # uint8_t data[0]
 
 class OFP_Stats_Request(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Stats_Request, self)
-        p.__init__()
-        # struct ofp_header header
-        p.add_value('type', 'H')
-        p.add_value('flags', 'H')
-        self.length = 4
-        # uint8_t body[0]
+    # struct ofp_header header
+    _fields = [
+        ('type', 'H'),
+        ('flags', 'H'),
+    ]
+    # uint8_t body[0]
 
 class OFP_Stats_Reply(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Stats_Reply, self)
-        p.__init__()
-        p.add_value('type', 'H')
-        p.add_value('flags', 'H')
-        self.length = 4
-        # uint8_t body[0]
+    _fields = [
+        ('type', 'H'),
+        ('flags', 'H'),
+    ]
+    # uint8_t body[0]
 
 class OFP_Flow_Stats_Request(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Flow_Stats_Request, self)
-        p.__init__()
-        # struct ofp_match match
-        p.add_value('table_id', 'B')
-        p.add_value('pad', 'B')
-        p.add_value('out_port', 'H')
-        self.length = 4
+    # struct ofp_match match
+    _fields = [
+        ('table_id', 'B'),
+        ('pad', 'B'),
+        ('out_port', 'H'),
+    ]
 
 class OFP_Flow_Stats(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Flow_Stats, self)
-        p.__init__()
-        p.add_value('length', 'H')
-        p.add_value('table_id', 'B')
-        p.add_value('pad', 'B')
-        # struct ofp_match match
-        p.add_value('duration_sec', 'I')
-        p.add_value('duration_nsec', 'I')
-        p.add_value('priority', 'H')
-        p.add_value('idle_timeout', 'H')
-        p.add_value('hard_timeout', 'H')
-        p.add_value('pad2', '6s')
-        p.add_value('cookie', 'Q')
-        p.add_value('packet_count', 'Q')
-        p.add_value('byte_count', 'Q')
-        self.length = 48 # without ofp_match
-        # struct ofp_action_header actions[0]
+    _fields = [
+        ('length', 'H'),
+        ('table_id', 'B'),
+        ('pad', 'B'),
+        ('match', '40x'), # struct ofp_match match, read with OFP_Match
+        ('duration_sec', 'I'),
+        ('duration_nsec', 'I'),
+        ('priority', 'H'),
+        ('idle_timeout', 'H'),
+        ('hard_timeout', 'H'),
+        ('pad2', '6s'),
+        ('cookie', 'Q'),
+        ('packet_count', 'Q'),
+        ('byte_count', 'Q'),
+    ]
+    # struct ofp_action_header actions[0]
 
 class OFP_Error(BinaryHeader):
-    def __init__(self):
-        p = super(OFP_Error, self)
-        p.__init__()
-        p.add_value('type', 'H')
-        p.add_value('code', 'H')
-        # uint8_t data[0]
-        self.length = 4
+    _fields = [
+        ('type', 'H'),
+        ('code', 'H'),
+    ]
+    # uint8_t data[0]
 
 class OFlowNet:
     """
     Class handling a connection to an OpenFlow switch
     """
-    def __init__(self):
+
+    # initial size of the receive buffer
+    RECV_SIZE = 65536
+
+    # protocol version of the messages, see OFlowNet13
+    Header = OFP_Header
+    Type = OFP_Type
+
+    def __init__(self, stats=None):
         self.sock = None
         self.flows = []
+        self.stats = stats  # SwitchStats of the connection, None to disable
+        if stats is not None:
+            stats.set_types(self.Type)
+        self.rbuf = bytearray(OFlowNet.RECV_SIZE)   # receive buffer
+        self.rstart = 0     # first byte of rbuf not yet returned
+        self.rend = 0       # end of the received bytes in rbuf
+        self.failed = {}    # xid -> (type, code) of the errors received
 
     def connect(self, host, port):
+        t0 = time()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((host, port))
+        if self.stats is not None:
+            self.stats.add_time('connect', time() - t0)
 
     def disconnect(self):
         self.sock.close()
 
     def send(self, msg):
+        if self.stats is not None:
+            t0 = time()
         totalsent = 0
         while totalsent < len(msg):
             sent = self.sock.send(msg[totalsent:])
             if sent == 0:
                 raise RuntimeError("socket connection broken")
             totalsent += sent
+        if self.stats is not None:
+            self.stats.on_send(msg, time() - t0)
 
-    def recv(self):
-        chunk = self.sock.recv(65535)
-        if len(chunk) == 0:
+    def fill(self):
+        """ Append the bytes available on the socket to the receive buffer """
+        n = self.sock.recv_into(memoryview(self.rbuf)[self.rend:])
+        if n == 0:
             raise RuntimeError("socket connection broken(2)")
-        return chunk
+        self.rend += n
+
+    def next_message(self):
+        """
+        Return the next complete message of the receive buffer as a
+        (OFP_Header, body) tuple, or None if more bytes are needed. Messages
+        are framed by the length of their header, whatever the way the
+        stream was split by the socket. The body is a memoryview of the
+        receive buffer, only valid until the next call
+        """
+        hlen = OFP_Header.length
+        if self.rstart == self.rend:
+            self.rstart = self.rend = 0
+
+        avail = self.rend - self.rstart
+        mlen = hlen
+        if avail >= hlen:
+            mlen = struct.unpack_from('>H', self.rbuf, self.rstart+2)[0]
+            if mlen < hlen:
+                raise RuntimeError("invalid message length %d" % (mlen))
+            if avail >= mlen:
+                hdr = OFP_Header()
+                hdr.unpack_from(self.rbuf, self.rstart)
+                if self.stats is not None:
+                    self.stats.on_receive(hdr)
+                body = memoryview(self.rbuf)[self.rstart+hlen:self.rstart+mlen]
+                self.rstart += mlen
+                return hdr, body
+
+        # Move the partial message to the front of the buffer (to a new
+        # one if it does not fit) so that fill() can receive the rest of it
+        if self.rstart + mlen > len(self.rbuf):
+            buf = self.rbuf
+            if mlen > len(buf):
+                buf = bytearray(mlen)
+            buf[:avail] = self.rbuf[self.rstart:self.rend]
+            self.rbuf = buf
+            self.rstart = 0
+            self.rend = avail
+        return None
+
+    def recv(self):
+        """ Wait for the next message from the switch, see next_message() """
+        while True:
+            m = self.next_message()
+            if m is not None:
+                return m
+            self.fill()
+
+    def messages(self):
+        """ Generator of the messages received from the switch, see recv() """
+        while True:
+            yield self.recv()
 
     def dump_flows(self):
         ofp_match = OFP_Match()
@@ -347,7 +472,66 @@ class OFlowNet:
 
         ofp_hdr = OFP_Header(OFP_Type.OFPT_STATS_REQUEST, len(body)+8)
 
+        if self.stats is not None:
+            self.stats.on_request('stats', ofp_hdr.get('xid'))
         self.send(ofp_hdr.pack()+body)
+        return ofp_hdr.get('xid')
+
+    def flow_stats_parts(self):
+        """
+        Request the flow table and yield (body, offset, end) for each part
+        of the multipart reply until its last part (OFPSF_REPLY_MORE
+        cleared), the flow stats entries being between offset and end of
+        body, a memoryview only valid until the next part. The
+        connection must not be read from until the iteration is over
+        """
+        xid = self.dump_flows()
+        for hdr, msg in self.messages():
+            if hdr.get('type') == OFP_Type.OFPT_STATS_REPLY and hdr.get('xid') == xid:
+                ofp_streply = OFP_Stats_Reply()
+                ofp_streply.unpack_from(msg)
+                if ofp_streply.get('type') != OFP_Stats_Types.OFPST_FLOW:
+                    raise RuntimeError("unexpected stats type %d" % (ofp_streply.get('type')))
+
+                yield msg, ofp_streply.length, hdr.get('length') - hdr.length
+
+                if not ofp_streply.get('flags') & OFP_Stats_Reply_Flags.OFPSF_REPLY_MORE:
+                    return
+            elif hdr.get('type') == self.Type.OFPT_ECHO_REQUEST:
+                self.parse_ping(hdr, msg)
+            elif hdr.get('type') == self.Type.OFPT_ERROR:
+                self.parse_error(hdr, msg)
+                if hdr.get('xid') == xid:
+                    raise RuntimeError("flow stats request failed")
+
+    def iter_flows(self):
+        """
+        Request the flow table and yield its entries as they are received.
+        Each flow is a dict as in self.flows, which is left untouched, so
+        memory does not grow with the table size. The connection must not
+        be read from until the iteration is over
+        """
+        for msg, offset, end in self.flow_stats_parts():
+            while offset < end:
+                plen, flow = self.parse_flow(msg, offset)
+                yield flow
+                offset += plen
+
+    def barrier(self):
+        """ Send a barrier request and return its xid """
+        ofp_hdr = self.Header(self.Type.OFPT_BARRIER_REQUEST, OFP_Header.length)
+        if self.stats is not None:
+            self.stats.on_request('barrier', ofp_hdr.get('xid'))
+        self.send(ofp_hdr.pack())
+        return ofp_hdr.get('xid')
+
+    def echo(self, data=''):
+        """ Send an echo request and return its xid """
+        ofp_hdr = self.Header(self.Type.OFPT_ECHO_REQUEST, OFP_Header.length+len(data))
+        if self.stats is not None:
+            self.stats.on_request('echo', ofp_hdr.get('xid'))
+        self.send(ofp_hdr.pack()+data)
+        return ofp_hdr.get('xid')
 
     def packet_out(self, inport, pkt, outport=OFP_Port_No.OFPP_TABLE):
         # ofp_header + ofp_packet_out + ofp_action_header + data
@@ -368,21 +552,103 @@ class OFlowNet:
         ofp_hdr = OFP_Header(OFP_Type.OFPT_PACKET_OUT, len(body)+8)
 
         self.send(ofp_hdr.pack()+body)
+        return ofp_hdr.get('xid')
+
+    def pack_flow_mod(self, msg, offset, xid, ofp_match, ofp_flow_mod, actions):
+        """ Pack a FLOW_MOD message with @xid into @msg at @offset, return the offset after it """
+        # ofp_header + ofp_match + ofp_flow_mod + actions, packed in place
+        parts = [ofp_match, ofp_flow_mod] + actions
+        length = OFP_Header.length + sum([h.length for h in parts])
+
+        ofp_hdr = OFP_Header(OFP_Type.OFPT_FLOW_MOD, length)
+        ofp_hdr.set('xid', xid)
+        ofp_hdr.pack_into(msg, offset)
+        offset += OFP_Header.length
+        for h in parts:
+            h.pack_into(msg, offset)
+            offset += h.length
+        return offset
+
+    def flow_mod_length(self, ofp_match, ofp_flow_mod, actions):
+        return OFP_Header.length + ofp_match.length + ofp_flow_mod.length + sum([a.length for a in actions])
 
     def mod_flow(self, ofp_match, ofp_flow_mod, actions):
-        actpack = ''
-        for act in actions:
-            actpack += act.pack()
-
-        body = ofp_match.pack() + ofp_flow_mod.pack() + actpack
-
-        ofp_hdr = OFP_Header(OFP_Type.OFPT_FLOW_MOD, len(body)+8)
-        self.send(ofp_hdr.pack()+body)
+        xid = random.getrandbits(32)
+        msg = bytearray(self.flow_mod_length(ofp_match, ofp_flow_mod, actions))
+        self.pack_flow_mod(msg, 0, xid, ofp_match, ofp_flow_mod, actions)
+        self.send(msg)
+        return xid
+
+    def send_flow_mods(self, mods):
+        """
+        Send the flow modifications @mods, a list of (ofp_match,
+        ofp_flow_mod, actions), followed by a barrier request, in a single
+        write. The messages get consecutive xids. Return the list of their
+        xids and the xid of the barrier, without waiting for the replies
+        """
+        length = OFP_Header.length
+        for m in mods:
+            length += self.flow_mod_length(*m)
+        msg = bytearray(length)
+
+        base = random.getrandbits(32)
+        xids = []
+        offset = 0
+        for i, m in enumerate(mods):
+            xid = (base + i) & 0xffffffff
+            offset = self.pack_flow_mod(msg, offset, xid, *m)
+            xids.append(xid)
+
+        bxid = (base + len(mods)) & 0xffffffff
+        ofp_hdr = self.Header(self.Type.OFPT_BARRIER_REQUEST, OFP_Header.length)
+        ofp_hdr.set('xid', bxid)
+        ofp_hdr.pack_into(msg, offset)
+
+        if self.stats is not None:
+            self.stats.on_request('barrier', bxid)
+        self.send(msg)
+        return xids, bxid
+
+    def wait_barrier(self, xid):
+        """
+        Read messages until the reply to the barrier request @xid. The
+        errors received meanwhile are recorded in self.failed, and echo
+        requests are answered
+        """
+        for hdr, msg in self.messages():
+            t = hdr.get('type')
+            if t == self.Type.OFPT_BARRIER_REPLY and hdr.get('xid') == xid:
+                return
+            elif t == self.Type.OFPT_ECHO_REQUEST:
+                self.parse_ping(hdr, msg)
+            elif t == self.Type.OFPT_ERROR:
+                self.parse_error(hdr, msg)
+
+    def mod_flows(self, mods, batch=512):
+        """
+        Apply the flow modifications @mods, a list of (ofp_match,
+        ofp_flow_mod, actions), pipelined by batches of @batch messages
+        each terminated by a barrier. Once the barrier is answered, every
+        message of the batch has been processed, so the errors received
+        until then are all the errors of the batch. Return, for each
+        modification in order, None if it succeeded or the (type, code) of
+        its error
+        """
+        report = []
+        for i in range(0, len(mods), batch):
+            xids, bxid = self.send_flow_mods(mods[i:i+batch])
+            self.wait_barrier(bxid)
+            report.extend(self.flow_mod_errors(xids))
+        return report
+
+    def flow_mod_errors(self, xids):
+        """ Remove and return the errors of the messages @xids from self.failed (None if none) """
+        return [self.failed.pop(xid, None) for xid in xids]
 
     def parse_hello(self, hdr, msg):
         hdr2 = OFP_Header()
         hdr2.set('version', hdr.get('version'))
-        hdr2.set('type', OFP_Type.OFPT_HELLO)
+        hdr2.set('type', self.Type.OFPT_HELLO)
         hdr2.set('length', hdr2.length)
         hdr2.set('xid', hdr.get('xid'))
         self.send(hdr2.pack())
@@ -391,78 +657,87 @@ class OFlowNet:
         print 'Ping'
         hdr2 = OFP_Header()
         hdr2.set('version', hdr.get('version'))
-        hdr2.set('type', OFP_Type.OFPT_ECHO_REPLY)
+        hdr2.set('type', self.Type.OFPT_ECHO_REPLY)
         hdr2.set('length', hdr.get('length'))
         hdr2.set('xid', hdr.get('xid'))
-        self.send(hdr2.pack()+msg[:(hdr.get('length')-hdr2.length)])
+        self.send(hdr2.pack()+msg[:(hdr.get('length')-hdr2.length)].tobytes())
 
     def parse_stats(self, hdr, msg):
         blen = hdr.get('length') - 8
 
         ofp_streply = OFP_Stats_Reply()
         offset = ofp_streply.length
-        ofp_streply.read(msg[:offset])
+        ofp_streply.unpack_from(msg)
 
         if ofp_streply.get('type') == OFP_Stats_Types.OFPST_FLOW:
             while offset < blen:
-                offset += self.parse_stats_flow(ofp_streply, msg[offset:])
+                offset += self.parse_stats_flow(ofp_streply, msg, offset)
         else:
             print 'Unknown stats type %d' % (ofp_streply.get('type'))
 
-    def parse_stats_flow(self, hdr, msg):
+    def parse_stats_flow(self, hdr, msg, offset=0):
+        plen, flow = self.parse_flow(msg, offset)
+        self.flows.append(flow)
+        return plen
+
+    def parse_flow(self, msg, offset=0):
+        """
+        Parse the flow stats entry at @offset of @msg, return its length
+        and a {"body", "match", "actions"} dict
+        """
         ofp_fwst = OFP_Flow_Stats()
         ofp_match = OFP_Match()
         ofp_action = OFP_Action_Header()
 
-        ofp_fwst.read(msg[:4]+msg[4+40:88])
-        ofp_match.read(msg[4:4+40])
+        ofp_fwst.unpack_from(msg, offset)
+        ofp_match.unpack_from(msg, offset+4)
 
         plen = ofp_fwst.get('length')
-        rlen = 88
+        rlen = ofp_fwst.length
+        if plen < rlen:
+            raise RuntimeError("invalid flow stats length %d" % (plen))
 
         actions = []
 
         while rlen < plen:
-            ofp_action.read(msg[rlen:rlen+ofp_action.length])
+            ofp_action.unpack_from(msg, offset+rlen)
             if ofp_action.get('type') == OFP_Action_Type.OFPAT_OUTPUT:
                 ofp_action_out = OFP_Action_Output()
-                ofp_action_out.read(msg[rlen:rlen+ofp_action_out.length])
+                ofp_action_out.unpack_from(msg, offset+rlen)
                 actions.append(ofp_action_out)
+            if ofp_action.get('len') < ofp_action.length:
+                raise RuntimeError("invalid action length %d" % (ofp_action.get('len')))
             rlen += ofp_action.get('len')
 
-        self.flows.append({"body": ofp_fwst, "match": ofp_match, "actions": actions})
-
-        return plen
+        return plen, {"body": ofp_fwst, "match": ofp_match, "actions": actions}
 
     def parse_error(self, hdr, msg):
         ofp_error = OFP_Error()
-        ofp_error.read(msg[:ofp_error.length])
+        ofp_error.unpack_from(msg)
+        self.failed[hdr.get('xid')] = (ofp_error.get('type'), ofp_error.get('code'))
         print 'Got error type %d code %d' % (ofp_error.get('type'), ofp_error.get('code'))
 
     def handshake(self):
-        msg = self.recv()
-        hdr = OFP_Header()
-        hdr.read(msg[:hdr.length])
+        t0 = time()
+        hdr, msg = self.recv()
 
-        if hdr.get('type') == OFP_Type.OFPT_HELLO:
-            self.parse_hello(hdr, msg[hdr.length:])
+        if hdr.get('type') == self.Type.OFPT_HELLO:
+            self.parse_hello(hdr, msg)
         else:
             print 'Failed handshake'
+        if self.stats is not None:
+            self.stats.add_time('handshake', time() - t0)
 
     def run(self, outcond=None):
-        while True:
-            msg = self.recv()
-            hdr = OFP_Header()
-            hdr.read(msg[:hdr.length])
-
+        for hdr, msg in self.messages():
             if hdr.get('type') == OFP_Type.OFPT_HELLO:
-                self.parse_hello(hdr, msg[hdr.length:])
+                self.parse_hello(hdr, msg)
             elif hdr.get('type') == OFP_Type.OFPT_ECHO_REQUEST:
-                self.parse_ping(hdr, msg[hdr.length:])
+                self.parse_ping(hdr, msg)
             elif hdr.get('type') == OFP_Type.OFPT_STATS_REPLY:
-                self.parse_stats(hdr, msg[hdr.length:])
+                self.parse_stats(hdr, msg)
             elif hdr.get('type') == OFP_Type.OFPT_ERROR:
-                self.parse_error(hdr, msg[hdr.length:])
+                self.parse_error(hdr, msg)
             else:
                 print 'Unknown command type %d' % (hdr.get('type'))
             print '\n'
@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import struct
+from oflownet import *
+
+"""
+Partial implementation of OpenFlow 1.3 protocol: OXM matches, flow
+modifications with instructions (goto_table, write/apply_actions) in any
+table, multipart flow stats and packet-outs. The connection handling is
+the one of OFlowNet, only the message layouts differ
+"""
+
+OFP13_VERSION = 0x04
+
+OFP13_Type = enum('OFPT_HELLO',
+                  'OFPT_ERROR',
+                  'OFPT_ECHO_REQUEST',
+                  'OFPT_ECHO_REPLY',
+                  'OFPT_EXPERIMENTER',
+                  'OFPT_FEATURES_REQUEST',
+                  'OFPT_FEATURES_REPLY',
+                  'OFPT_GET_CONFIG_REQUEST',
+                  'OFPT_GET_CONFIG_REPLY',
+                  'OFPT_SET_CONFIG',
+                  'OFPT_PACKET_IN',
+                  'OFPT_FLOW_REMOVED',
+                  'OFPT_PORT_STATUS',
+                  'OFPT_PACKET_OUT',
+                  'OFPT_FLOW_MOD',
+                  'OFPT_GROUP_MOD',
+                  'OFPT_PORT_MOD',
+                  'OFPT_TABLE_MOD',
+                  'OFPT_MULTIPART_REQUEST',
+                  'OFPT_MULTIPART_REPLY',
+                  'OFPT_BARRIER_REQUEST',
+                  'OFPT_BARRIER_REPLY')
+
+OFP13_Port_No = enum(OFPP_MAX        = 0xffffff00,
+                     OFPP_IN_PORT    = 0xfffffff8,
+                     OFPP_TABLE      = 0xfffffff9,
+                     OFPP_NORMAL     = 0xfffffffa,
+                     OFPP_FLOOD      = 0xfffffffb,
+                     OFPP_ALL        = 0xfffffffc,
+                     OFPP_CONTROLLER = 0xfffffffd,
+                     OFPP_LOCAL      = 0xfffffffe,
+                     OFPP_ANY        = 0xffffffff)
+
+OFPG_ANY = 0xffffffff       # any group, in flow stats requests
+OFPTT_ALL = 0xff            # all the tables, in flow stats requests
+OFP_NO_BUFFER = 0xffffffff
+
+OFP13_Multipart_Types = enum('OFPMP_DESC',
+                             'OFPMP_FLOW',
+                             'OFPMP_AGGREGATE',
+                             'OFPMP_TABLE',
+                             'OFPMP_PORT_STATS',
+                             'OFPMP_QUEUE',
+                             'OFPMP_GROUP',
+                             'OFPMP_GROUP_DESC',
+                             'OFPMP_GROUP_FEATURES',
+                             'OFPMP_METER',
+                             'OFPMP_METER_CONFIG',
+                             'OFPMP_METER_FEATURES',
+                             'OFPMP_TABLE_FEATURES',
+                             'OFPMP_PORT_DESC',
+                             OFPMP_EXPERIMENTER = 0xffff)
+
+OFP13_Multipart_Flags = enum(OFPMPF_REQ_MORE = 1 << 0,
+                             OFPMPF_REPLY_MORE = 1 << 0)
+
+OFP13_Instruction_Type = enum(OFPIT_GOTO_TABLE      = 1,
+                              OFPIT_WRITE_METADATA  = 2,
+                              OFPIT_WRITE_ACTIONS   = 3,
+                              OFPIT_APPLY_ACTIONS   = 4,
+                              OFPIT_CLEAR_ACTIONS   = 5,
+                              OFPIT_METER           = 6)
+
+OFP13_Action_Type = enum(OFPAT_OUTPUT       = 0,
+                         OFPAT_PUSH_VLAN    = 17,
+                         OFPAT_POP_VLAN     = 18,
+                         OFPAT_SET_FIELD    = 25)
+
+OFP13_Flow_Mod_Flags = enum(OFPFF_SEND_FLOW_REM = 1 << 0,
+                            OFPFF_CHECK_OVERLAP = 1 << 1,
+                            OFPFF_RESET_COUNTS  = 1 << 2)
+
+OFPMT_OXM = 1               # match type
+OFPXMC_OPENFLOW_BASIC = 0x8000
+OFPVID_PRESENT = 0x1000     # vlan_vid flag of tagged packets
+
+# OXM basic fields: name -> (field number, value length)
+OXM_Fields = {
+    'in_port':      (0, 4),
+    'eth_dst':      (3, 6),
+    'eth_src':      (4, 6),
+    'eth_type':     (5, 2),
+    'vlan_vid':     (6, 2),
+    'vlan_pcp':     (7, 1),
+    'ip_dscp':      (8, 1),
+    'ip_proto':     (10, 1),
+    'ipv4_src':     (11, 4),
+    'ipv4_dst':     (12, 4),
+    'tcp_src':      (13, 2),
+    'tcp_dst':      (14, 2),
+    'udp_src':      (15, 2),
+    'udp_dst':      (16, 2),
+}
+OXM_Names = dict((f, n) for n, (f, _) in OXM_Fields.items())
+
+def pad8(n):
+    """ @n rounded up to a multiple of 8 """
+    return (n + 7) & ~7
+
+class OFP13_Header(OFP_Header):
+    def __init__(self, t=0, l=0):
+        super(OFP13_Header, self).__init__(t, l)
+        self.set('version', OFP13_VERSION)
+
+class OXM_Match(object):
+    """
+    struct ofp_match: a list of OXM TLVs, padded to 8 bytes. Values and
+    masks are integers, or strings for the addresses of eth_src/eth_dst
+    """
+    def __init__(self):
+        self.fields = []    # (name, value, mask or None)
+        self.length = 8
+
+    def set(self, n, v, mask=None):
+        self.fields = [f for f in self.fields if f[0] != n] + [(n, v, mask)]
+        self.length = pad8(self.oxm_length())
+
+    def get(self, n):
+        for f in self.fields:
+            if f[0] == n:
+                return f[1]
+        return None
+
+    def oxm_length(self):
+        """ Length of the match without its padding """
+        return 4 + sum([4 + OXM_Fields[f[0]][1]*(2 if f[2] is not None else 1) for f in self.fields])
+
+    def pack(self):
+        buf = bytearray(self.length)
+        self.pack_into(buf)
+        return str(buf)
+
+    def pack_into(self, buf, offset=0):
+        struct.pack_into('>HH', buf, offset, OFPMT_OXM, self.oxm_length())
+        offset += 4
+        for n, v, mask in self.fields:
+            offset = pack_oxm(buf, offset, n, v, mask)
+        # the padding is left to zero by the caller's buffer
+
+    def unpack_from(self, buf, offset=0):
+        mtype, mlen = struct.unpack_from('>HH', buf, offset)
+        if mtype != OFPMT_OXM or mlen < 4:
+            raise RuntimeError("invalid match type %d length %d" % (mtype, mlen))
+        self.fields = []
+        end = offset + mlen
+        offset += 4
+        while offset < end:
+            n, v, mask, offset = unpack_oxm(buf, offset)
+            if n is not None:
+                self.fields.append((n, v, mask))
+        self.length = pad8(mlen)
+
+def oxm_value(n, v, size):
+    if isinstance(v, str):
+        return v
+    return ''.join([chr((v >> (8*i)) & 0xff) for i in reversed(range(size))])
+
+def pack_oxm(buf, offset, n, v, mask=None):
+    """ Write the OXM TLV of field @n at @offset of @buf, return the offset after it """
+    field, size = OXM_Fields[n]
+    hasmask = mask is not None
+    struct.pack_into('>HBB', buf, offset, OFPXMC_OPENFLOW_BASIC, (field << 1) | hasmask, size*(2 if hasmask else 1))
+    offset += 4
+    buf[offset:offset+size] = oxm_value(n, v, size)
+    offset += size
+    if hasmask:
+        buf[offset:offset+size] = oxm_value(n, mask, size)
+        offset += size
+    return offset
+
+def unpack_oxm(buf, offset):
+    """
+    Read the OXM TLV at @offset of @buf, return (name, value, mask, next
+    offset), name being None for the fields this module does not know
+    """
+    oclass, fh, olen = struct.unpack_from('>HBB', buf, offset)
+    offset += 4
+    field = fh >> 1
+    if oclass != OFPXMC_OPENFLOW_BASIC or field not in OXM_Names:
+        return None, None, None, offset+olen
+    n = OXM_Names[field]
+    size = OXM_Fields[n][1]
+    data = memoryview(buf)[offset:offset+olen].tobytes()
+    if n in ('eth_src', 'eth_dst'):
+        v = data[:size]
+        mask = data[size:] if fh & 1 else None
+    else:
+        v = int(data[:size].encode('hex'), 16)
+        mask = int(data[size:].encode('hex'), 16) if fh & 1 else None
+    return n, v, mask, offset+olen
+
+class OFP13_Action_Output(BinaryHeader):
+    _fields = [
+        ('type', 'H'),
+        ('len', 'H'),
+        ('port', 'I'),
+        ('max_len', 'H'),
+        ('pad', '6x'),
+    ]
+
+class OFP13_Action_Push(BinaryHeader):
+    _fields = [
+        ('type', 'H'),
+        ('len', 'H'),
+        ('ethertype', 'H'),
+        ('pad', '2x'),
+    ]
+
+class OFP13_Action_Pop_Vlan(BinaryHeader):
+    _fields = [
+        ('type', 'H'),
+        ('len', 'H'),
+        ('pad', '4x'),
+    ]
+
+class OFP13_Action_Set_Field(object):
+    """ OFPAT_SET_FIELD action with a single OXM TLV, padded to 8 bytes """
+    def __init__(self, n=None, v=0):
+        self.field = n
+        self.value = v
+        self.length = pad8(4 + 4 + OXM_Fields[n][1]) if n is not None else 8
+
+    def pack_into(self, buf, offset=0):
+        struct.pack_into('>HH', buf, offset, OFP13_Action_Type.OFPAT_SET_FIELD, self.length)
+        pack_oxm(buf, offset+4, self.field, self.value)
+
+class OFP13_Instruction_Goto_Table(BinaryHeader):
+    _fields = [
+        ('type', 'H'),
+        ('len', 'H'),
+        ('table_id', 'B'),
+        ('pad', '3x'),
+    ]
+
+class OFP13_Instruction_Actions(object):
+    """ OFPIT_WRITE_ACTIONS/OFPIT_APPLY_ACTIONS/OFPIT_CLEAR_ACTIONS and its actions """
+    def __init__(self, t=OFP13_Instruction_Type.OFPIT_APPLY_ACTIONS, actions=None):
+        self.type = t
+        self.actions = actions if actions is not None else []
+
+    @property
+    def length(self):
+        return 8 + sum([a.length for a in self.actions])
+
+    def pack_into(self, buf, offset=0):
+        struct.pack_into('>HH4x', buf, offset, self.type, self.length)
+        offset += 8
+        for a in self.actions:
+            a.pack_into(buf, offset)
+            offset += a.length
+
+class OFP13_Flow_Mod(BinaryHeader):
+    # struct ofp_header header
+    _fields = [
+        ('cookie', 'Q'),
+        ('cookie_mask', 'Q'),
+        ('table_id', 'B'),
+        ('command', 'B'),
+        ('idle_timeout', 'H'),
+        ('hard_timeout', 'H'),
+        ('priority', 'H'),
+        ('buffer_id', 'I'),
+        ('out_port', 'I'),
+        ('out_group', 'I'),
+        ('flags', 'H'),
+        ('pad', '2x'),
+    ]
+    # struct ofp_match match
+    # struct ofp_instruction instructions[0]
+
+class OFP13_Packet_Out(BinaryHeader):
+    # struct ofp_header header
+    _fields = [
+        ('buffer_id', 'I'),
+        ('in_port', 'I'),
+        ('actions_len', 'H'),
+        ('pad', '6x'),
+    ]
+    # struct ofp_action_header actions[0]
+    # uint8_t data[0]
+
+class OFP13_Multipart_Header(BinaryHeader):
+    # struct ofp_header header
+    _fields = [
+        ('type', 'H'),
+        ('flags', 'H'),
+        ('pad', '4x'),
+    ]
+    # uint8_t body[0]
+
+class OFP13_Flow_Stats_Request(BinaryHeader):
+    _fields = [
+        ('table_id', 'B'),
+        ('pad', '3x'),
+        ('out_port', 'I'),
+        ('out_group', 'I'),
+        ('pad2', '4x'),
+        ('cookie', 'Q'),
+        ('cookie_mask', 'Q'),
+    ]
+    # struct ofp_match match
+
+class OFP13_Flow_Stats(BinaryHeader):
+    _fields = [
+        ('length', 'H'),
+        ('table_id', 'B'),
+        ('pad', 'x'),
+        ('duration_sec', 'I'),
+        ('duration_nsec', 'I'),
+        ('priority', 'H'),
+        ('idle_timeout', 'H'),
+        ('hard_timeout', 'H'),
+        ('flags', 'H'),
+        ('pad2', '4x'),
+        ('cookie', 'Q'),
+        ('packet_count', 'Q'),
+        ('byte_count', 'Q'),
+    ]
+    # struct ofp_match match
+    # struct ofp_instruction instructions[0]
+
+def port13(port):
+    """ OpenFlow 1.3 port number of the OpenFlow 1.0 port @port (reserved ports differ) """
+    if port >= OFP_Port_No.OFPP_MAX:
+        return port | 0xffff0000
+    return port
+
+class OFlowNet13(OFlowNet):
+    """
+    Connection to an OpenFlow 1.3 switch. Flow modifications are
+    (OXM_Match, OFP13_Flow_Mod, instructions) tuples, and the flow entries
+    are {"body", "match", "instructions"} dicts
+    """
+
+    Header = OFP13_Header
+    Type = OFP13_Type
+
+    def parse_hello(self, hdr, msg):
+        if hdr.get('version') < OFP13_VERSION:
+            raise RuntimeError("switch does not support OpenFlow 1.3 (version %d)" % (hdr.get('version')))
+        self.send(OFP13_Header(OFP13_Type.OFPT_HELLO, OFP_Header.length).pack())
+
+    def dump_flows(self, table_id=OFPTT_ALL):
+        ofp_mpreq = OFP13_Multipart_Header()
+        ofp_mpreq.set('type', OFP13_Multipart_Types.OFPMP_FLOW)
+
+        ofp_fsreq = OFP13_Flow_Stats_Request()
+        ofp_fsreq.set('table_id', table_id)
+        ofp_fsreq.set('out_port', OFP13_Port_No.OFPP_ANY)
+        ofp_fsreq.set('out_group', OFPG_ANY)
+
+        ofp_match = OXM_Match()
+
+        body = ofp_mpreq.pack() + ofp_fsreq.pack() + ofp_match.pack()
+
+        ofp_hdr = OFP13_Header(OFP13_Type.OFPT_MULTIPART_REQUEST, len(body)+8)
+
+        if self.stats is not None:
+            self.stats.on_request('stats', ofp_hdr.get('xid'))
+        self.send(ofp_hdr.pack()+body)
+        return ofp_hdr.get('xid')
+
+    def flow_stats_parts(self, table_id=OFPTT_ALL):
+        """ Same as OFlowNet.flow_stats_parts, for the flows of table @table_id (all by default) """
+        xid = self.dump_flows(table_id)
+        for hdr, msg in self.messages():
+            if hdr.get('type') == OFP13_Type.OFPT_MULTIPART_REPLY and hdr.get('xid') == xid:
+                ofp_mpreply = OFP13_Multipart_Header()
+                ofp_mpreply.unpack_from(msg)
+                if ofp_mpreply.get('type') != OFP13_Multipart_Types.OFPMP_FLOW:
+                    raise RuntimeError("unexpected multipart type %d" % (ofp_mpreply.get('type')))
+
+                yield msg, ofp_mpreply.length, hdr.get('length') - hdr.length
+
+                if not ofp_mpreply.get('flags') & OFP13_Multipart_Flags.OFPMPF_REPLY_MORE:
+                    return
+            elif hdr.get('type') == OFP13_Type.OFPT_ECHO_REQUEST:
+                self.parse_ping(hdr, msg)
+            elif hdr.get('type') == OFP13_Type.OFPT_ERROR:
+                self.parse_error(hdr, msg)
+                if hdr.get('xid') == xid:
+                    raise RuntimeError("flow stats request failed")
+
+    def parse_flow(self, msg, offset=0):
+        """
+        Parse the flow stats entry at @offset of @msg, return its length
+        and a {"body", "match", "instructions"} dict. Only the goto_table
+        and actions instructions are kept, with their output actions
+        """
+        ofp_fwst = OFP13_Flow_Stats()
+        ofp_fwst.unpack_from(msg, offset)
+        plen = ofp_fwst.get('length')
+        if plen < ofp_fwst.length + 8:
+            raise RuntimeError("invalid flow stats length %d" % (plen))
+
+        ofp_match = OXM_Match()
+        ofp_match.unpack_from(msg, offset+ofp_fwst.length)
+        rlen = ofp_fwst.length + ofp_match.length
+
+        instructions = []
+        while rlen < plen:
+            itype, ilen = struct.unpack_from('>HH', msg, offset+rlen)
+            if ilen < 8 or rlen + ilen > plen:
+                raise RuntimeError("invalid instruction length %d" % (ilen))
+            if itype == OFP13_Instruction_Type.OFPIT_GOTO_TABLE:
+                goto = OFP13_Instruction_Goto_Table()
+                goto.unpack_from(msg, offset+rlen)
+                instructions.append(goto)
+            elif itype in (OFP13_Instruction_Type.OFPIT_WRITE_ACTIONS, OFP13_Instruction_Type.OFPIT_APPLY_ACTIONS):
+                instructions.append(OFP13_Instruction_Actions(itype, self.parse_actions(msg, offset+rlen+8, ilen-8)))
+            rlen += ilen
+
+        return plen, {"body": ofp_fwst, "match": ofp_match, "instructions": instructions}
+
+    def parse_actions(self, msg, offset, length):
+        actions = []
+        end = offset + length
+        while offset < end:
+            atype, alen = struct.unpack_from('>HH', msg, offset)
+            if alen < 8:
+                raise RuntimeError("invalid action length %d" % (alen))
+            if atype == OFP13_Action_Type.OFPAT_OUTPUT:
+                ofp_action_out = OFP13_Action_Output()
+                ofp_action_out.unpack_from(msg, offset)
+                actions.append(ofp_action_out)
+            offset += alen
+        return actions
+
+    def pack_flow_mod(self, msg, offset, xid, ofp_match, ofp_flow_mod, instructions):
+        """ Pack a FLOW_MOD message with @xid into @msg at @offset, return the offset after it """
+        # ofp_header + ofp_flow_mod + ofp_match + instructions, packed in place
+        parts = [ofp_flow_mod, ofp_match] + instructions
+        length = OFP_Header.length + sum([h.length for h in parts])
+
+        ofp_hdr = OFP13_Header(OFP13_Type.OFPT_FLOW_MOD, length)
+        ofp_hdr.set('xid', xid)
+        ofp_hdr.pack_into(msg, offset)
+        offset += OFP_Header.length
+        for h in parts:
+            h.pack_into(msg, offset)
+            offset += h.length
+        return offset
+
+    def packet_out(self, inport, pkt, outport=OFP_Port_No.OFPP_TABLE):
+        """ Same as OFlowNet.packet_out, OpenFlow 1.0 reserved port numbers are translated """
+        # ofp_header + ofp_packet_out + ofp_action_output + data
+        ofp_action = OFP13_Action_Output()
+        ofp_action.set('type', OFP13_Action_Type.OFPAT_OUTPUT)
+        ofp_action.set('len', ofp_action.length)
+        ofp_action.set('port', port13(outport))
+        ofp_action.set('max_len', 256)
+
+        ofp_packet_out = OFP13_Packet_Out()
+        ofp_packet_out.set('buffer_id', OFP_NO_BUFFER)
+        ofp_packet_out.set('in_port', port13(inport) if inport != 0 else OFP13_Port_No.OFPP_CONTROLLER)
+        ofp_packet_out.set('actions_len', ofp_action.length)
+
+        body = ofp_packet_out.pack() + ofp_action.pack() + pkt
+
+        ofp_hdr = OFP13_Header(OFP13_Type.OFPT_PACKET_OUT, len(body)+8)
+
+        self.send(ofp_hdr.pack()+body)
+        return ofp_hdr.get('xid')
+
+    def run(self, outcond=None):
+        for hdr, msg in self.messages():
+            if hdr.get('type') == OFP13_Type.OFPT_HELLO:
+                self.parse_hello(hdr, msg)
+            elif hdr.get('type') == OFP13_Type.OFPT_ECHO_REQUEST:
+                self.parse_ping(hdr, msg)
+            elif hdr.get('type') == OFP13_Type.OFPT_MULTIPART_REPLY:
+                ofp_mpreply = OFP13_Multipart_Header()
+                ofp_mpreply.unpack_from(msg)
+                if ofp_mpreply.get('type') == OFP13_Multipart_Types.OFPMP_FLOW:
+                    offset = ofp_mpreply.length
+                    while offset < hdr.get('length') - hdr.length:
+                        offset += self.parse_stats_flow(ofp_mpreply, msg, offset)
+                else:
+                    print 'Unknown multipart type %d' % (ofp_mpreply.get('type'))
+            elif hdr.get('type') == OFP13_Type.OFPT_ERROR:
+                self.parse_error(hdr, msg)
+            else:
+                print 'Unknown command type %d' % (hdr.get('type'))
+            print '\n'
+
+            if outcond is not None and hdr.get('type') == outcond:
+                return
+
+if __name__ == "__main__":
+    ofnet = OFlowNet13()
+    ofnet.connect('127.0.0.1', 6653)
+    ofnet.handshake()
+    for flow in ofnet.iter_flows():
+        print 'table %d priority %d' % (flow['body'].get('table_id'), flow['body'].get('priority'))
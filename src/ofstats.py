@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import struct, threading
+from time import time
+
+"""
+Instrumentation of the OpenFlow control channel. An OFlowNet given a
+SwitchStats counts the messages and bytes it sends and receives per
+message type, times its connection, handshake and writes, and measures
+the round trip time of its echo, flow stats and barrier requests. An
+OFlowStats gathers the SwitchStats of all the switches and exports them
+as a JSON-able snapshot. Connections without stats (the default) only
+pay a test against None
+"""
+
+class Histogram:
+    """
+    Latency histogram with power of two buckets, from 1us to about 1min
+    """
+
+    # upper bound of the first bucket, in seconds
+    BASE = 1e-6
+    BUCKETS = 26
+
+    def __init__(self):
+        self.counts = [0]*Histogram.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, t):
+        i = 0
+        bound = Histogram.BASE
+        while t > bound and i < Histogram.BUCKETS - 1:
+            bound *= 2
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += t
+        if self.min is None or t < self.min:
+            self.min = t
+        if self.max is None or t > self.max:
+            self.max = t
+
+    def percentile(self, p):
+        """ Upper bound of the bucket holding the @p-th percentile """
+        if self.count == 0:
+            return None
+        rank = p*self.count/100.0
+        seen = 0
+        bound = Histogram.BASE
+        for c in self.counts:
+            seen += c
+            if seen >= rank:
+                return min(bound, self.max)
+            bound *= 2
+        return self.max
+
+    def snapshot(self):
+        """ Times in milliseconds, buckets keyed by their upper bound in microseconds """
+        if self.count == 0:
+            return {'count': 0}
+        buckets = {}
+        bound = 1
+        for c in self.counts:
+            if c > 0:
+                buckets[str(bound)] = c
+            bound *= 2
+        return {'count': self.count,
+                'mean_ms': self.total/self.count*1000,
+                'min_ms': self.min*1000,
+                'max_ms': self.max*1000,
+                'p50_ms': self.percentile(50)*1000,
+                'p99_ms': self.percentile(99)*1000,
+                'buckets_us': buckets}
+
+class SwitchStats:
+    """
+    Counters of the connection to one switch. @types is the enum of the
+    message types of the protocol, for the names of the counters
+    """
+
+    # timed requests waiting for their reply
+    MAX_PENDING = 4096
+
+    def __init__(self, name, types=None):
+        self.name = name
+        self.names = {}         # message type -> name
+        if types is not None:
+            self.set_types(types)
+        self.lock = threading.Lock()
+        self.sent = {}          # message type -> [messages, bytes]
+        self.received = {}      # message type -> [messages, bytes]
+        self.pending = {}       # xid -> (request kind, time sent)
+        self.rtt = {}           # request kind -> Histogram
+        self.times = {}         # phase -> total seconds
+        self.connections = 0
+
+    def set_types(self, types):
+        self.names = dict((v, n) for n, v in vars(types).items() if n.startswith('OFPT_'))
+
+    def on_send(self, msg, elapsed=0):
+        """ Count the messages of the buffer @msg, written in @elapsed seconds """
+        with self.lock:
+            offset = 0
+            while offset + 4 <= len(msg):
+                t, length = struct.unpack_from('>xBH', msg, offset)
+                if length < 8: # not a framed message
+                    break
+                c = self.sent.get(t)
+                if c is None:
+                    c = self.sent[t] = [0, 0]
+                c[0] += 1
+                c[1] += length
+                offset += length
+            self.times['write'] = self.times.get('write', 0) + elapsed
+
+    def on_request(self, kind, xid):
+        """ Start the round trip of the request @xid, of @kind echo, stats or barrier """
+        with self.lock:
+            if len(self.pending) >= SwitchStats.MAX_PENDING: # replies lost with their connection
+                self.pending.clear()
+            self.pending[xid] = (kind, time())
+
+    def on_receive(self, hdr):
+        t = hdr.get('type')
+        with self.lock:
+            c = self.received.get(t)
+            if c is None:
+                c = self.received[t] = [0, 0]
+            c[0] += 1
+            c[1] += hdr.get('length')
+
+            # first reply (or error) to a timed request
+            p = self.pending.pop(hdr.get('xid'), None)
+            if p is not None:
+                h = self.rtt.get(p[0])
+                if h is None:
+                    h = self.rtt[p[0]] = Histogram()
+                h.add(time() - p[1])
+
+    def add_time(self, phase, elapsed):
+        with self.lock:
+            self.times[phase] = self.times.get(phase, 0) + elapsed
+            if phase == 'connect':
+                self.connections += 1
+
+    def snapshot(self):
+        with self.lock:
+            messages = {}
+            for d, key in ((self.sent, 'sent'), (self.received, 'received')):
+                for t, (n, b) in d.items():
+                    m = messages.setdefault(self.names.get(t, str(t)), {})
+                    m[key] = n
+                    m[key+'_bytes'] = b
+            return {'connections': self.connections,
+                    'messages': messages,
+                    'rtt': dict((k, h.snapshot()) for k, h in self.rtt.items()),
+                    'time_s': dict(self.times)}
+
+class OFlowStats:
+    """ SwitchStats of every switch, by name """
+    def __init__(self):
+        self.switches = {}
+        self.lock = threading.Lock()
+
+    def switch(self, name, types=None):
+        with self.lock:
+            s = self.switches.get(name)
+            if s is None:
+                s = self.switches[name] = SwitchStats(name, types)
+            elif types is not None:
+                s.set_types(types)
+            return s
+
+    def snapshot(self):
+        with self.lock:
+            switches = self.switches.items()
+        return dict((name, s.snapshot()) for name, s in switches)
+
+    def dump(self):
+        for name, s in sorted(self.snapshot().items()):
+            rtt = ', '.join(['%s %.3fms (%d)' % (k, h['mean_ms'], h['count']) for k, h in sorted(s['rtt'].items()) if h['count'] > 0])
+            sent = sum([m.get('sent', 0) for m in s['messages'].values()])
+            received = sum([m.get('received', 0) for m in s['messages'].values()])
+            print '%s: %d sent, %d received, rtt %s' % (name, sent, received, rtt if rtt else 'n/a')
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import os, re, sys, hashlib, tempfile
+from collections import OrderedDict
+from regex import RegexParser, CompiledDFA, LazyDFA, MultiDFA
+
+class PathCache:
+    """
+    Process-wide LRU cache of compiled path expressions, keyed by the
+    normalized expression. When a store directory is set, compiled DFAs
+    are also serialized to disk so that later runs skip the compilation.
+    Expressions whose DFA exceeds @budget states are matched with a
+    LazyDFA, which is kept in memory only.
+    """
+
+    # bump when the serialized format of CompiledDFA changes
+    VERSION = 1
+
+    def __init__(self, size=256, store=None, budget=100000):
+        self.size = size            # maximum number of cached DFAs
+        self.store = store          # on-disk store directory (None = memory only)
+        self.budget = budget        # maximum DFA states before going lazy (None = no limit)
+        self.entries = OrderedDict()
+        self.multi = OrderedDict()  # tuple of keys -> MultiDFA, same LRU policy
+        self.hits = 0               # found in memory
+        self.misses = 0             # not found in memory
+        self.loads = 0              # misses served from the store
+        self.compiles = 0           # misses that required a compilation
+        self.lazy = 0               # compilations that exceeded the budget
+
+    def set_store(self, store):
+        if store is not None and not os.path.isdir(store):
+            os.makedirs(store)
+        self.store = store
+
+    def set_budget(self, budget):
+        self.budget = budget
+
+    def normalize(self, expr):
+        return re.sub('\s', '', expr)
+
+    def get(self, expr):
+        """ Return the CompiledDFA matching @expr """
+        key = self.normalize(expr)
+
+        cdfa = self.entries.pop(key, None)
+        if cdfa is not None:
+            self.hits += 1
+            self.entries[key] = cdfa
+            return cdfa
+
+        self.misses += 1
+        cdfa = self.load(key)
+        if cdfa is None:
+            cdfa = RegexParser().create_fsm(key, max_states=self.budget)
+            self.compiles += 1
+            if isinstance(cdfa, LazyDFA):
+                sys.stderr.write('Warning: DFA of '+key+' exceeds %d states, using lazy matching\n' % (self.budget))
+                self.lazy += 1
+            else:
+                cdfa = cdfa.compile()
+                self.save(key, cdfa)
+        else:
+            self.loads += 1
+
+        self.entries[key] = cdfa
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        return cdfa
+
+    def get_multi(self, exprs):
+        """
+        Return the MultiDFA matching the union of @exprs, labelled with
+        the index of each expression in the list
+        """
+        keys = tuple([self.normalize(expr) for expr in exprs])
+
+        mdfa = self.multi.pop(keys, None)
+        if mdfa is None:
+            mdfa = MultiDFA([self.get(key) for key in keys], range(len(keys)))
+        self.multi[keys] = mdfa
+        while len(self.multi) > self.size:
+            self.multi.popitem(last=False)
+
+        return mdfa
+
+    def filename(self, key):
+        return os.path.join(self.store, hashlib.sha1(key).hexdigest()+'.dfa')
+
+    def load(self, key):
+        if self.store is None:
+            return None
+        try:
+            f = open(self.filename(key), 'rb')
+            data = f.read()
+            f.close()
+        except IOError:
+            return None
+
+        # header: version and expression, guards against hash collisions
+        header, _, body = data.partition('\n')
+        if header != '%d %s' % (PathCache.VERSION, key):
+            return None
+        try:
+            return CompiledDFA.loads(body)
+        except (ValueError, EOFError, TypeError):
+            sys.stderr.write('Warning: corrupted path cache entry for '+key+'\n')
+            return None
+
+    def save(self, key, cdfa):
+        if self.store is None:
+            return
+        # write then rename so that concurrent runs never read partial entries
+        fd, tmp = tempfile.mkstemp(dir=self.store)
+        f = os.fdopen(fd, 'wb')
+        f.write('%d %s\n' % (PathCache.VERSION, key))
+        f.write(cdfa.dumps())
+        f.close()
+        os.rename(tmp, self.filename(key))
+
+    def counters(self):
+        return {'hits': self.hits, 'misses': self.misses, 'loads': self.loads, 'compiles': self.compiles, 'lazy': self.lazy}
+
+    def dump(self):
+        print 'Path cache: %d hits, %d misses (%d loaded from store, %d compiled, %d lazy)' % (self.hits, self.misses, self.loads, self.compiles, self.lazy)
+
+_inst = PathCache()
+get = _inst.get
+get_multi = _inst.get_multi
+set_store = _inst.set_store
+set_budget = _inst.set_budget
+counters = _inst.counters
+dump = _inst.dump
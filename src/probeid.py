@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+from bisect import bisect_right
+import simplejson as json
+
+"""
+Probe identifiers. A probe is identified by a 32-bit serial number split
+across its IP id (high 16 bits) and the identifier of its transport
+header (low 16 bits: UDP/TCP source port, ICMP echo id), instead of a
+random 16-bit source port, so that the postcards of up to 2^32 probes of
+a run are never merged. The generator allocates the serials in order,
+one block per (condition, source, destination), and saves the blocks as
+a ProbeIndex that the collector and the checker load to find the
+condition of each probe
+"""
+
+MAX_PROBES = 1 << 32
+
+def split(pid):
+    """ (IP id, transport id) of probe @pid """
+    return pid >> 16, pid & 0xffff
+
+def join(ipid, tid):
+    """ Probe id carried in the IP id @ipid and transport id @tid """
+    return (ipid << 16) | tid
+
+class ProbeIndex:
+    """
+    Blocks of consecutive probe ids, each sent by the same condition from
+    the same source to the same destination (nodes)
+    """
+    def __init__(self, fname=None):
+        self.first = []         # first id of the blocks, increasing
+        self.blocks = []        # (count, gcid, src, dst) of the blocks
+        self.count = 0
+
+        if fname is not None:
+            self.load(fname)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, first, count, gcid, src, dst):
+        if self.first and first < self.first[-1] + self.blocks[-1][0]:
+            raise RuntimeError("probe block %d overlaps the previous one" % (first))
+        self.first.append(first)
+        self.blocks.append((count, gcid, src, dst))
+        self.count += count
+
+    def lookup(self, pid):
+        """ (gcid, src, dst) of probe @pid, None if it was not allocated """
+        i = bisect_right(self.first, pid) - 1
+        if i < 0 or pid >= self.first[i] + self.blocks[i][0]:
+            return None
+        return self.blocks[i][1:]
+
+    def gcid(self, pid):
+        b = self.lookup(pid)
+        if b is None:
+            return None
+        return b[0]
+
+    def save(self, fname):
+        f = open(fname, 'w')
+        json.dump([[first] + list(b) for first, b in zip(self.first, self.blocks)], f)
+        f.close()
+
+    def load(self, fname):
+        f = open(fname, 'r')
+        data = json.load(f)
+        f.close()
+
+        for first, count, gcid, src, dst in data:
+            self.add(first, count, gcid, src, dst)
+
+class ProbeAllocator:
+    """
+    Deterministic allocator of probe ids: the same conditions generated in
+    the same order get the same ids
+    """
+    def __init__(self, first=0):
+        self.next = first
+        self.index = ProbeIndex()
+
+    def allocate(self, gcid, src, dst, count):
+        """ Allocate @count consecutive ids to probes of @gcid from @src to @dst, return the first """
+        if self.next + count > MAX_PROBES:
+            raise RuntimeError("probe id space exhausted (%d probes)" % (self.next + count))
+        first = self.next
+        self.next += count
+        self.index.add(first, count, gcid, src, dst)
+        return first
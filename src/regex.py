@@ -4,7 +4,9 @@
 @author: David Lebrun <dav.lebrun@gmail.com>
 """
 
-import sys
+import sys, marshal
+from array import array
+from collections import deque, OrderedDict
 from time import time
 
 debug = False
@@ -20,38 +22,11 @@ def dlog(s):
     if debug:
         print s
 
-def is_states_in_list(slist, states):
-    for s in slist:
-        if len(s) != len(states):
-            continue
-        eq = True
-        for i in range(len(s)):
-            if s[i] != states[i]:
-                eq = False
-                break
-        if eq:
-            return True
-
-    return False
-
-def get_index_in_list(slist, states):
-    for i in range(len(slist)):
-        s = slist[i]
-        if len(s) != len(states):
-            continue
-        eq = True
-        for j in range(len(s)):
-            if s[j] != states[j]:
-                eq = False
-                break
-        if eq:
-            return i
-
-    return None
-
 class FSM:
     """
     Finite State Machine class. It represents a NFA or a DFA.
+    Transitions are labelled with a switch symbol, the dot, epsilon or a
+    switch class (frozenset of switch symbols matching any of them).
     """
 
     # some constants
@@ -67,6 +42,20 @@ class FSM:
     def state_size(self):
         return len(self.states.keys())
 
+    @staticmethod
+    def symbols(label):
+        """ Switch symbols of a transition label (symbol or frozenset of symbols) """
+        if type(label) is frozenset:
+            return label
+        return (label,)
+
+    @staticmethod
+    def label(syms):
+        """ Transition label matching the switch symbols @syms """
+        if len(syms) == 1:
+            return iter(syms).next()
+        return frozenset(syms)
+
     def add_transition(self, state, symbol, next_state):
         """ Add a transition from @state to @next_state with @symbol """
         if state not in self.states:
@@ -78,17 +67,6 @@ class FSM:
         if next_state not in self.states:
             self.states[next_state] = {}
 
-        # Dot character fix
-        if symbol == FSM.dot: # override existing next state
-            for tsym in self.states[state].keys():
-                if tsym == FSM.dot:
-                    continue
-                if next_state in self.states[state][tsym]:
-                    self.states[state][tsym].remove(next_state)
-                    dlog('Removing transition '+str(state)+' -- '+str(tsym)+' --> '+str(next_state)+' overriden by dot')
-                    if len(self.states[state][tsym]) == 0:
-                        del self.states[state][tsym]
-
     def set_accepting(self, states):
         for q in states:
             if q not in self.accepting:
@@ -142,86 +120,256 @@ class FSM:
 
     def remove_epsilon(self):
         """
-        Implementation of the epsilon-removal by loop reduction algorithm
-        """
-        E = self.get_all_transitions()
-        F = self.accepting
-        queue = []
+        Epsilon-removal by epsilon-closure.
 
-        for q, sym, t in E:
-            if sym is FSM.epsilon:
-                queue.append((q, t))
+        The epsilon and symbol edges are indexed per state, then the states
+        reachable from the initial state are explored with a deque worklist.
+        Each of them inherits the symbol edges and the accepting status of
+        its epsilon-closure. States only reachable through epsilon edges are
+        dropped, which does not change the accepted language.
+        """
+        eps = {}    # state -> [states] through epsilon edges
+        moves = {}  # state -> [(symbol, state)] through symbol edges
+        for q in self.states:
+            for sym, targets in self.states[q].iteritems():
+                if sym == FSM.epsilon:
+                    eps[q] = targets
+                else:
+                    moves.setdefault(q, []).extend([(sym, t) for t in targets])
 
-        dlog(len(queue))
-        iteration = 0
+        accepting = set(self.accepting)
+        F = []
+        states = {}
+        seen = set([0])
+        queue = deque([0])
 
         while len(queue) > 0:
-            iteration += 1
-            if iteration % 1000 == 0:
-                dlog(str(iteration)+' (qlen '+str(len(queue))+')') # count iterations for debugging purposes
-            p, qm = queue.pop(0)
-            dlog('Initially removing ('+str(p)+', epsilon) -> '+str(qm))
-            E.pop(E.index((p, FSM.epsilon, qm)))
-
-            if p == qm:
-                E[:] = [(qq, ssym, tt) for (qq, ssym, tt) in E if qq == p]
-            else:
-                tmpE = []
-                for tmpqm, a, qn in E:
-                    if tmpqm != qm:
-                        continue
-                    dlog('Adding connection ('+str(p)+', '+str(a)+') -> '+str(qn))
-                    tmpE.append((p, a, qn))
-                    if a is FSM.epsilon:
-                        queue.append((p, qn))
-                E.extend(tmpE)
-
-                if qm in F and p not in F:
-                    F.append(p)
-
-        dlog('New transitions')
-        dlog(E)
-        dlog('New accepting')
-        dlog(F)
-        self.reset_transitions(E)
+            p = queue.popleft()
+
+            # Epsilon-closure of p
+            closure = set([p])
+            work = deque([p])
+            while len(work) > 0:
+                q = work.popleft()
+                for t in eps.get(q, ()):
+                    if t not in closure:
+                        closure.add(t)
+                        work.append(t)
+
+            trans = {}
+            for q in closure:
+                for sym, t in moves.get(q, ()):
+                    if sym not in trans:
+                        trans[sym] = set()
+                    trans[sym].add(t)
+                    if t not in seen:
+                        seen.add(t)
+                        queue.append(t)
+
+            states[p] = dict((sym, sorted(targets)) for sym, targets in trans.iteritems())
+            if not accepting.isdisjoint(closure):
+                F.append(p)
+
+        if debug:
+            dlog('New transitions')
+            dlog(states)
+            dlog('New accepting')
+            dlog(F)
+        self.states = states
         self.accepting = F
 
-    def to_dfa(self):
+    def to_dfa(self, max_states=None):
         """
-        Transform to DFA with Rabin-Scott subset contruction algorithm
+        Transform to DFA with Rabin-Scott subset contruction algorithm.
+
+        Each subset of NFA states is interned in a frozenset-keyed dictionary
+        and its outgoing transitions are computed exactly once, so the cost is
+        linear in the number of DFA transitions. A dot edge matches any switch,
+        hence its targets are merged into every explicit symbol of the subset.
+        The switches leading to the same DFA state share a single edge,
+        labelled with their switch class.
+        Returns None if the DFA would have more than @max_states states.
         """
         if self.dfa == True:
             return self
 
-        Q = [ [ 0 ] ]
-        Q2 = [ [ 0 ] ]
-        F2 = []
+        accepting = set(self.accepting)
+        start = frozenset([0])
+        index = {start: 0}  # subset -> DFA state
+        subsets = [start]   # DFA state -> subset
 
-        while len(Q) > 0:
-            q2 = Q.pop()
+        m2 = FSM()
+        i = 0
+        while i < len(subsets):
+            q2 = subsets[i]
+
+            # Gather the transitions of the whole subset in one pass
+            moves = {}
             for q in q2:
-                if q in self.accepting:
-                    F2.append(q2)
-                    break
-            syms = self.get_transitions(q2)
-            for sym in syms:
-                ns = self.get_next_states(q2, sym)
-                if not is_states_in_list(Q2, ns):
-                    Q2.append(ns)
-                    Q.append(ns)
+                for label, targets in self.states[q].iteritems():
+                    for sym in FSM.symbols(label):
+                        if sym not in moves:
+                            moves[sym] = set(targets)
+                        else:
+                            moves[sym].update(targets)
+
+            wildcard = moves.get(FSM.dot)
+            trans = {}
+            bytarget = {}   # DFA state -> [symbols]
+            for sym, ns in moves.iteritems():
+                if wildcard is not None and sym != FSM.dot:
+                    ns |= wildcard
+                ns = frozenset(ns)
+                idx = index.get(ns)
+                if idx is None:
+                    idx = len(subsets)
+                    if max_states is not None and idx >= max_states:
+                        dlog('DFA exceeds %d states, aborting' % (max_states))
+                        return None
+                    index[ns] = idx
+                    subsets.append(ns)
+                if sym == FSM.dot:
+                    trans[sym] = [idx]
+                else:
+                    bytarget.setdefault(idx, []).append(sym)
+                if debug:
+                    dlog('Mapping ('+str(i)+', '+str(sym)+') -> '+str(idx)+' from original ('+str(sorted(q2))+', '+str(sym)+') -> '+str(sorted(ns)))
 
-        m2 = FSM()
-        for i in range(len(Q2)):
-            syms = self.get_transitions(Q2[i])
-            for sym in syms:
-                ns = self.get_next_states(Q2[i], sym)
-                idx = get_index_in_list(Q2, ns)
-                m2.add_transition(i, sym, idx)
-                dlog('Mapping ('+str(i)+', '+str(sym)+') -> '+str(idx)+' from original ('+(str(Q2[i]))+', '+str(sym)+') -> '+str(ns))
+            for idx, syms in bytarget.iteritems():
+                trans[FSM.label(syms)] = [idx]
+            m2.states[i] = trans
+            if not accepting.isdisjoint(q2):
+                m2.accepting.append(i)
+            i += 1
+
+        m2.dfa = True
+        return m2
+
+    def minimize(self):
+        """
+        Minimize the DFA with Hopcroft's partition refinement algorithm.
+
+        The automaton is completed with a dead state and a dot edge stands
+        for every switch without an explicit edge, so the explicit edges of
+        a state are only exceptions to its default (dot) target. A splitter
+        block is processed for all symbols at once: the dot predecessors
+        split first, then for each symbol only the states whose explicit
+        edge disagrees with their default are moved.
+        """
+        if not self.dfa:
+            dlog('Please transform to DFA first')
+            return None
 
-        for s in F2:
-            idx = get_index_in_list(Q2, s)
-            m2.set_accepting([idx])
+        n = self.state_size()
+        dead = n
+        default = [dead]*(n+1)  # state -> dot target (or dead state)
+        explicit = [{}]*(n+1)   # state -> {symbol: target} differing from default
+        inv_default = [[] for _ in range(n+1)]
+        inv_explicit = [[] for _ in range(n+1)]
+
+        for q in range(n):
+            trans = self.states[q]
+            if FSM.dot in trans:
+                default[q] = trans[FSM.dot][0]
+            exp = {}
+            for label, targets in trans.iteritems():
+                if label != FSM.dot and targets[0] != default[q]:
+                    for sym in FSM.symbols(label):
+                        exp[sym] = targets[0]
+                        inv_explicit[targets[0]].append((q, sym))
+            explicit[q] = exp
+        for q in range(n+1):
+            inv_default[default[q]].append(q)
+
+        # Initial partition: accepting and non-accepting states
+        accepting = set(self.accepting)
+        blocks = []
+        block = [0]*(n+1)
+        for part in [[q for q in range(n+1) if q in accepting], [q for q in range(n+1) if q not in accepting]]:
+            if len(part) > 0:
+                for q in part:
+                    block[q] = len(blocks)
+                blocks.append(set(part))
+
+        W = set()
+        if len(blocks) > 1:
+            W.add(0 if len(blocks[0]) <= len(blocks[1]) else 1)
+
+        def split(X):
+            touched = {}
+            for q in X:
+                b = block[q]
+                if b not in touched:
+                    touched[b] = [q]
+                else:
+                    touched[b].append(q)
+            for b, inter in touched.iteritems():
+                Y = blocks[b]
+                if len(inter) == len(Y):
+                    continue
+                Y.difference_update(inter)
+                nb = len(blocks)
+                blocks.append(set(inter))
+                for q in inter:
+                    block[q] = nb
+                if b in W or len(inter) <= len(Y):
+                    W.add(nb)
+                else:
+                    W.add(b)
+
+        while len(W) > 0:
+            B = frozenset(blocks[W.pop()])
+
+            # Dot predecessors, also the splitter of the switches without
+            # any explicit edge
+            Pd = []
+            for t in B:
+                Pd.extend(inv_default[t])
+            split(Pd)
+
+            # Per-symbol exceptions to the default behaviour
+            marked = {}
+            for t in B:
+                for q, sym in inv_explicit[t]:
+                    if default[q] not in B:
+                        marked.setdefault(sym, []).append(q)
+            for q in Pd:
+                for sym, t in explicit[q].iteritems():
+                    if t not in B:
+                        marked.setdefault(sym, []).append(q)
+            for X in marked.itervalues():
+                split(X)
+
+        # Rebuild from the initial state, dropping the dead block unless
+        # an explicit edge needs it to override a live dot edge
+        deadblock = block[dead]
+        m2 = FSM()
+        ids = {block[0]: 0}
+        order = [block[0]]
+        i = 0
+        while i < len(order):
+            b = order[i]
+            r = iter(blocks[b]).next()
+            trans = {}
+            dblock = block[default[r]]
+            targets = []
+            if dblock != deadblock:
+                targets.append((FSM.dot, dblock))
+            bytarget = {}   # block -> [symbols]
+            for sym, t in explicit[r].iteritems():
+                if block[t] != dblock:
+                    bytarget.setdefault(block[t], []).append(sym)
+            for tb, syms in bytarget.iteritems():
+                targets.append((FSM.label(syms), tb))
+            for sym, tb in targets:
+                if tb not in ids:
+                    ids[tb] = len(order)
+                    order.append(tb)
+                trans[sym] = [ids[tb]]
+            m2.states[i] = trans
+            if r in accepting:
+                m2.accepting.append(i)
+            i += 1
 
         m2.dfa = True
         return m2
@@ -239,6 +387,12 @@ class FSM:
         curstate = 0
         for sym in data:
             syms = self.get_transitions([curstate])
+            if sym not in syms:
+                # switch class containing the symbol, if any
+                for label in syms:
+                    if type(label) is frozenset and sym in label:
+                        sym = label
+                        break
             if sym not in syms and FSM.dot not in syms:
                 dlog('No transition available at state %d, input not accepted, aborting' % (curstate))
                 return None
@@ -261,6 +415,451 @@ class FSM:
 
         return curstate
 
+    def next_state(self, q, sym):
+        """ DFA transition from @q with @sym, dot edges included, or None """
+        trans = self.states[q]
+        if sym in trans:
+            return trans[sym][0]
+        for label, targets in trans.iteritems():
+            if type(label) is frozenset and sym in label:
+                return targets[0]
+        if FSM.dot in trans:
+            return trans[FSM.dot][0]
+        return None
+
+    def alphabet(self, q):
+        """ Set of the switch symbols (and dot) labelling the edges of @q """
+        syms = set()
+        for label in self.states[q]:
+            syms.update(FSM.symbols(label))
+        return syms
+
+    def is_empty(self):
+        """ True if the DFA accepts no path at all """
+        accepting = set(self.accepting)
+        seen = set([0])
+        queue = deque([0])
+        while len(queue) > 0:
+            q = queue.popleft()
+            if q in accepting:
+                return False
+            for targets in self.states[q].itervalues():
+                if targets[0] not in seen:
+                    seen.add(targets[0])
+                    queue.append(targets[0])
+        return True
+
+    def intersect(self, other):
+        """ Product DFA accepting the paths accepted by both DFAs """
+        if not self.dfa or not other.dfa:
+            dlog('Please transform to DFA first')
+            return None
+
+        acc1 = set(self.accepting)
+        acc2 = set(other.accepting)
+        index = {(0, 0): 0}
+        pairs = [(0, 0)]
+        m = FSM()
+        i = 0
+        while i < len(pairs):
+            a, b = pairs[i]
+            trans = {}
+            bytarget = {}   # product state -> [symbols]
+            for sym in self.alphabet(a) | other.alphabet(b):
+                na = self.next_state(a, sym)
+                nb = other.next_state(b, sym)
+                if na is None or nb is None:
+                    continue
+                idx = index.get((na, nb))
+                if idx is None:
+                    idx = len(pairs)
+                    index[(na, nb)] = idx
+                    pairs.append((na, nb))
+                if sym == FSM.dot:
+                    trans[sym] = [idx]
+                else:
+                    bytarget.setdefault(idx, []).append(sym)
+            for idx, syms in bytarget.iteritems():
+                trans[FSM.label(syms)] = [idx]
+            m.states[i] = trans
+            if a in acc1 and b in acc2:
+                m.accepting.append(i)
+            i += 1
+
+        m.dfa = True
+        return m
+
+    def is_subset(self, other):
+        """ True if every path accepted by this DFA is accepted by @other """
+        if not self.dfa or not other.dfa:
+            dlog('Please transform to DFA first')
+            return None
+
+        acc1 = set(self.accepting)
+        acc2 = set(other.accepting)
+        seen = set([(0, 0)])
+        queue = deque([(0, 0)])
+        while len(queue) > 0:
+            a, b = queue.popleft()
+            if a in acc1 and (b is None or b not in acc2):
+                return False
+            syms = self.alphabet(a)
+            if b is not None:
+                syms.update(other.alphabet(b))
+            for sym in syms:
+                na = self.next_state(a, sym)
+                if na is None:
+                    continue
+                nb = None
+                if b is not None:
+                    nb = other.next_state(b, sym)
+                if (na, nb) not in seen:
+                    seen.add((na, nb))
+                    queue.append((na, nb))
+        return True
+
+    def equivalent(self, other):
+        """ True if both DFAs accept the same paths """
+        return self.is_subset(other) and other.is_subset(self)
+
+    def compile(self):
+        """ Return the table-driven form of the DFA """
+        if not self.dfa:
+            dlog('Please transform to DFA first')
+            return None
+        return CompiledDFA(self)
+
+    def process_many(self, paths):
+        """ Process several input strings, see CompiledDFA.process_many """
+        return self.compile().process_many(paths)
+
+class CompiledDFA:
+    """
+    Table-driven DFA used to match switch paths. Switch symbols are interned
+    to column numbers, the last column being the dot fallback, and each hop
+    is a single lookup in a flat array of next states (-1 if none). When the
+    dense table would be too large, each state keeps a dictionary of its
+    explicit edges and a default (dot) target instead.
+    """
+
+    # maximum number of cells of the dense table
+    DENSE_LIMIT = 1 << 20
+
+    def __init__(self, fsm=None):
+        if fsm is not None:
+            self.load_fsm(fsm)
+
+    def load_fsm(self, fsm):
+        """ Build the tables from a DFA """
+        n = fsm.state_size()
+        self.size = n
+        self.accepting = bytearray(n)   # state -> 1 if accepting
+        for q in fsm.accepting:
+            self.accepting[q] = 1
+
+        syms = set()
+        for q in range(n):
+            syms.update(fsm.alphabet(q))
+        syms.discard(FSM.dot)
+
+        self.symtab = dict((sym, i) for i, sym in enumerate(sorted(syms)))
+        self.width = len(self.symtab) + 1  # columns per state
+        self.other = self.width - 1        # dot column
+
+        self.dense = n*self.width <= CompiledDFA.DENSE_LIMIT
+        self.default = array('i', [-1])*n  # state -> dot target
+        self.rows = None
+        self.table = None
+
+        for q in range(n):
+            if FSM.dot in fsm.states[q]:
+                self.default[q] = fsm.states[q][FSM.dot][0]
+
+        if self.dense:
+            self.table = array('i', [-1])*(n*self.width)
+            for q in range(n):
+                base = q*self.width
+                d = self.default[q]
+                if d >= 0:
+                    for c in range(self.width):
+                        self.table[base+c] = d
+                for label, targets in fsm.states[q].iteritems():
+                    if label != FSM.dot:
+                        for sym in FSM.symbols(label):
+                            self.table[base+self.symtab[sym]] = targets[0]
+        else:
+            self.rows = []
+            for q in range(n):
+                row = {}
+                for label, targets in fsm.states[q].iteritems():
+                    if label != FSM.dot:
+                        for sym in FSM.symbols(label):
+                            row[sym] = targets[0]
+                self.rows.append(row)
+
+    def dumps(self):
+        """ Serialize the tables to a string, see loads() """
+        return marshal.dumps((self.size, str(self.accepting), self.symtab, self.width,
+            self.dense, self.default.tostring(),
+            self.table.tostring() if self.dense else self.rows))
+
+    @staticmethod
+    def loads(s):
+        """ Rebuild a CompiledDFA from the output of dumps() """
+        size, accepting, symtab, width, dense, default, table = marshal.loads(s)
+        cdfa = CompiledDFA()
+        cdfa.size = size
+        cdfa.accepting = bytearray(accepting)
+        cdfa.symtab = symtab
+        cdfa.width = width
+        cdfa.other = width - 1
+        cdfa.dense = dense
+        cdfa.default = array('i')
+        cdfa.default.fromstring(default)
+        cdfa.rows = None
+        cdfa.table = None
+        if dense:
+            cdfa.table = array('i')
+            cdfa.table.fromstring(table)
+        else:
+            cdfa.rows = table
+        return cdfa
+
+    # initial state
+    start = 0
+
+    def step(self, q, sym):
+        """ Return the state reached from @q with @sym, or None """
+        if self.dense:
+            q = self.table[q*self.width + self.symtab.get(sym, self.other)]
+        else:
+            q = self.rows[q].get(sym, self.default[q])
+        if q < 0:
+            return None
+        return q
+
+    def accepts(self, q):
+        return self.accepting[q] == 1
+
+    def process(self, data):
+        """
+        Same as FSM.process: return the accepting state reached by @data,
+        or None if the input is not accepted
+        """
+        return self.process_many([data])[0]
+
+    def process_many(self, paths):
+        """
+        Match an iterable of switch paths in one call and return the list
+        of results, as FSM.process would for each of them
+        """
+        ret = []
+        append = ret.append
+        accepting = self.accepting
+
+        if self.dense:
+            table = self.table
+            width = self.width
+            col = self.symtab.get
+            other = self.other
+            for path in paths:
+                q = 0
+                for sym in path:
+                    q = table[q*width + col(sym, other)]
+                    if q < 0:
+                        break
+                if q >= 0 and accepting[q]:
+                    append(q)
+                else:
+                    append(None)
+        else:
+            rows = self.rows
+            default = self.default
+            for path in paths:
+                q = 0
+                for sym in path:
+                    q = rows[q].get(sym, default[q])
+                    if q < 0:
+                        break
+                if q >= 0 and accepting[q]:
+                    append(q)
+                else:
+                    append(None)
+
+        return ret
+
+class LazyDFA:
+    """
+    DFA determinized on the fly from an epsilon-free NFA, for expressions
+    whose subset construction explodes. Only the subsets visited by the
+    processed paths are materialized, with their transitions, in a cache
+    bounded to @cache_size states with least-recently-used eviction.
+    A state of the lazy DFA is the frozenset of NFA states it stands for.
+    """
+
+    def __init__(self, nfa, cache_size=4096):
+        self.nfa = nfa
+        self.cache_size = cache_size
+        self.nfa_accepting = set(nfa.accepting)
+        self.start = frozenset([0])
+        self.cache = OrderedDict()  # subset -> (accepting, {symbol: subset})
+        self.evictions = 0
+        self.classes = {}           # NFA state -> [(switch class, states)]
+        for q, trans in nfa.states.iteritems():
+            for label, targets in trans.iteritems():
+                if type(label) is frozenset:
+                    self.classes.setdefault(q, []).append((label, targets))
+
+    def entry(self, subset):
+        """ Return the cache entry of @subset, creating it if needed """
+        e = self.cache.pop(subset, None)
+        if e is None:
+            e = (not self.nfa_accepting.isdisjoint(subset), {})
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+        self.cache[subset] = e
+        return e
+
+    def next_subset(self, subset, sym):
+        """ Subset reached from @subset with @sym, dot edges included """
+        states = self.nfa.states
+        targets = set()
+        for q in subset:
+            trans = states[q]
+            if sym in trans:
+                targets.update(trans[sym])
+            if FSM.dot in trans:
+                targets.update(trans[FSM.dot])
+            for label, t in self.classes.get(q, ()):
+                if sym in label:
+                    targets.update(t)
+        return frozenset(targets)
+
+    def step(self, q, sym):
+        """ Return the subset reached from @q with @sym, or None """
+        trans = self.entry(q)[1]
+        nq = trans.get(sym)
+        if nq is None:
+            nq = self.next_subset(q, sym)
+            trans[sym] = nq
+        if len(nq) == 0:
+            return None
+        return nq
+
+    def accepts(self, q):
+        return self.entry(q)[0]
+
+    def process(self, data):
+        """
+        Same as FSM.process, the accepting state being returned as the
+        subset of NFA states it stands for
+        """
+        return self.process_many([data])[0]
+
+    def process_many(self, paths):
+        """ Match an iterable of switch paths, see CompiledDFA.process_many """
+        ret = []
+        entry = self.entry
+        for path in paths:
+            q = self.start
+            acc, trans = entry(q)
+            for sym in path:
+                nq = trans.get(sym)
+                if nq is None:
+                    nq = self.next_subset(q, sym)
+                    trans[sym] = nq
+                if len(nq) == 0:
+                    break
+                q = nq
+                acc, trans = entry(q)
+            else:
+                if acc:
+                    ret.append(q)
+                    continue
+            ret.append(None)
+
+        return ret
+
+class MultiDFA:
+    """
+    Union of several path automata (CompiledDFA or LazyDFA), each one
+    identified by a label. The product automaton is built on the fly: a
+    product state is the tuple of the component states (None once the
+    component rejected the path), interned to an integer and labelled with
+    the labels of the accepting components, so one pass over a path
+    returns every matching expression. Once more than @cache_size product
+    states are known, the cache is flushed before the next path.
+    """
+
+    def __init__(self, matchers, labels, cache_size=65536):
+        self.matchers = matchers
+        self.labels = labels
+        self.cache_size = cache_size
+        self.dead = tuple([None]*len(matchers))
+        self.flush()
+
+    def flush(self):
+        self.index = {}     # product state -> id
+        self.tuples = []    # id -> product state
+        self.accepts = []   # id -> labels of the accepting components
+        self.trans = []     # id -> {symbol: id}, -1 for the dead state
+        self.intern(tuple([m.start for m in self.matchers]))
+
+    def intern(self, q):
+        if q == self.dead:
+            return -1
+        i = self.index.get(q)
+        if i is None:
+            i = len(self.tuples)
+            labels = []
+            for j in range(len(q)):
+                if q[j] is not None and self.matchers[j].accepts(q[j]):
+                    labels.append(self.labels[j])
+            self.index[q] = i
+            self.tuples.append(q)
+            self.accepts.append(frozenset(labels))
+            self.trans.append({})
+        return i
+
+    def next_state(self, i, sym):
+        nq = []
+        for j, q in enumerate(self.tuples[i]):
+            if q is None:
+                nq.append(None)
+            else:
+                nq.append(self.matchers[j].step(q, sym))
+        ni = self.intern(tuple(nq))
+        self.trans[i][sym] = ni
+        return ni
+
+    def process(self, data):
+        """ Return the set of labels of the expressions matching @data """
+        return self.process_many([data])[0]
+
+    def process_many(self, paths):
+        """ Match an iterable of switch paths, return a set of labels per path """
+        ret = []
+        none = frozenset()
+        for path in paths:
+            if len(self.tuples) > self.cache_size:
+                self.flush()
+            trans = self.trans
+            q = 0
+            for sym in path:
+                nq = trans[q].get(sym)
+                if nq is None:
+                    nq = self.next_state(q, sym)
+                if nq < 0:
+                    break
+                q = nq
+            else:
+                ret.append(self.accepts[q])
+                continue
+            ret.append(none)
+
+        return ret
+
 class AST:
     def __init__(self):
         self.left = None
@@ -282,125 +881,299 @@ class RegexParser:
     WILDCARD = -3
     UNION = -4
     CONCAT = -5
+    OPTIONAL = -6
+    REPEAT = -7
+
+    # AST operators, the unary ones only have a left child
+    OPERATORS = (KLEENE, CONCAT, UNION, OPTIONAL)
+
+    # NFA constructions
+    THOMPSON = 'thompson'
+    GLUSHKOV = 'glushkov'
 
     def __init__(self):
-        pass
+        self.stats = {}     # state counts of the last compiled expression
 
-    def get_fsm_symbol(self, sym):
-        """ Single symbol to FSM """
-        fsm = FSM()
-        fsm.add_transition(0, sym, 1)
-        fsm.set_accepting([1])
-        fsm.last_state = 1
-        return fsm
+    def translate_ast(self, ast):
+        """
+        Generate corresponding FSM from AST data (Thompson construction).
 
-    def get_fsm_union(self, m1, m2):
-        """ Merge two FSM with union operator """
+        The AST is walked in post-order with an explicit stack and every
+        sub-expression is a (start, end) fragment of a single FSM, so the
+        construction is linear and does not depend on the recursion limit.
+        State 0 is a fresh initial state leading to the root fragment.
+        """
         fsm = FSM()
-        m1_init = 1
-        m2_init = 1+m1.state_size()
-        fstate = m2_init+m2.state_size()
-
-        fsm.import_transitions(m1.get_all_transitions(), m1_init)
-        fsm.import_transitions(m2.get_all_transitions(), m2_init)
-        fsm.add_transition(0, FSM.epsilon, m1_init)
-        fsm.add_transition(0, FSM.epsilon, m2_init)
-        fsm.add_transition(m1.last_state+m1_init, FSM.epsilon, fstate)
-        fsm.add_transition(m2.last_state+m2_init, FSM.epsilon, fstate)
-        fsm.set_accepting([fstate])
-        fsm.last_state = fstate
+        states = fsm.states
+        states[0] = {}
+
+        def new_state():
+            q = len(states)
+            states[q] = {}
+            return q
+
+        def link(q, sym, t):
+            trans = states[q]
+            if sym not in trans:
+                trans[sym] = [t]
+            else:
+                trans[sym].append(t)
+
+        frags = []
+        stack = [(ast, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            op = node.data
+            if op in RegexParser.OPERATORS and not expanded:
+                stack.append((node, True))
+                if op in (RegexParser.CONCAT, RegexParser.UNION):
+                    stack.append((node.right, False))
+                stack.append((node.left, False))
+                continue
+
+            if op == RegexParser.KLEENE:
+                s1, e1 = frags.pop()
+                start, end = new_state(), new_state()
+                link(start, FSM.epsilon, s1)
+                link(start, FSM.epsilon, end)
+                link(e1, FSM.epsilon, s1)
+                link(e1, FSM.epsilon, end)
+            elif op == RegexParser.OPTIONAL:
+                s1, e1 = frags.pop()
+                start, end = new_state(), new_state()
+                link(start, FSM.epsilon, s1)
+                link(start, FSM.epsilon, end)
+                link(e1, FSM.epsilon, end)
+            elif op == RegexParser.CONCAT:
+                s2, e2 = frags.pop()
+                s1, e1 = frags.pop()
+                link(e1, FSM.epsilon, s2)
+                start, end = s1, e2
+            elif op == RegexParser.UNION:
+                s2, e2 = frags.pop()
+                s1, e1 = frags.pop()
+                start, end = new_state(), new_state()
+                link(start, FSM.epsilon, s1)
+                link(start, FSM.epsilon, s2)
+                link(e1, FSM.epsilon, end)
+                link(e2, FSM.epsilon, end)
+            else:
+                start, end = new_state(), new_state()
+                link(start, op, end)
+            frags.append((start, end))
+
+        start, end = frags.pop()
+        link(0, FSM.epsilon, start)
+        fsm.set_accepting([end])
+        fsm.last_state = end
         return fsm
 
-    def get_fsm_concat(self, m1, m2):
-        """ Merge two FSM with (implicit) concatenation operator """
-        fsm = FSM()
-        m2_offset = m1.state_size() - 1
-        fstate = m2.last_state + m2_offset
+    def position_automaton(self, ast):
+        """
+        Generate the position (Glushkov) automaton of the AST: state 0 is
+        the initial state and every leaf of the AST is a state, entered
+        with the symbol of the leaf. The automaton has no epsilon edge and
+        is computed from the nullable/first/last sets of each node and the
+        follow set of each position, with an explicit post-order stack.
+        """
+        syms = [None]   # position -> symbol
+        follow = [None] # position -> set of positions
+        info = []       # (nullable, first, last) of the processed nodes
+
+        stack = [(ast, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            op = node.data
+            if op in RegexParser.OPERATORS and not expanded:
+                stack.append((node, True))
+                if op in (RegexParser.CONCAT, RegexParser.UNION):
+                    stack.append((node.right, False))
+                stack.append((node.left, False))
+                continue
+
+            if op == RegexParser.KLEENE:
+                nullable, first, last = info.pop()
+                for p in last:
+                    follow[p].update(first)
+                info.append((True, first, last))
+            elif op == RegexParser.OPTIONAL:
+                nullable, first, last = info.pop()
+                info.append((True, first, last))
+            elif op == RegexParser.CONCAT:
+                n2, f2, l2 = info.pop()
+                n1, f1, l1 = info.pop()
+                for p in l1:
+                    follow[p].update(f2)
+                # sets are shared between nodes, never modified in place
+                first = f1 | f2 if n1 else f1
+                last = l1 | l2 if n2 else l2
+                info.append((n1 and n2, first, last))
+            elif op == RegexParser.UNION:
+                n2, f2, l2 = info.pop()
+                n1, f1, l1 = info.pop()
+                info.append((n1 or n2, f1 | f2, l1 | l2))
+            else:
+                p = len(syms)
+                syms.append(op)
+                follow.append(set())
+                info.append((False, frozenset([p]), frozenset([p])))
 
-        fsm.import_transitions(m1.get_all_transitions(), 0)
-        fsm.import_transitions(m2.get_all_transitions(), m2_offset)
-        fsm.set_accepting([fstate])
-        fsm.last_state = fstate
-        return fsm
+        nullable, first, last = info.pop()
 
-    def get_fsm_kleene(self, m1):
-        """ Apply the Kleene operator to an FSM """
         fsm = FSM()
-        m1_offset = 1
-        fstate = m1_offset + m1.state_size()
-
-        fsm.import_transitions(m1.get_all_transitions(), m1_offset)
-        fsm.add_transition(0, FSM.epsilon, 1)
-        fsm.add_transition(0, FSM.epsilon, fstate)
-        fsm.add_transition(m1.last_state+m1_offset, FSM.epsilon, 1)
-        fsm.add_transition(m1.last_state+m1_offset, FSM.epsilon, fstate)
-        fsm.set_accepting([fstate])
-        fsm.last_state = fstate
-        return fsm
+        fsm.states[0] = {}
+        for p in range(1, len(syms)):
+            fsm.states[p] = {}
+        for p, targets in [(0, first)] + [(p, follow[p]) for p in range(1, len(syms))]:
+            trans = fsm.states[p]
+            for q in targets:
+                if syms[q] not in trans:
+                    trans[syms[q]] = [q]
+                else:
+                    trans[syms[q]].append(q)
 
-    def translate_ast(self, ast):
-        """ Generate corresponding FSM from AST data """
-        if ast.data == RegexParser.KLEENE:
-            return self.get_fsm_kleene(self.translate_ast(ast.left))
-        elif ast.data == RegexParser.CONCAT:
-            return self.get_fsm_concat(self.translate_ast(ast.left), self.translate_ast(ast.right))
-        elif ast.data == RegexParser.UNION:
-            return self.get_fsm_union(self.translate_ast(ast.left), self.translate_ast(ast.right))
-        else:
-            return self.get_fsm_symbol(ast.data)
+        fsm.accepting = sorted(last)
+        if nullable:
+            fsm.accepting.insert(0, 0)
+        return fsm
 
-    def get_next_symbol(self, s):
-        """ Get next symbol in input string. Returns symbol,isoperator tuple.
-            @symbol is an internal representation of the symbol
+    def get_next_symbol(self, s, i):
+        """ Get the symbol starting at index @i of input string @s. Returns
+            a symbol,isoperator,index tuple.
+            @symbol is an internal representation of the symbol: a switch,
+                a switch class (frozenset of switches), an operator, or a
+                (REPEAT, min, max) tuple for a bounded repetition
             @isoperator is True if the parsed sym is an operator, False otherwise
+            @index is the position following the symbol
         """
-        if len(s) == 0:
-            return None, None
+        if i >= len(s):
+            return None, None, i
 
+        c = s[i]
         # Dot character, Kleene star or union operator
-        if s[0] == '.' or s[0] == '*' or s[0] == '|':
-            if s[0] == '.':
-                sym = RegexParser.WILDCARD
-                s[:] = s[1:]
-                return sym, False
-            elif s[0] == '*':
-                sym = RegexParser.KLEENE
-            elif s[0] == '|':
-                sym = RegexParser.UNION
-            s[:] = s[1:]
-            return sym, True
+        if c == '.':
+            return RegexParser.WILDCARD, False, i+1
+        elif c == '*':
+            return RegexParser.KLEENE, True, i+1
+        elif c == '|':
+            return RegexParser.UNION, True, i+1
         # Switch symbol
-        elif s[0] == 's':
-            sym = 's'
-            s[:] = s[1:]
-            while len(s) > 0 and s[0] in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']:
-                sym += s[0]
-                s[:] = s[1:]
-            return sym, False
+        elif c == 's':
+            j = i+1
+            while j < len(s) and s[j].isdigit():
+                j += 1
+            return ''.join(s[i:j]), False, j
         # Concatenation operator
-        elif s[0] == ',':
-            s[:] = s[1:]
-            return RegexParser.CONCAT, True
+        elif c == ',':
+            return RegexParser.CONCAT, True, i+1
+        # Switch class: [s1 s2 s40-s80]
+        elif c == '[':
+            j = s.find(']', i)
+            if j < 0:
+                raise RuntimeError('Unterminated switch class at position '+str(i)+' of path expression')
+            return self.parse_class(s[i+1:j], i+1), False, j+1
+        # Bounded repetition: {m}, {m,}, {m,n}
+        elif c == '{':
+            j = s.find('}', i)
+            if j < 0:
+                raise RuntimeError('Unterminated repetition at position '+str(i)+' of path expression')
+            return self.parse_bounds(s[i+1:j], i+1), True, j+1
+
+        raise RuntimeError('Invalid character '+repr(c)+' at position '+str(i)+' of path expression')
+
+    def parse_class(self, s, pos):
+        """
+        Switch class from the content @s of [...] (starting at index @pos of
+        the expression): switches and ranges like s40-s80, optionally
+        separated by spaces or commas. A single switch is returned as is
+        """
+        syms = set()
+        i = 0
+        while i < len(s):
+            if s[i] in ' \t,':
+                i += 1
+                continue
+            lo, isop, j = self.get_next_symbol(s, i)
+            if isop or lo == RegexParser.WILDCARD or type(lo) is not str or len(lo) < 2:
+                raise RuntimeError('Invalid switch at position '+str(pos+i)+' of path expression')
+            i = j
+            if i < len(s) and s[i] == '-':
+                hi, isop, j = self.get_next_symbol(s, i+1)
+                if isop or type(hi) is not str or len(hi) < 2 or int(hi[1:]) < int(lo[1:]):
+                    raise RuntimeError('Invalid switch range at position '+str(pos+i)+' of path expression')
+                i = j
+                for k in range(int(lo[1:]), int(hi[1:])+1):
+                    syms.add('s'+str(k))
+            else:
+                syms.add(lo)
+
+        if len(syms) == 0:
+            raise RuntimeError('Empty switch class at position '+str(pos)+' of path expression')
+        return FSM.label(syms)
+
+    def parse_bounds(self, s, pos):
+        """ (REPEAT, min, max) tuple from the content @s of {...}, max is None if unbounded """
+        bounds = s.replace(' ', '').split(',')
+        try:
+            if len(bounds) == 1:
+                m = n = int(bounds[0])
+            elif len(bounds) == 2:
+                m = int(bounds[0]) if bounds[0] != '' else 0
+                n = int(bounds[1]) if bounds[1] != '' else None
+            else:
+                raise ValueError
+        except ValueError:
+            raise RuntimeError('Invalid repetition bounds at position '+str(pos)+' of path expression')
+        if m < 0 or (n is not None and (n < m or n == 0)):
+            raise RuntimeError('Invalid repetition bounds at position '+str(pos)+' of path expression')
+        return (RegexParser.REPEAT, m, n)
+
+    def repeat(self, ast, m, n):
+        """
+        Expand the bounded repetition @ast{@m,@n} in the AST: @m copies
+        followed by nested optional copies, x{1,3} being x,(x,(x)?)?, or by
+        x* if @n is None. Copies share the subtree of @ast, the NFA
+        constructions walk it once per reference
+        """
+        if n is None:
+            tail = AST(ast, None, RegexParser.KLEENE)
+        elif n > m:
+            tail = AST(ast, None, RegexParser.OPTIONAL)
+            for k in range(n-m-1):
+                tail = AST(AST(ast, tail, RegexParser.CONCAT), None, RegexParser.OPTIONAL)
+        else:
+            tail = None
 
-        dlog('Failed for '+str.join('',s))
-        return None
+        if m == 0:
+            return tail
+        if tail is None:
+            return self.concat([ast]*(m-1), ast)
+        return self.concat([ast]*(m-1)+[tail], ast)
 
     def concat(self, array, root):
-        if len(array) == 0:
-            return root
-        return self.concat(array[1:], AST(root, array[0], RegexParser.CONCAT))
+        """ Left-deep concatenation of @root and the ASTs of @array """
+        for a in array:
+            root = AST(root, a, RegexParser.CONCAT)
+        return root
 
     def parse(self, regex):
-        """ Generate an AST from a path expression """
+        """ Generate an AST from a path expression (string or list of characters) """
+
+        if not isinstance(regex, basestring):
+            regex = ''.join(regex) # get_next_symbol searches the string
 
         farray = []
         union = False
         psym = False
         ast = None
-
-        while len(regex) > 0:
-            sym, isop = self.get_next_symbol(regex)
-            dlog('Parsing sym '+str(sym)+' and isop '+str(isop))
+        i = 0
+        upos = None # position of the last union operator
+
+        while i < len(regex):
+            pos = i
+            sym, isop, i = self.get_next_symbol(regex, i)
+            if debug:
+                dlog('Parsing sym '+str(sym)+' and isop '+str(isop))
             if not isop:
                 if psym:
                     union = False
@@ -418,14 +1191,25 @@ class RegexParser:
             else:
                 if sym == RegexParser.CONCAT:
                     continue
+                # operators apply to the previous operand, a union waits for its right one
+                if ast is None or (ast.data == RegexParser.UNION and ast.right is None):
+                    raise RuntimeError('Missing operand before '+repr(regex[pos])+' at position '+str(pos)+' of path expression')
                 if sym == RegexParser.UNION:
                     union = True
+                    upos = pos
                 elif union:
                     union = False
-                ast = AST(ast, None, sym)
+                if type(sym) is tuple:
+                    ast = self.repeat(ast, sym[1], sym[2])
+                else:
+                    ast = AST(ast, None, sym)
                 psym = False
                 if debug:
                     dlog('Created blank ast with previous ast and symbol')
+        if ast is None:
+            raise RuntimeError('Empty path expression')
+        if ast.data == RegexParser.UNION and ast.right is None:
+            raise RuntimeError('Missing operand after \'|\' at position '+str(upos)+' of path expression')
         farray.append(ast)
 
         if len(farray) > 1:
@@ -435,25 +1219,63 @@ class RegexParser:
 
         return res
 
-    def create_fsm(self, regex):
-        # Transform input string to list
-        rlist = [x for x in regex]
-
+    def create_fsm(self, regex, minimize=True, max_states=None, method=THOMPSON):
+        """
+        Compile a path expression to a DFA. The state counts of each stage
+        are stored in self.stats. If the DFA would have more than
+        @max_states states, a LazyDFA is returned instead.
+        @method selects the NFA construction: RegexParser.THOMPSON (then
+        epsilon-removal) or RegexParser.GLUSHKOV (position automaton)
+        """
         # Generate AST from input
-        ast = self.parse(rlist)
+        ast = self.parse(regex)
 
         # Translate AST to NFA
-        fsm = self.translate_ast(ast)
-        dlog('NFA FULL TRANSITIONS:')
-        dlog(str(fsm.get_all_transitions()))
-        dlog('ACCEPTING')
-        dlog(str(fsm.accepting))
-        dlog('EOF')
+        if method == RegexParser.GLUSHKOV:
+            fsm = self.position_automaton(ast)
+        else:
+            fsm = self.translate_ast(ast)
+        if debug:
+            dlog('NFA FULL TRANSITIONS:')
+            dlog(str(fsm.get_all_transitions()))
+            dlog('ACCEPTING')
+            dlog(str(fsm.accepting))
+            dlog('EOF')
+        self.stats = {'nfa': fsm.state_size()}
 
         # Apply epsilon-removal algorithm
-        fsm.remove_epsilon()
+        if method != RegexParser.GLUSHKOV:
+            fsm.remove_epsilon()
 
         # Translate NFA to DFA
-        dfa = fsm.to_dfa()
-
+        dfa = fsm.to_dfa(max_states)
+        if dfa is None:
+            dlog('Falling back to lazy determinization')
+            self.stats['dfa'] = None
+            return LazyDFA(fsm)
+        self.stats['dfa'] = dfa.state_size()
+
+        # Merge equivalent states
+        if minimize:
+            dfa = dfa.minimize()
+            self.stats['min'] = dfa.state_size()
+
+        dlog('State counts: '+str(self.stats))
         return dfa
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print 'Usage: '+sys.argv[0]+' <path expression> [switch ...]'
+        sys.exit(-1)
+
+    p = RegexParser()
+    dfa = p.create_fsm(sys.argv[1])
+    print 'NFA states: %d' % (p.stats['nfa'])
+    print 'DFA states: %d' % (p.stats['dfa'])
+    print 'Minimized DFA states: %d' % (p.stats['min'])
+
+    if len(sys.argv) > 2:
+        if dfa.process(sys.argv[2:]) is not None:
+            print 'Path accepted'
+        else:
+            print 'Path rejected'
@@ -43,7 +43,8 @@ class Requirements:
     def finalize(self):
         """
         * Append each member of a constraint group to the list of constraints
-        * Create the grouped conditions
+        * Create the grouped conditions. Members of a group sharing the same
+          conditions share their grouped condition, hence their probes
         """
 
         for gid in self.grpconstraints:
@@ -51,8 +52,16 @@ class Requirements:
 
         for constr in self.constraints:
             if constr.ctype == Constraint.CONSTR_GROUP:
+                gcs = []
                 for subc in constr.constraints:
-                    gc = GroupCondition(subc.conditions)
+                    gc = None
+                    for g in gcs:
+                        if g.conds == subc.conditions:
+                            gc = g
+                            break
+                    if gc is None:
+                        gc = GroupCondition(subc.conditions)
+                        gcs.append(gc)
                     self.add_condition(gc, subc)
             else:
                 gc = GroupCondition(constr.conditions)
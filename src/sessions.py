@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import sys, socket, select, threading
+from time import time
+from oflownet import *
+
+"""
+Persistent OpenFlow connections, one per datapath, shared by the flow
+table hooking and the probe injection. Idle connections are kept alive by
+a background thread answering the echo requests of the switches and
+probing them, and broken connections are reopened on their next use.
+"""
+
+class Session:
+    """
+    Connection to the OpenFlow agent of one switch
+    """
+    def __init__(self, node, ip, port, protocol=OFlowNet, stats=None):
+        self.node = node
+        self.ip = ip
+        self.port = port
+        self.protocol = protocol # OFlowNet class of the connection
+        self.stats = stats      # SwitchStats of the connections, if instrumented
+        self.ofnet = None       # OFlowNet, None if not connected
+        self.lock = threading.Lock()
+        self.last_recv = 0      # last time something was received
+        self.last_send = 0      # last time something was sent
+        self.echo_sent = None   # time of the unanswered keepalive echo request
+        self.opened = 0         # number of connections opened
+
+    def open(self):
+        ofnet = self.protocol(self.stats)
+        ofnet.connect(self.ip, self.port)
+        ofnet.handshake() # wait for HELLO and reply with HELLO
+        self.ofnet = ofnet
+        self.opened += 1
+        self.last_recv = self.last_send = time()
+        self.echo_sent = None
+
+    def close(self):
+        if self.ofnet is not None:
+            try:
+                self.ofnet.disconnect()
+            except socket.error:
+                pass
+            self.ofnet = None
+
+    def drain(self):
+        """
+        Handle the messages received while the session was idle: answer
+        echo requests, report errors. Does not block
+        """
+        ofnet = self.ofnet
+        while True:
+            m = ofnet.next_message()
+            if m is None:
+                if len(select.select([ofnet.sock], [], [], 0)[0]) == 0:
+                    return
+                ofnet.fill()
+                self.last_recv = time()
+                self.echo_sent = None # the switch is alive
+                continue
+
+            hdr, msg = m
+            if hdr.get('type') == ofnet.Type.OFPT_ECHO_REQUEST:
+                reply = ofnet.Header(ofnet.Type.OFPT_ECHO_REPLY, hdr.get('length'))
+                reply.set('xid', hdr.get('xid'))
+                ofnet.send(reply.pack()+msg.tobytes())
+            elif hdr.get('type') == ofnet.Type.OFPT_ERROR:
+                ofnet.parse_error(hdr, msg)
+
+class SessionPool:
+    """
+    One Session per datapath, opened on first use. @keepalive is the idle
+    time in seconds after which a switch is probed with an echo request, a
+    switch not answering within another @keepalive seconds is disconnected.
+    @protocol is the OFlowNet class of the connections (OFlowNet13 for
+    OpenFlow 1.3 switches). With an OFlowStats @stats, the connections
+    are instrumented, under the name s<node>
+    """
+    def __init__(self, mapping=None, keepalive=5.0, protocol=OFlowNet, stats=None):
+        self.mapping = mapping
+        self.keepalive = keepalive
+        self.protocol = protocol
+        self.stats = stats
+        self.sessions = {}      # node -> Session
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+        # counters
+        self.connects = 0
+        self.reconnects = 0
+        self.requests = 0
+        self.failures = 0
+
+    def set_mapping(self, mapping):
+        self.mapping = mapping
+
+    def get(self, node):
+        with self.lock:
+            s = self.sessions.get(node)
+            if s is None:
+                ip, _, port = self.mapping.get_data(node)
+                stats = None
+                if self.stats is not None:
+                    stats = self.stats.switch('s'+str(node))
+                s = Session(node, ip, port, self.protocol, stats)
+                self.sessions[node] = s
+            return s
+
+    def run(self, node, f, retry=False):
+        """
+        Call f(ofnet) with the live OFlowNet of switch @node, connecting
+        first if needed, and return its result. If the connection breaks,
+        it is closed, and f is called once more on a new connection if
+        @retry is set (only for operations safe to repeat, or resuming
+        where the failed call stopped)
+        """
+        s = self.get(node)
+        with s.lock:
+            while True:
+                try:
+                    if s.ofnet is None:
+                        reopen = s.opened > 0
+                        s.open()
+                        with self.lock:
+                            self.connects += 1
+                            if reopen:
+                                self.reconnects += 1
+                    else:
+                        s.drain()
+                    with self.lock:
+                        self.requests += 1
+                    ret = f(s.ofnet)
+                    s.last_send = time()
+                    return ret
+                except (socket.error, RuntimeError), e:
+                    with self.lock:
+                        self.failures += 1
+                    s.close()
+                    if not retry:
+                        raise RuntimeError('session to s%s (%s:%d) failed: %s' % (str(node), s.ip, s.port, str(e)))
+                    sys.stderr.write('Warning: session to s'+str(node)+' failed ('+str(e)+'), reconnecting\n')
+                    retry = False
+
+    def packet_out(self, node, inport, pkt, outport=OFP_Port_No.OFPP_TABLE):
+        """
+        Send @pkt out of switch @node, at most once: the session is
+        reopened if it broke while idle, but a packet-out whose write
+        failed is not sent again, as it may have reached the switch
+        """
+        written = [False]
+        def send(ofnet):
+            if not written[0]:
+                written[0] = True
+                ofnet.packet_out(inport, pkt, outport)
+        self.run(node, send, retry=True)
+
+    def start(self):
+        """ Start the keepalive thread """
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.keepalive_loop, name='sessions')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def keepalive_loop(self):
+        while not self.stopped.wait(self.keepalive/2):
+            with self.lock:
+                sessions = self.sessions.values()
+            for s in sessions:
+                if not s.lock.acquire(False): # in use, hence alive
+                    continue
+                try:
+                    if s.ofnet is None:
+                        continue
+                    s.drain()
+                    now = time()
+                    if s.echo_sent is not None:
+                        if now - s.echo_sent > self.keepalive:
+                            sys.stderr.write('Warning: s'+str(s.node)+' does not answer, disconnecting\n')
+                            s.close()
+                    elif now - max(s.last_recv, s.last_send) > self.keepalive:
+                        s.ofnet.echo()
+                        s.echo_sent = now
+                except (socket.error, RuntimeError):
+                    s.close()
+                finally:
+                    s.lock.release()
+
+    def close(self):
+        """ Stop the keepalive thread and close all the sessions """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            for s in self.sessions.values():
+                with s.lock:
+                    s.close()
+
+    def counters(self):
+        return {'connects': self.connects, 'reconnects': self.reconnects, 'requests': self.requests, 'failures': self.failures}
+
+    def dump(self):
+        print 'Sessions: %d switches, %d connections (%d reconnections), %d requests, %d failures' % (len(self.sessions), self.connects, self.reconnects, self.requests, self.failures)
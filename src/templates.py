@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import socket, struct
+
+"""
+Precompiled probe templates. The packets of a protocol handler are
+serialized once, with placeholder addresses, and each probe is then made
+by patching the MAC and IP addresses, the IP id and the identifier of the
+transport header (UDP/TCP source port, ICMP echo id) into the template
+bytes and fixing the IP header checksum. The transport checksum is left
+as set by the handler (the 0x4242 magic), so the payload does not need to
+be summed
+"""
+
+ETH_LEN = 14
+
+class PlaceholderMapping:
+    """ Mapping giving the same addresses to every node, to build the templates """
+    def get_ip(self, node):
+        return '0.0.0.0'
+
+    def get_mac(self, node):
+        return '00:00:00:00:00:00'
+
+def mac_bytes(mac):
+    return ''.join([chr(int(x, 16)) for x in mac.split(':')])
+
+def ip_bytes(ip):
+    return socket.inet_aton(ip)
+
+class ProbeTemplate:
+    """
+    Ethernet/IPv4 probe serialized in @data. build() returns a copy with
+    the given addresses and identifiers, patched into a buffer allocated
+    once per template
+    """
+
+    # Ethernet and IPv4 header fields patched by build()
+    ADDRS = struct.Struct('>6s6s')
+    IP_ID = struct.Struct('>H')
+    IP_ADDRS = struct.Struct('>4s4s')
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+        if len(self.data) < ETH_LEN + 20 or struct.unpack_from('>H', self.data, 12)[0] != 0x0800:
+            raise RuntimeError("probe template is not an IPv4 packet")
+        self.ihl = (self.data[ETH_LEN] & 0x0f)*4
+        self.proto = self.data[ETH_LEN+9]
+        l4 = ETH_LEN + self.ihl
+        if self.proto in (6, 17): # TCP, UDP: source port
+            self.id_offset = l4
+        elif self.proto == 1: # ICMP echo: id
+            self.id_offset = l4 + 4
+        else:
+            raise RuntimeError("unsupported probe protocol %d" % (self.proto))
+        if len(self.data) < self.id_offset + 2:
+            raise RuntimeError("truncated probe template")
+
+        # one's complement sum of the IP header words that build() does not
+        # patch (all but the id, the checksum and the addresses)
+        words = struct.unpack_from('>%dH' % (self.ihl/2), self.data, ETH_LEN)
+        self.ip_sum = sum(words) - words[2] - words[5] - sum(words[6:10])
+        self.buf = bytearray(self.data)
+
+    def build(self, smac, dmac, sip, dip, ipid, tid):
+        """
+        Probe from @smac to @dmac and @sip to @dip (packed bytes, see
+        mac_bytes and ip_bytes) with IP id @ipid and transport id @tid
+        """
+        buf = self.buf
+        ProbeTemplate.ADDRS.pack_into(buf, 0, dmac, smac)
+        ProbeTemplate.IP_ID.pack_into(buf, ETH_LEN+4, ipid)
+        ProbeTemplate.IP_ADDRS.pack_into(buf, ETH_LEN+12, sip, dip)
+        struct.pack_into('>H', buf, self.id_offset, tid)
+
+        s = self.ip_sum + ipid + sum(struct.unpack_from('>4H', buf, ETH_LEN+12))
+        s = (s & 0xffff) + (s >> 16)
+        s = (s & 0xffff) + (s >> 16)
+        struct.pack_into('>H', buf, ETH_LEN+10, ~s & 0xffff)
+        return str(buf)
+
+def compile_protocol(inst, linklayer):
+    """
+    Templates of the packets built by the protocol handler @inst, given
+    the placeholder Ethernet layer @linklayer
+    """
+    pkts = inst.build_layers(0, 0, 0, PlaceholderMapping(), linklayer)
+    return [ProbeTemplate(str(p)) for p in pkts]
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import random, struct, unittest
+import flowtable
+from flowtable import *
+
+"""
+Tests of the columnar flow table: the rows and queries of a FlowTable
+built from random flow stats entries, against OFlowNet.parse_flow and
+plain scans of the entries. Run with
+python -m unittest test_flowtable
+"""
+
+def action_output(port):
+    act = OFP_Action_Output()
+    act.set('type', OFP_Action_Type.OFPAT_OUTPUT)
+    act.set('len', act.length)
+    act.set('port', port)
+    return act.pack()
+
+def action_dl_dst(mac):
+    act = OFP_Action_Mod_Dl_Dst()
+    act.set('type', OFP_Action_Type.OFPAT_SET_DL_DST)
+    act.set('len', act.length)
+    act.set('dl_dst', mac)
+    return act.pack()
+
+def action_vlan(vid):
+    # OFPAT_SET_VLAN_VID, not decoded by FlowTable
+    return struct.pack('>HHH2x', OFP_Action_Type.OFPAT_SET_VLAN_VID, 8, vid)
+
+def flow_stats(table_id, priority, cookie, ofp_match, actions):
+    ofp_fwst = OFP_Flow_Stats()
+    ofp_fwst.set('length', ofp_fwst.length + len(actions))
+    ofp_fwst.set('table_id', table_id)
+    ofp_fwst.set('priority', priority)
+    ofp_fwst.set('cookie', cookie)
+    buf = bytearray(ofp_fwst.length)
+    ofp_fwst.pack_into(buf)
+    ofp_match.pack_into(buf, 4)
+    return str(buf) + actions
+
+def random_flow(rng):
+    ofp_match = OFP_Match()
+    wildcards = OFP_Flow_Wildcards.OFPFW_ALL
+    for n in ('in_port', 'dl_type', 'tp_dst'):
+        if rng.random() < 0.5:
+            wildcards &= ~WILDCARDS[n]
+            ofp_match.set(n, rng.randint(1, 4))
+    if rng.random() < 0.5:
+        wildcards &= ~WILDCARDS['dl_dst']
+        ofp_match.set('dl_dst', '\x02\x00\x00\x00\x00' + chr(rng.randint(1, 4)))
+    ofp_match.set('wildcards', wildcards)
+
+    actions = []
+    for i in range(rng.randint(0, 3)):
+        r = rng.random()
+        if r < 0.2:
+            actions.append(action_vlan(rng.randint(1, 100)))
+        elif r < 0.4:
+            actions.append(action_dl_dst('\x42\x42\x00\x01\x00' + chr(rng.randint(1, 4))))
+        else:
+            actions.append(action_output(rng.randint(1, 6)))
+    return flow_stats(rng.randint(0, 1), rng.randint(0, 3), rng.getrandbits(64), ofp_match, ''.join(actions))
+
+class FlowTableTest(unittest.TestCase):
+    """ Rows, actions and queries of a FlowTable against parse_flow and scans """
+
+    def setUp(self):
+        self.rng = random.Random(2222)
+        self.entries = [random_flow(self.rng) for i in range(300)]
+        self.table = FlowTable()
+        self.assertEqual(len(self.entries), self.table.add_stats(''.join(self.entries)))
+        self.flows = []
+        for e in self.entries:
+            plen, flow = OFlowNet().parse_flow(e)
+            self.flows.append(flow)
+        self.columns = flowtable.COLUMNS
+
+    def tearDown(self):
+        flowtable.COLUMNS = self.columns
+
+    def test_rows(self):
+        self.assertEqual(len(self.entries), len(self.table))
+        for i, flow in enumerate(self.flows):
+            row = self.table.flow(i)
+            self.assertEqual(flow['body'].pack(), row['body'].pack())
+            self.assertEqual(flow['match'].pack(), row['match'].pack())
+            self.assertEqual([a.pack() for a in flow['actions']], [a.pack() for a in row['actions']])
+            self.assertEqual(flow['body'].get('cookie'), self.table.get(i, 'cookie'))
+
+    def test_actions(self):
+        # every action, decoded or not, packs back to its bytes
+        for i, e in enumerate(self.entries):
+            actions = self.table.actions(i)
+            buf = bytearray(sum([a.length for a in actions]))
+            offset = 0
+            for a in actions:
+                a.pack_into(buf, offset)
+                offset += a.length
+            self.assertEqual(e[OFP_Flow_Stats.length:], str(buf))
+
+    def test_priority(self):
+        for priority in range(5):
+            expected = [i for i, f in enumerate(self.flows) if f['body'].get('priority') == priority]
+            self.assertEqual(expected, self.table.with_priority(priority))
+
+    def test_out_port(self):
+        for port in range(8):
+            expected = [i for i, f in enumerate(self.flows) if port in [a.get('port') for a in f['actions']]]
+            self.assertEqual(expected, self.table.with_out_port(port))
+
+    def test_field(self):
+        for n, values in (('in_port', range(6)), ('tp_dst', range(6)), ('dl_dst', ['\x02\x00\x00\x00\x00' + chr(k) for k in range(6)])):
+            for v in values:
+                expected = [i for i, f in enumerate(self.flows) if not f['match'].get('wildcards') & WILDCARDS[n] and f['match'].get(n) == v]
+                self.assertEqual(expected, self.table.with_field(n, v))
+
+        # the index built by with_field follows the flows added later
+        ofp_match = OFP_Match()
+        ofp_match.set('wildcards', OFP_Flow_Wildcards.OFPFW_ALL & ~OFP_Flow_Wildcards.OFPFW_TP_DST)
+        ofp_match.set('tp_dst', 3)
+        rows = list(self.table.with_field('tp_dst', 3))
+        self.table.add_stats(flow_stats(0, 0, 0, ofp_match, ''))
+        self.assertEqual(rows + [len(self.table)-1], self.table.with_field('tp_dst', 3))
+
+    def test_find(self):
+        # the last flow of the same table, match and priority wins
+        for i, f in enumerate(self.flows):
+            row = self.table.find(f['match'], f['body'].get('priority'), f['body'].get('table_id'))
+            self.assertEqual(self.table.key(i), self.table.key(row))
+            self.assertTrue(row >= i)
+
+    def test_find_table(self):
+        ofp_match = OFP_Match()
+        ofp_match.set('wildcards', OFP_Flow_Wildcards.OFPFW_ALL & ~OFP_Flow_Wildcards.OFPFW_IN_PORT)
+        ofp_match.set('in_port', 1)
+        table = FlowTable()
+        table.add_stats(flow_stats(0, 10, 1, ofp_match, action_output(2)) + flow_stats(1, 10, 2, ofp_match, action_output(3)))
+        self.assertEqual(0, table.find(ofp_match, 10))
+        self.assertEqual(1, table.find(ofp_match, 10, 1))
+        self.assertEqual(None, table.find(ofp_match, 10, 2))
+        self.assertEqual(None, table.find(ofp_match, 11))
+
+    def test_u64_columns(self):
+        # as on platforms where array('L') has 32 bits
+        flowtable.COLUMNS = [(n, 'u64' if t == flowtable.U64 else t) for n, t in self.columns]
+        table = FlowTable()
+        table.add_stats(''.join(self.entries))
+        for i, f in enumerate(self.flows):
+            self.assertEqual(f['body'].pack(), table.body(i).pack())
+        cookie = (0x4242 << 48) | 0x123456789
+        table.add_stats(flow_stats(0, 0, cookie, OFP_Match(), ''))
+        self.assertEqual(cookie, table.get(len(table)-1, 'cookie'))
+
+    def test_invalid(self):
+        e = flow_stats(0, 0, 0, OFP_Match(), '')
+        self.assertRaises(RuntimeError, FlowTable().add_stats, struct.pack('>H', 8) + e[2:])
+        self.assertRaises(RuntimeError, FlowTable().add_stats, flow_stats(0, 0, 0, OFP_Match(), struct.pack('>HH4x', 0, 4)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import os, sys, socket, threading, unittest
+from oflownet import *
+
+"""
+Tests of the OpenFlow 1.0 connection handling, against a socket pair
+standing for the switch. Run with
+python -m unittest test_oflownet
+"""
+
+def message(t, xid, body=''):
+    hdr = OFP_Header(t, OFP_Header.length+len(body))
+    hdr.set('xid', xid)
+    return hdr.pack() + body
+
+def flow_stats(priority, ports):
+    """ Flow stats entry of @priority with an output action to each of @ports """
+    ofp_fwst = OFP_Flow_Stats()
+    ofp_fwst.set('length', ofp_fwst.length + len(ports)*OFP_Action_Output.length)
+    ofp_fwst.set('priority', priority)
+    actions = []
+    for port in ports:
+        act = OFP_Action_Output()
+        act.set('type', OFP_Action_Type.OFPAT_OUTPUT)
+        act.set('len', act.length)
+        act.set('port', port)
+        actions.append(act.pack())
+    return ofp_fwst.pack() + ''.join(actions)
+
+def stats_reply(xid, flows, more):
+    ofp_streply = OFP_Stats_Reply()
+    ofp_streply.set('type', OFP_Stats_Types.OFPST_FLOW)
+    if more:
+        ofp_streply.set('flags', OFP_Stats_Reply_Flags.OFPSF_REPLY_MORE)
+    return message(OFP_Type.OFPT_STATS_REPLY, xid, ofp_streply.pack() + ''.join([flow_stats(*f) for f in flows]))
+
+class FramingTest(unittest.TestCase):
+    """ Messages read by OFlowNet.recv, however the stream is split """
+
+    def setUp(self):
+        self.switch, sock = socket.socketpair()
+        self.ofnet = OFlowNet()
+        self.ofnet.sock = sock
+
+    def tearDown(self):
+        self.switch.close()
+        self.ofnet.disconnect()
+
+    def check(self, msgs):
+        for t, xid, body in msgs:
+            hdr, msg = self.ofnet.recv()
+            self.assertEqual((t, xid, body), (hdr.get('type'), hdr.get('xid'), msg.tobytes()))
+
+    def test_coalesced(self):
+        msgs = [(OFP_Type.OFPT_ECHO_REQUEST, i, 'x'*i) for i in range(20)]
+        self.switch.sendall(''.join([message(*m) for m in msgs]))
+        self.check(msgs)
+
+    def test_partial(self):
+        data = message(OFP_Type.OFPT_ECHO_REPLY, 7, 'abcdefgh')
+        for i in range(len(data)-1):
+            self.switch.sendall(data[i])
+            self.ofnet.fill()
+            self.assertEqual(self.ofnet.next_message(), None)
+        self.switch.sendall(data[-1])
+        self.check([(OFP_Type.OFPT_ECHO_REPLY, 7, 'abcdefgh')])
+
+    def test_split_across_messages(self):
+        msgs = [(OFP_Type.OFPT_ECHO_REQUEST, i, chr(65+i)*(3*i)) for i in range(10)]
+        data = ''.join([message(*m) for m in msgs])
+        for i in range(0, len(data), 5):
+            self.switch.sendall(data[i:i+5])
+        self.check(msgs)
+
+    def test_buffer_growth(self):
+        # messages larger than the receive buffer, and straddling its end
+        self.ofnet.rbuf = bytearray(16)
+        msgs = [(OFP_Type.OFPT_ECHO_REQUEST, i, chr(97+i)*(10+7*i)) for i in range(6)]
+        self.switch.sendall(''.join([message(*m) for m in msgs]))
+        self.check(msgs)
+
+    def test_invalid_length(self):
+        self.switch.sendall(OFP_Header(OFP_Type.OFPT_ECHO_REQUEST, 4).pack())
+        self.assertRaises(RuntimeError, self.ofnet.recv)
+
+    def test_closed(self):
+        self.switch.sendall(message(OFP_Type.OFPT_ECHO_REQUEST, 1, 'abc')[:6])
+        self.switch.close()
+        self.assertRaises(RuntimeError, self.ofnet.recv)
+
+class MultipartTest(unittest.TestCase):
+    """ Flow stats replies in several parts, read by flow_stats_parts and iter_flows """
+
+    def setUp(self):
+        sock, self.sock = socket.socketpair()
+        self.switch = OFlowNet()
+        self.switch.sock = sock
+        self.ofnet = OFlowNet()
+        self.ofnet.sock = self.sock
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w') # parse_ping and parse_error print
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        self.switch.disconnect()
+        self.ofnet.disconnect()
+
+    def serve(self, replies):
+        """ Answer the flow stats request with the messages returned by replies(xid) """
+        def run():
+            hdr, msg = self.switch.recv()
+            self.assertEqual(hdr.get('type'), OFP_Type.OFPT_STATS_REQUEST)
+            self.switch.sock.sendall(''.join(replies(hdr.get('xid'))))
+        th = threading.Thread(target=run)
+        th.daemon = True
+        th.start()
+        return th
+
+    def test_reply_more(self):
+        def replies(xid):
+            return [stats_reply(xid, [(0, [1]), (1, [2]), (2, [1, 2])], True),
+                    stats_reply(xid ^ 1, [(9, [9])], False), # not ours
+                    message(OFP_Type.OFPT_ECHO_REQUEST, 42, 'ping'),
+                    stats_reply(xid, [(3, []), (4, [3])], True),
+                    stats_reply(xid, [(5, [4])], False),
+                    message(OFP_Type.OFPT_BARRIER_REPLY, 43)]
+        th = self.serve(replies)
+        flows = list(self.ofnet.iter_flows())
+        th.join()
+        self.assertEqual(range(6), [f['body'].get('priority') for f in flows])
+        self.assertEqual([[1], [2], [1, 2], [], [3], [4]], [[a.get('port') for a in f['actions']] for f in flows])
+
+        # the echo request was answered, the message after the last part is left unread
+        hdr, msg = self.switch.recv()
+        self.assertEqual((OFP_Type.OFPT_ECHO_REPLY, 42, 'ping'), (hdr.get('type'), hdr.get('xid'), msg.tobytes()))
+        hdr, msg = self.ofnet.recv()
+        self.assertEqual((OFP_Type.OFPT_BARRIER_REPLY, 43), (hdr.get('type'), hdr.get('xid')))
+
+    def test_parts(self):
+        th = self.serve(lambda xid: [stats_reply(xid, [(i, [1])]*i, i < 3) for i in range(4)])
+        counts = []
+        for msg, offset, end in self.ofnet.flow_stats_parts():
+            self.assertEqual(0, (end - offset) % (OFP_Flow_Stats.length + OFP_Action_Output.length))
+            counts.append((end - offset)/(OFP_Flow_Stats.length + OFP_Action_Output.length))
+        th.join()
+        self.assertEqual([0, 1, 2, 3], counts)
+
+    def test_error(self):
+        def replies(xid):
+            return [stats_reply(xid, [(0, [1])], True),
+                    message(OFP_Type.OFPT_ERROR, xid, OFP_Error().pack())]
+        th = self.serve(replies)
+        flows = []
+        try:
+            for flow in self.ofnet.iter_flows():
+                flows.append(flow)
+        except RuntimeError:
+            pass
+        else:
+            self.fail('error of the flow stats request ignored')
+        th.join()
+        self.assertEqual(1, len(flows))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import random, struct, unittest
+from oflownet13 import *
+
+"""
+Tests of the OpenFlow 1.3 codec: OXM TLVs and matches, packed then
+parsed back. Run with
+python -m unittest test_oflownet13
+"""
+
+def random_value(rng, n):
+    size = OXM_Fields[n][1]
+    if n in ('eth_src', 'eth_dst'):
+        return ''.join([chr(rng.randint(0, 255)) for i in range(size)])
+    return rng.getrandbits(8*size)
+
+class OXMTest(unittest.TestCase):
+    """ pack_oxm/unpack_oxm and OXM_Match """
+
+    def setUp(self):
+        self.rng = random.Random(1818)
+
+    def test_tlv(self):
+        buf = bytearray(4 + 2*6)
+        self.assertEqual(8, pack_oxm(buf, 0, 'in_port', 3))
+        self.assertEqual('\x80\x00\x00\x04\x00\x00\x00\x03', str(buf[:8]))
+        self.assertEqual(8, pack_oxm(buf, 0, 'vlan_vid', OFPVID_PRESENT | 5, 0x1fff))
+        self.assertEqual('\x80\x00\x0d\x04\x10\x05\x1f\xff', str(buf[:8]))
+
+    def test_round_trip(self):
+        for n in sorted(OXM_Fields):
+            for i in range(20):
+                v = random_value(self.rng, n)
+                mask = random_value(self.rng, n) if i % 2 else None
+                buf = bytearray(4 + 2*OXM_Fields[n][1])
+                end = pack_oxm(buf, 0, n, v, mask)
+                self.assertEqual((n, v, mask, end), unpack_oxm(buf, 0))
+
+    def test_unknown_field(self):
+        # experimenter class, then a known field
+        buf = bytearray(struct.pack('>HBBI', 0xffff, 2, 4, 42)) + bytearray(8)
+        pack_oxm(buf, 8, 'ip_proto', 17)
+        self.assertEqual((None, None, None, 8), unpack_oxm(buf, 0))
+        self.assertEqual(('ip_proto', 17, None, 13), unpack_oxm(buf, 8))
+
+    def test_match(self):
+        ofp_match = OXM_Match()
+        self.assertEqual('\x00\x01\x00\x04\x00\x00\x00\x00', ofp_match.pack())
+        names = sorted(OXM_Fields)
+        for i in range(50):
+            ofp_match = OXM_Match()
+            fields = []
+            for n in self.rng.sample(names, self.rng.randint(1, len(names))):
+                mask = random_value(self.rng, n) if self.rng.random() < 0.3 else None
+                fields.append((n, random_value(self.rng, n), mask))
+                ofp_match.set(*fields[-1])
+            data = ofp_match.pack()
+            self.assertEqual(0, len(data) % 8)
+            self.assertEqual(len(data), ofp_match.length)
+
+            # followed by other bytes, as in a flow stats entry
+            parsed = OXM_Match()
+            parsed.unpack_from(data + '\xff'*8)
+            self.assertEqual(fields, parsed.fields)
+            self.assertEqual(ofp_match.length, parsed.length)
+            for n, v, mask in fields:
+                self.assertEqual(v, parsed.get(n))
+
+    def test_set_replaces(self):
+        ofp_match = OXM_Match()
+        ofp_match.set('eth_type', 0x0800)
+        ofp_match.set('ip_proto', 6)
+        ofp_match.set('eth_type', 0x86dd)
+        self.assertEqual([('ip_proto', 6, None), ('eth_type', 0x86dd, None)], ofp_match.fields)
+        self.assertEqual(16, ofp_match.length)
+
+    def test_invalid_match(self):
+        self.assertRaises(RuntimeError, OXM_Match().unpack_from, struct.pack('>HH4x', 0, 4))
+        self.assertRaises(RuntimeError, OXM_Match().unpack_from, struct.pack('>HH4x', OFPMT_OXM, 2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import os, random, tempfile, unittest
+from probeid import *
+
+"""
+Tests of the probe identifiers: the split of the ids across the IP and
+transport headers, and the index of the allocated blocks. Run with
+python -m unittest test_probeid
+"""
+
+class ProbeIdTest(unittest.TestCase):
+    """ split and join """
+
+    def test_round_trip(self):
+        rng = random.Random(2424)
+        pids = [0, 1, 0xffff, 0x10000, 0x12345678, MAX_PROBES-1] + [rng.getrandbits(32) for i in range(1000)]
+        for pid in pids:
+            ipid, tid = split(pid)
+            self.assertTrue(0 <= ipid <= 0xffff and 0 <= tid <= 0xffff, hex(pid))
+            self.assertEqual(pid, join(ipid, tid))
+        self.assertEqual((0x1234, 0x5678), split(0x12345678))
+
+class ProbeIndexTest(unittest.TestCase):
+    """ ProbeIndex and ProbeAllocator """
+
+    def setUp(self):
+        self.index = ProbeIndex()
+        # (first, count, gcid, src, dst), with a gap before the last block
+        self.blocks = [(0, 10, 1, 3, 4), (10, 1, 1, 3, 5), (11, 5, 2, 4, 3), (100, 20, 7, 9, 3)]
+        for b in self.blocks:
+            self.index.add(*b)
+
+    def expected(self, pid):
+        for first, count, gcid, src, dst in self.blocks:
+            if first <= pid < first + count:
+                return (gcid, src, dst)
+        return None
+
+    def test_lookup(self):
+        self.assertEqual(36, len(self.index))
+        for pid in range(130):
+            self.assertEqual(self.expected(pid), self.index.lookup(pid), pid)
+            b = self.expected(pid)
+            self.assertEqual(b[0] if b is not None else None, self.index.gcid(pid))
+
+    def test_empty(self):
+        self.assertEqual(None, ProbeIndex().lookup(0))
+        self.assertEqual(None, ProbeIndex().gcid(42))
+
+    def test_overlap(self):
+        self.assertRaises(RuntimeError, self.index.add, 119, 2, 1, 1, 2)
+        self.index.add(120, 1, 1, 1, 2)
+
+    def test_save_load(self):
+        fd, fname = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            self.index.save(fname)
+            index = ProbeIndex(fname)
+        finally:
+            os.remove(fname)
+        self.assertEqual(len(self.index), len(index))
+        for pid in range(130):
+            self.assertEqual(self.expected(pid), index.lookup(pid), pid)
+
+    def test_allocator(self):
+        runs = []
+        for k in range(2):
+            probes = ProbeAllocator()
+            runs.append([probes.allocate(gcid, 3, 4, count) for gcid, count in [(1, 5), (2, 1), (1, 7)]])
+        self.assertEqual([0, 5, 6], runs[0])
+        self.assertEqual(runs[0], runs[1])
+        self.assertEqual(13, len(probes.index))
+        self.assertEqual((2, 3, 4), probes.index.lookup(5))
+        self.assertEqual(None, probes.index.lookup(13))
+
+    def test_exhausted(self):
+        probes = ProbeAllocator(MAX_PROBES - 10)
+        self.assertEqual(MAX_PROBES - 10, probes.allocate(1, 2, 3, 10))
+        self.assertRaises(RuntimeError, probes.allocate, 1, 2, 3, 1)
+
+if __name__ == "__main__":
+    unittest.main()
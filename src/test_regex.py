@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import random, unittest
+from regex import *
+
+"""
+Regression tests of the path expression compilation. Every automaton is
+checked against a direct simulation of the Thompson NFA of the
+expression, or against FSM.process for the compiled tables, on random
+expressions (switches, dots, classes, unions, Kleene stars and bounded
+repetitions) and random paths, some of them through switches the
+expressions do not name. Run with
+python -m unittest test_regex
+"""
+
+SWITCHES = 6
+
+def nfa_accepts(nfa, path):
+    """ True if the Thompson NFA @nfa (with epsilon edges) accepts @path """
+    def closure(states):
+        todo = list(states)
+        states = set(states)
+        while todo:
+            q = todo.pop()
+            for t in nfa.states.get(q, {}).get(FSM.epsilon, []):
+                if t not in states:
+                    states.add(t)
+                    todo.append(t)
+        return states
+
+    cur = closure([0])
+    for sym in path:
+        nxt = set()
+        for q in cur:
+            for label, targets in nfa.states.get(q, {}).iteritems():
+                if label == sym or label == FSM.dot or (type(label) is frozenset and sym in label):
+                    nxt.update(targets)
+        cur = closure(nxt)
+        if not cur:
+            return False
+    return not cur.isdisjoint(nfa.accepting)
+
+def thompson(expr):
+    p = RegexParser()
+    return p.translate_ast(p.parse(expr))
+
+def random_atom(rng):
+    r = rng.random()
+    if r < 0.15:
+        return '.'
+    if r < 0.3:
+        lo = rng.randint(1, SWITCHES-1)
+        return '[s%d-s%d]' % (lo, rng.randint(lo, SWITCHES-1))
+    return 's%d' % (rng.randint(1, SWITCHES-2))
+
+def random_expr(rng, n):
+    out = []
+    for i in range(n):
+        if out:
+            out.append('|' if rng.random() < 0.2 else ',')
+        out.append(random_atom(rng))
+        r = rng.random()
+        if r < 0.2:
+            out.append('*')
+        elif r < 0.3:
+            m = rng.randint(0, 2)
+            out.append('{%d,%d}' % (m, rng.randint(max(m, 1), 3)))
+    return ''.join(out)
+
+def random_path(rng):
+    # s<SWITCHES> is never named by the expressions, only matched by dots
+    return ['s%d' % (rng.randint(1, SWITCHES)) for i in range(rng.randint(0, 8))]
+
+class DeterminizationTest(unittest.TestCase):
+    """ The automata of the expressions against their Thompson NFA """
+
+    def setUp(self):
+        self.rng = random.Random(4242)
+        self.exprs = [random_expr(self.rng, self.rng.randint(1, 6)) for i in range(150)]
+        self.paths = [random_path(self.rng) for i in range(150)]
+
+    def check(self, expr, matcher):
+        nfa = thompson(expr)
+        for path in self.paths:
+            self.assertEqual(nfa_accepts(nfa, path), matcher(path) is not None, '%s on %s' % (expr, ','.join(path)))
+
+    def test_to_dfa(self):
+        for expr in self.exprs:
+            dfa = RegexParser().create_fsm(expr, minimize=False)
+            self.check(expr, dfa.process)
+
+    def test_minimize(self):
+        for expr in self.exprs:
+            dfa = RegexParser().create_fsm(expr)
+            self.check(expr, dfa.process)
+            self.assertTrue(len(dfa.states) <= len(RegexParser().create_fsm(expr, minimize=False).states), expr)
+
+    def test_glushkov(self):
+        for expr in self.exprs:
+            dfa = RegexParser().create_fsm(expr, method=RegexParser.GLUSHKOV)
+            self.check(expr, dfa.process)
+
+    def test_lazy(self):
+        for expr in self.exprs:
+            lazy = RegexParser().create_fsm(expr, max_states=0)
+            self.assertTrue(isinstance(lazy, LazyDFA))
+            self.check(expr, lazy.process)
+
+    def test_lazy_eviction(self):
+        for expr in self.exprs[:30]:
+            nfa = thompson(expr)
+            nfa.remove_epsilon()
+            self.check(expr, LazyDFA(nfa, cache_size=2).process)
+
+    def test_remove_epsilon(self):
+        for expr in self.exprs:
+            nfa = thompson(expr)
+            nfa.remove_epsilon()
+            for q in nfa.states:
+                self.assertFalse(FSM.epsilon in nfa.states[q], expr)
+            self.check(expr, lambda path: True if nfa_accepts(nfa, path) else None)
+
+    def test_classes_and_bounds(self):
+        dfa = RegexParser().create_fsm('s1,[s2-s4,s6]{1,2},s5')
+        self.assertNotEqual(dfa.process(['s1', 's3', 's5']), None)
+        self.assertNotEqual(dfa.process(['s1', 's6', 's2', 's5']), None)
+        self.assertEqual(dfa.process(['s1', 's5']), None)
+        self.assertEqual(dfa.process(['s1', 's5', 's5']), None)
+        self.assertEqual(dfa.process(['s1', 's2', 's3', 's4', 's5']), None)
+        dfa = RegexParser().create_fsm('s1{2}')
+        self.assertNotEqual(dfa.process(['s1', 's1']), None)
+        self.assertEqual(dfa.process(['s1']), None)
+        self.assertEqual(dfa.process(['s1', 's1', 's1']), None)
+
+    def test_dot_merged_into_symbols(self):
+        # the s1 edge of the subset construction also follows the dot target
+        dfa = RegexParser().create_fsm('.*,s1,s2', minimize=False)
+        self.assertNotEqual(dfa.process(['s1', 's1', 's2']), None)
+        self.assertNotEqual(dfa.process(['s3', 's1', 's2']), None)
+        self.assertEqual(dfa.process(['s1', 's2', 's3']), None)
+        self.assertEqual(dfa.process(['s2']), None)
+
+    def test_multi(self):
+        for k in range(0, len(self.exprs), 10):
+            exprs = self.exprs[k:k+10]
+            matchers = []
+            for i, expr in enumerate(exprs):
+                if i % 2:
+                    matchers.append(RegexParser().create_fsm(expr, max_states=0))
+                else:
+                    matchers.append(RegexParser().create_fsm(expr).compile())
+            mdfa = MultiDFA(matchers, range(len(exprs)), cache_size=16)
+            nfas = [thompson(expr) for expr in exprs]
+            for path, labels in zip(self.paths, mdfa.process_many(self.paths)):
+                expected = frozenset([i for i, nfa in enumerate(nfas) if nfa_accepts(nfa, path)])
+                self.assertEqual(expected, labels, ','.join(path))
+
+class ParserTest(unittest.TestCase):
+    """ Errors of RegexParser.parse """
+
+    def test_invalid(self):
+        for expr in ['', '*', 's1||s2', '{2}', 's1|', 's1|*', 's1|{2}', '(s1', '[s1', 's1{3,1}']:
+            self.assertRaises(RuntimeError, RegexParser().parse, expr)
+
+    def test_list(self):
+        expr = 's1,[s2-s4]{1,2},s5|s6*'
+        dfa = RegexParser().create_fsm(expr)
+        ldfa = RegexParser().create_fsm(list(expr))
+        for path in [['s1', 's3', 's5'], ['s1', 's2', 's4', 's6', 's6'], ['s1', 's5'], ['s1', 's2', 's3', 's4']]:
+            self.assertEqual(dfa.process(path) is None, ldfa.process(path) is None, ','.join(path))
+
+    def test_position(self):
+        try:
+            RegexParser().parse('s1,s2||s3')
+        except RuntimeError, e:
+            self.assertTrue('position 6' in str(e), str(e))
+        else:
+            self.fail('s1,s2||s3 parsed')
+
+class CompiledDFATest(unittest.TestCase):
+    """ CompiledDFA.process and process_many against FSM.process """
+
+    def setUp(self):
+        self.rng = random.Random(4343)
+        self.exprs = [random_expr(self.rng, self.rng.randint(1, 6)) for i in range(150)]
+        self.paths = [random_path(self.rng) for i in range(150)]
+        self.limit = CompiledDFA.DENSE_LIMIT
+
+    def tearDown(self):
+        CompiledDFA.DENSE_LIMIT = self.limit
+
+    def check(self, dfa, cdfa):
+        expected = [dfa.process(path) for path in self.paths]
+        self.assertEqual(expected, cdfa.process_many(self.paths))
+        self.assertEqual(expected, [cdfa.process(path) for path in self.paths])
+
+    def test_dense(self):
+        for expr in self.exprs:
+            dfa = RegexParser().create_fsm(expr)
+            cdfa = dfa.compile()
+            self.assertTrue(cdfa.dense)
+            self.check(dfa, cdfa)
+
+    def test_sparse(self):
+        CompiledDFA.DENSE_LIMIT = 0
+        for expr in self.exprs:
+            dfa = RegexParser().create_fsm(expr, minimize=False)
+            cdfa = dfa.compile()
+            self.assertFalse(cdfa.dense)
+            self.check(dfa, cdfa)
+
+    def test_dumps(self):
+        for limit in (self.limit, 0):
+            CompiledDFA.DENSE_LIMIT = limit
+            for expr in self.exprs[:50]:
+                dfa = RegexParser().create_fsm(expr)
+                self.check(dfa, CompiledDFA.loads(dfa.compile().dumps()))
+
+    def test_fsm_process_many(self):
+        for expr in self.exprs[:50]:
+            dfa = RegexParser().create_fsm(expr)
+            self.assertEqual([dfa.process(path) for path in self.paths], dfa.process_many(self.paths))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""
+@author: David Lebrun <dav.lebrun@gmail.com>
+"""
+
+import random, struct, unittest
+from templates import *
+
+"""
+Tests of the probe templates: the packets built by ProbeTemplate.build
+against their fields and a full IP header checksum. Run with
+python -m unittest test_templates
+"""
+
+def ip_header(proto, length, options='', tos=0, ttl=64):
+    ihl = 5 + len(options)/4
+    return struct.pack('>BBHHHBBH4s4s', 0x40 | ihl, tos, length, 0, 0x4000, ttl, proto, 0, '\0'*4, '\0'*4) + options
+
+def probe(proto, options='', payload='x'*16):
+    """ Placeholder Ethernet/IPv4 probe of @proto, as serialized by scapy """
+    if proto == 1:
+        l4 = struct.pack('>BBHHH', 8, 0, 0x4242, 0, 1) + payload
+    elif proto == 6:
+        l4 = struct.pack('>HHIIBBHHH', 0, 80, 0, 0, 0x50, 2, 8192, 0x4242, 0) + payload
+    else:
+        l4 = struct.pack('>HHHH', 0, 64242, 8+len(payload), 0x4242) + payload
+    ip = ip_header(proto, 20+len(options)+len(l4), options)
+    return '\0'*12 + '\x08\x00' + ip + l4
+
+def checksum(data):
+    s = sum(struct.unpack('>%dH' % (len(data)/2), data))
+    while s >> 16:
+        s = (s & 0xffff) + (s >> 16)
+    return s
+
+class ProbeTemplateTest(unittest.TestCase):
+    """ ProbeTemplate.build on random addresses and identifiers """
+
+    def setUp(self):
+        self.rng = random.Random(2323)
+
+    def random_fields(self):
+        smac = ''.join([chr(self.rng.randint(0, 255)) for i in range(6)])
+        dmac = ''.join([chr(self.rng.randint(0, 255)) for i in range(6)])
+        sip = ip_bytes('10.%d.%d.%d' % tuple([self.rng.randint(0, 255) for i in range(3)]))
+        dip = struct.pack('>I', self.rng.getrandbits(32))
+        return smac, dmac, sip, dip, self.rng.getrandbits(16), self.rng.getrandbits(16)
+
+    def check(self, data, id_offset):
+        template = ProbeTemplate(data)
+        ihl = (ord(data[ETH_LEN]) & 0x0f)*4
+        for i in range(500):
+            smac, dmac, sip, dip, ipid, tid = self.random_fields()
+            pkt = template.build(smac, dmac, sip, dip, ipid, tid)
+            self.assertEqual(len(data), len(pkt))
+            self.assertEqual((dmac, smac), (pkt[0:6], pkt[6:12]))
+            self.assertEqual(ipid, struct.unpack_from('>H', pkt, ETH_LEN+4)[0])
+            self.assertEqual((sip, dip), (pkt[ETH_LEN+12:ETH_LEN+16], pkt[ETH_LEN+16:ETH_LEN+20]))
+            self.assertEqual(tid, struct.unpack_from('>H', pkt, id_offset)[0])
+
+            # valid header checksum, the other bytes as in the template
+            self.assertEqual(0xffff, checksum(pkt[ETH_LEN:ETH_LEN+ihl]))
+            for k in range(len(data)):
+                if k < 12 or ETH_LEN+4 <= k < ETH_LEN+6 or ETH_LEN+10 <= k < ETH_LEN+20 or id_offset <= k < id_offset+2:
+                    continue
+                self.assertEqual(data[k], pkt[k], 'byte %d' % (k))
+
+    def test_udp(self):
+        self.check(probe(17), ETH_LEN+20)
+
+    def test_tcp(self):
+        self.check(probe(6), ETH_LEN+20)
+
+    def test_icmp(self):
+        self.check(probe(1), ETH_LEN+24)
+
+    def test_options(self):
+        # a header of 24 bytes, with tos and ttl words summed from the template
+        data = probe(17, '\x94\x04\x00\x00')
+        data = data[:ETH_LEN+1] + '\xb8' + data[ETH_LEN+2:ETH_LEN+8] + '\x07' + data[ETH_LEN+9:]
+        self.check(data, ETH_LEN+24)
+
+    def test_carry(self):
+        # destination addresses chosen so that the header sum still
+        # carries after one fold: 0x<k>ffff with k >= 1
+        data = probe(17)
+        template = ProbeTemplate(data)
+        n = 0
+        while n < 50:
+            smac, dmac, sip, _, ipid, tid = self.random_fields()
+            hdr = data[ETH_LEN:ETH_LEN+4] + struct.pack('>H', ipid) + data[ETH_LEN+6:ETH_LEN+10] + '\0\0' + sip
+            rest = sum(struct.unpack('>8H', hdr))
+            if rest & 0xffff == 0:
+                continue
+            diff = 0x1ffff - (rest & 0xffff)
+            dip = struct.pack('>HH', 0xffff, diff - 0xffff)
+            pkt = template.build(smac, dmac, sip, dip, ipid, tid)
+            self.assertEqual(0xffff, checksum(pkt[ETH_LEN:ETH_LEN+20]))
+            n += 1
+
+    def test_mac_ip_bytes(self):
+        self.assertEqual('\x00\x1b\x21\xaa\x0f\xff', mac_bytes('00:1b:21:aa:0f:ff'))
+        self.assertEqual('\x0a\x00\x01\xfe', ip_bytes('10.0.1.254'))
+
+    def test_invalid(self):
+        udp = probe(17)
+        self.assertRaises(RuntimeError, ProbeTemplate, udp[:12] + '\x86\xdd' + udp[14:])
+        self.assertRaises(RuntimeError, ProbeTemplate, udp[:ETH_LEN+19])
+        ipv4 = udp[:ETH_LEN] + ip_header(47, 20)
+        self.assertRaises(RuntimeError, ProbeTemplate, ipv4)
+        self.assertRaises(RuntimeError, ProbeTemplate, udp[:ETH_LEN+21])
+
+if __name__ == "__main__":
+    unittest.main()